@@ -0,0 +1,80 @@
+"""
+Checks that concatenating batches of parsed emails with concat_message_batches gives the same
+DataFrame whatever the batch size, and compares it with a plain pd.concat of the batches, whose
+threading is cut at the batch boundaries and whose categorical columns fall back to objects.
+
+The emails are synthetic threads in shuffled order, like the folders of a mailbox, each batch
+gets its threading and domain columns as PSTExtractor.process_batch adds them, and the result
+of every batch size is asserted equal to the result of a single batch.
+
+Usage:
+    python -m src.benchmarks.batch_concat --count 200000 --batch-sizes 100 1000 10000
+"""
+
+import argparse
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from src.benchmarks.domain_parsing import make_addresses
+from src.benchmarks.response_time import make_messages
+from src.extract.parsing_utils import concat_message_batches, parse_domain_info, parse_email_threading
+
+
+def make_batches(df: pd.DataFrame, batch_size: int) -> List[pd.DataFrame]:
+    """
+    Splits the emails into batches with their threading and domain columns, as parsed by PSTExtractor.
+
+    Args:
+        df (pd.DataFrame): The emails.
+        batch_size (int): The maximum number of emails in each batch.
+
+    Returns:
+        List[pd.DataFrame]: The batches.
+    """
+    return [
+        parse_domain_info(parse_email_threading(df.iloc[start : start + batch_size].reset_index(drop=True)))
+        for start in range(0, len(df), batch_size)
+    ]
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=200_000, help="number of synthetic emails")
+    arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000, 10_000])
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    messages = make_messages(args.count, seed=args.seed)[["message_id", "previous_message_id"]]
+    addresses = make_addresses(args.count, seed=args.seed).drop(columns="message_id")
+    df = pd.concat([messages, addresses], axis=1)
+    df = df.sample(frac=1, random_state=args.seed).reset_index(drop=True)
+    expected = concat_message_batches(make_batches(df, len(df)))
+    columns = ["first_in_thread", "num_previous_messages", "thread_id", "sender_domain", "all_domains"]
+
+    print(f"Emails: {args.count:,}")
+    for batch_size in args.batch_sizes:
+        batches = make_batches(df, batch_size)
+        start = time.perf_counter()
+        naive = pd.concat(batches, ignore_index=True)
+        naive_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = concat_message_batches(batches)
+        unioned_seconds = time.perf_counter() - start
+
+        pd.testing.assert_frame_equal(actual, expected)
+        naive_mismatches = int((naive[columns].astype(str) != expected[columns].astype(str)).any(axis=1).sum())
+        naive_bytes = naive[columns].memory_usage(deep=True, index=False).sum()
+        unioned_bytes = actual[columns].memory_usage(deep=True, index=False).sum()
+        print(
+            f"Batch size {batch_size:>7,}: identical to a single batch in {unioned_seconds:.2f}s, "
+            f"{unioned_bytes / 2**20:.1f} MiB; pd.concat {naive_seconds:.2f}s, {naive_bytes / 2**20:.1f} MiB, "
+            f"{naive_mismatches:,} rows threaded differently, "
+            f"sender_domain {naive['sender_domain'].dtype}"
+        )
+
+
+if __name__ == "__main__":
+    main()
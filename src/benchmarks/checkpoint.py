@@ -0,0 +1,94 @@
+"""
+Benchmarks Parquet checkpoints against the previous CSV round trip, on messages with long
+HTML bodies and embedding lists, including a projected pull of one day of messages.
+
+Usage:
+    python -m src.benchmarks.checkpoint --count 100000
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.utils.checkpoint import DataFrameCheckpointer
+
+
+def make_messages(count: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Builds messages with the heavy columns of the pipeline checkpoints.
+
+    Args:
+        count (int): The number of messages.
+        seed (int): The random seed.
+
+    Returns:
+        pd.DataFrame: The messages, in submit_time order.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array("account card transfer branch loan payment balance statement".split())
+    bodies = [" ".join(words[rng.integers(0, len(words), 300)]) for _ in range(1000)]
+    return pd.DataFrame(
+        {
+            "message_id": [f"<{i}@bench.example>" for i in range(count)],
+            "submit_time": pd.date_range("2024-01-01", periods=count, freq="5min", tz="UTC"),
+            "is_spam": rng.random(count) < 0.1,
+            "html_body": [f"<html><body><p>{bodies[i % len(bodies)]}</p></body></html>" for i in range(count)],
+            "clean_text": [bodies[i % len(bodies)] for i in range(count)],
+            "embedding": list(rng.random((count, 384), dtype=np.float32)),
+        }
+    )
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=100_000, help="number of synthetic messages")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    df = make_messages(args.count, seed=args.seed)
+    day = df["submit_time"].iloc[len(df) // 2].floor("D")
+    with tempfile.TemporaryDirectory() as checkpoint_path:
+        checkpointer = DataFrameCheckpointer(checkpoint_path)
+        csv_path = f"{checkpoint_path}/messages_csv.csv"
+
+        start = time.perf_counter()
+        df.to_csv(csv_path, index=False)
+        csv_save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        pd.read_csv(csv_path)
+        csv_pull_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        checkpointer.save("messages", df)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        pulled = checkpointer.pull("messages")
+        pull_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        one_day = checkpointer.pull(
+            "messages", columns=["message_id", "submit_time"], since=day, until=day + pd.Timedelta("1D")
+        )
+        projected_seconds = time.perf_counter() - start
+
+        same_dtypes = (pulled.dtypes.astype(str) == df.dtypes.astype(str)).sum()
+        print(f"Messages:        {args.count:,}")
+        print(
+            f"CSV:             {os.path.getsize(csv_path) / 2**20:,.0f} MiB, "
+            f"saved in {csv_save_seconds:.2f}s, pulled in {csv_pull_seconds:.2f}s"
+        )
+        print(
+            f"Parquet:         {os.path.getsize(f'{checkpoint_path}/messages.parquet') / 2**20:,.0f} MiB, "
+            f"saved in {save_seconds:.2f}s, pulled in {pull_seconds:.2f}s"
+        )
+        print(f"One day, 2 cols: {len(one_day):,} rows pulled in {projected_seconds:.3f}s")
+        print(f"Dtypes kept:     {same_dtypes} of {len(df.columns)} columns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmarks the compiled TextCleaner against the previous clean_text, which recompiled its
+patterns through the re cache on every call, and checks that both produce the same texts.
+
+Usage:
+    python -m src.benchmarks.clean_text --count 100000
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import Optional
+
+import pandas as pd
+
+from src.transform.text_cleaning import DISCLAIMERS, TextCleaner
+
+WORDS = "account card transfer branch loan payment balance statement please kindly request customer".split()
+ARABIC_WORDS = "حساب بطاقة تحويل فرع قرض دفع رصيد كشف".split()
+TAILS = [
+    "\r\n\r\n-----Original Message-----\r\nFrom: QIB <info@qib.com.qa>\r\nSent: Monday\r\n\r\n{quote}",
+    "\n\nOn Mon, 1 Jan 2024 at 10:00, QIB <info@qib.com.qa> wrote:\n> {quote}",
+    "\n\n________________________________\nFrom: Customer Service\nSent: Sunday\n{quote}",
+    "\n-- \nJohn Doe | Relationship Manager | +974 4444 0000",
+    "\n\nSent from my iPhone",
+    "",
+]
+
+
+def make_text(rng: random.Random) -> str:
+    """
+    Builds an email body with a disclaimer, pipes, dashes, and a quote or signature tail.
+
+    Args:
+        rng (random.Random): The random generator.
+
+    Returns:
+        str: The email body.
+    """
+    words = rng.choice([WORDS, ARABIC_WORDS])
+    lines = [" ".join(rng.choices(words, k=rng.randint(3, 15))) for _ in range(rng.randint(1, 8))]
+    if rng.random() < 0.3:
+        lines.insert(0, rng.choice(DISCLAIMERS))
+    if rng.random() < 0.2:
+        lines.append("Reference | 12-34-56 | \t pending")
+    quote = "\n> ".join(" ".join(rng.choices(WORDS, k=10)) for _ in range(rng.randint(2, 30)))
+    return "\r\n".join(lines) + rng.choice(TAILS).format(quote=quote)
+
+
+def clean_text_by_call(text: Optional[str]) -> str:
+    """The previous implementation of clean_text."""
+    if not text or not isinstance(text, str):
+        return ""
+    parts = re.split(
+        r"^-- \n.*|^--\n.*|^-----Original Message-----.*$|^________________________________.*$|^On .* wrote:.*|^From: .*|^Sent from my iPhone.*$",
+        text,
+        flags=re.MULTILINE | re.DOTALL,
+        maxsplit=1,
+    )
+
+    text = parts[0].strip() if len(parts) > 1 else text
+    text = re.sub(r"[\n\r\t| -]+", " ", text, flags=re.MULTILINE)
+    caution_notes = [
+        r"CAUTION: This email originated from outside QIB. Do not click any links or open attachments unless you are sure of the safety of the contents.",
+        r"""CAUTION: This email originated from outside of the organization. Do not click links or open attachments unless you recognize the sender and know the content is safe""",
+    ]
+    for caution_note in caution_notes:
+        text = re.sub(caution_note, "", text)
+
+    text = "\n".join([line for line in text.split("\n") if line.strip()])
+    return text
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=100_000, help="number of synthetic email bodies")
+    arg_parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to the CPUs")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = pd.Series([make_text(rng) for _ in range(args.count)] + [None, "", "  \n ", float("nan")])
+
+    start = time.perf_counter()
+    expected = texts.map(clean_text_by_call)
+    call_seconds = time.perf_counter() - start
+
+    cleaner = TextCleaner()
+    start = time.perf_counter()
+    serial = texts.map(cleaner.clean)
+    serial_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    parallel = cleaner.clean_series(texts, num_processes=args.processes)
+    parallel_seconds = time.perf_counter() - start
+
+    print(f"Texts:               {len(texts):,}")
+    print(f"Mismatches:          {int((serial != expected).sum())} serial, {int((parallel != expected).sum())} pooled")
+    print(f"Previous clean_text: {call_seconds:.2f}s")
+    print(f"TextCleaner:         {serial_seconds:.2f}s")
+    print(f"TextCleaner, pooled: {parallel_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
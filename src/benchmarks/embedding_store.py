@@ -0,0 +1,75 @@
+"""
+Benchmarks reading embeddings for clustering from an EmbeddingStore against the previous
+list column, merged by message_id and rebuilt into an array, reporting the peak memory
+allocated by each.
+
+Usage:
+    python -m src.benchmarks.embedding_store --count 30000 --dimension 384
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.database.embedding_store import EmbeddingStore
+
+
+def measure(function: Callable[[], np.ndarray]) -> Tuple[np.ndarray, float, float]:
+    """
+    Runs a function, measuring its time and the peak memory it allocates.
+
+    Args:
+        function (Callable[[], np.ndarray]): The function.
+
+    Returns:
+        Tuple[np.ndarray, float, float]: The result, the seconds and the peak MiB allocated.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=30_000, help="number of synthetic embeddings")
+    arg_parser.add_argument("--dimension", type=int, default=384)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    message_ids = [f"<{i}@bench.example>" for i in range(args.count)]
+    embeddings = rng.standard_normal((args.count, args.dimension), dtype=np.float32)
+    message_df = pd.DataFrame({"message_id": message_ids, "clean_text": "text"})
+
+    def _list_column() -> np.ndarray:
+        embedding_df = pd.DataFrame({"message_id": message_ids, "embeddings": embeddings.tolist()})
+        df_with_embeddings = pd.merge(message_df, embedding_df, on="message_id")
+        return np.asarray(df_with_embeddings["embeddings"].tolist())
+
+    with tempfile.TemporaryDirectory() as store_path:
+        embedding_store = EmbeddingStore(store_path)
+        embedding_store.add(message_ids, embeddings)
+
+        list_matrix, list_seconds, list_peak = measure(_list_column)
+        store_matrix, store_seconds, store_peak = measure(lambda: embedding_store.get(message_df["message_id"]))
+        sample_ids = message_df["message_id"].sample(frac=0.1, random_state=args.seed)
+        _, sample_seconds, sample_peak = measure(lambda: embedding_store.get(sample_ids))
+
+        print(f"Embeddings:      {args.count:,} x {args.dimension}")
+        print(f"List column:     {list_seconds:.2f}s, {list_peak:,.0f} MiB peak, {list_matrix.dtype}")
+        print(f"Store, all rows: {store_seconds:.2f}s, {store_peak:,.0f} MiB peak, {type(store_matrix).__name__}")
+        print(f"Store, 10% rows: {sample_seconds:.2f}s, {sample_peak:,.0f} MiB peak")
+        print(f"Same values:     {np.allclose(list_matrix, store_matrix)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmarks the transport header scanner against the stdlib HeaderParser path.
+
+Usage:
+    python -m src.benchmarks.header_parsing --count 20000
+"""
+
+import argparse
+import random
+import time
+from email.parser import HeaderParser
+from typing import Any, Callable, Dict, List
+
+from src.extract.parsing_utils import charset_from_content_type, parse_addresses, parse_identifiers
+from src.extract.pst_parsing_utils import TRANSPORT_HEADER_FIELDS, scan_headers
+
+DOMAINS = ["gmail.com", "hotmail.com", "qib.com.qa", "outlook.com", "yahoo.com", "ooredoo.qa"]
+
+
+def make_headers(i: int, rng: random.Random) -> str:
+    """
+    Builds a realistic Outlook transport header block with folded and encoded values.
+
+    Args:
+        i (int): The index of the message, used to make unique identifiers.
+        rng (random.Random): The random generator.
+
+    Returns:
+        str: The raw header block.
+    """
+    sender = f"user{rng.randint(0, 5000)}@{rng.choice(DOMAINS)}"
+    references = [f"<ref{i}.{j}@{rng.choice(DOMAINS)}>" for j in range(rng.randint(0, 6))]
+    recipients = [f"Person {j} <p{j}@{rng.choice(DOMAINS)}>" for j in range(rng.randint(1, 4))]
+
+    lines = [
+        f"Received: from mail{j}.{rng.choice(DOMAINS)} (10.0.0.{j}) by mx.qib.com.qa with SMTP id {i}.{j};\r\n"
+        f"\tMon, 1 Jan 2024 10:{j:02d}:00 +0300"
+        for j in range(rng.randint(2, 8))
+    ]
+    lines += [
+        "X-MS-Exchange-Organization-AuthSource: mx.qib.com.qa",
+        "X-MS-Has-Attach: " + rng.choice(["yes", ""]),
+        "From: " + (f"=?utf-8?B?2YXYrdmF2K8=?= <{sender}>" if i % 3 else f'"Customer, {i}" <{sender}>'),
+        "To: " + ",\r\n\t".join(recipients),
+        f"CC: info@qib.com.qa" if i % 4 == 0 else "X-Spam-Score: 0",
+        f"Subject: =?windows-1256?Q?=C7=E1=D3=E1=C7=E3?= {i}",
+        "Date: Mon, 1 Jan 2024 10:00:00 +0300",
+        f"Message-ID: <msg{i}@{sender.split('@')[1]}>",
+    ]
+    if references:
+        lines.append(f"In-Reply-To: {references[-1]}")
+        lines.append("References: " + "\r\n ".join(references))
+    lines += [
+        "Content-Type: multipart/alternative;\r\n\tboundary=\"_000_boundary_\";\r\n\tcharset=" + rng.choice(["utf-8", "windows-1256", "iso-8859-1"]),
+        "MIME-Version: 1.0",
+    ]
+    rng.shuffle(lines)
+    return "\r\n".join(lines) + "\r\n\r\n"
+
+
+def stdlib_parse_headers(headers: str) -> Dict[str, Any]:
+    """The previous parse_headers implementation, on a raw header block."""
+    parsed_headers = HeaderParser().parsestr(headers)
+    return {k.lower(): v for k, v in parsed_headers.items()} if parsed_headers else {}
+
+
+def scanner_parse_headers(headers: str) -> Dict[str, Any]:
+    """The current parse_headers implementation, on a raw header block."""
+    return scan_headers(headers, TRANSPORT_HEADER_FIELDS)
+
+
+def parsed_columns(headers: Dict[str, Any]) -> Dict[str, Any]:
+    """Derives the columns PSTExtractor.parse_message builds from the headers."""
+    return {
+        "charset": charset_from_content_type(headers.get("content-type", None)),
+        "message_id": parse_identifiers(headers.get("message-id", None)),
+        "previous_message_id": parse_identifiers(headers.get("in-reply-to", None)),
+        "references": parse_identifiers(headers.get("references", None)),
+        "from_address": parse_addresses(headers.get("from", None)),
+        "to_address": parse_addresses(headers.get("to", None)),
+        "cc_address": parse_addresses(headers.get("cc", None)),
+        "bcc_address": parse_addresses(headers.get("bcc", None)),
+    }
+
+
+def time_parser(parser: Callable[[str], Dict[str, Any]], corpus: List[str], repeat: int) -> float:
+    """Returns the best time of parsing the whole corpus, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for headers in corpus:
+            parser(headers)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=20000, help="number of synthetic header blocks")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="number of timed runs, the best is reported")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_headers(i, rng) for i in range(args.count)]
+
+    mismatches = sum(
+        parsed_columns(stdlib_parse_headers(headers)) != parsed_columns(scanner_parse_headers(headers))
+        for headers in corpus
+    )
+    stdlib_seconds = time_parser(stdlib_parse_headers, corpus, args.repeat)
+    scanner_seconds = time_parser(scanner_parse_headers, corpus, args.repeat)
+
+    print(f"Header blocks:     {args.count}")
+    print(f"Column mismatches: {mismatches}")
+    print(f"HeaderParser:      {stdlib_seconds:.3f}s ({args.count / stdlib_seconds:,.0f} blocks/s)")
+    print(f"scan_headers:      {scanner_seconds:.3f}s ({args.count / scanner_seconds:,.0f} blocks/s)")
+    print(f"Speedup:           {stdlib_seconds / scanner_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmarks fill_plain_text_body against converting every HTML body with html2text, on
+synthetic emails where campaign and notification bodies repeat.
+
+Reports the time taken by the previous row-by-row conversion, by the deduplicated conversion
+with html2text and with the lxml fast extractor, and by a second run served from the cache.
+
+Usage:
+    python -m src.benchmarks.html_conversion --count 20000 --templates 50
+"""
+
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from src.extract.html_conversion import HTMLTextCache, html_to_text
+from src.extract.parsing_utils import fill_plain_text_body
+
+WORDS = "account card transfer branch loan payment balance statement offer customer service mobile".split()
+
+
+def make_html(rng: random.Random, paragraphs: int) -> str:
+    """
+    Builds an HTML body with styled paragraphs, line breaks and a footer table.
+
+    Args:
+        rng (random.Random): The random generator.
+        paragraphs (int): The number of paragraphs.
+
+    Returns:
+        str: The HTML body.
+    """
+    body = "".join(
+        f"<p style='font-family:Arial'>{' '.join(rng.choices(WORDS, k=40))}<br>{rng.choice(WORDS)}</p>"
+        for _ in range(paragraphs)
+    )
+    footer = "<table><tr><td>Unsubscribe</td><td>Privacy</td></tr></table>" if rng.random() < 0.5 else ""
+    return f"<html><head><style>p {{margin:0}}</style></head><body><div>{body}</div>{footer}</body></html>"
+
+
+def make_bodies(count: int, templates: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Builds emails with an HTML body only, half of them copies of a few campaign templates.
+
+    Args:
+        count (int): The number of emails.
+        templates (int): The number of distinct campaign bodies.
+        seed (int): The random seed.
+
+    Returns:
+        pd.DataFrame: The html_body and plain_text_body columns of the emails.
+    """
+    rng = random.Random(seed)
+    campaigns = [make_html(rng, 6) for _ in range(templates)]
+    bodies = [rng.choice(campaigns) if i % 2 else make_html(rng, rng.randint(1, 4)) for i in range(count)]
+    return pd.DataFrame({"html_body": bodies, "plain_text_body": None})
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=20_000, help="number of synthetic emails")
+    arg_parser.add_argument("--templates", type=int, default=50, help="number of distinct campaign bodies")
+    arg_parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to the CPUs")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    df = make_bodies(args.count, args.templates, seed=args.seed)
+    start = time.perf_counter()
+    expected = df["html_body"].map(html_to_text)
+    row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    converted = fill_plain_text_body(df.copy(), num_processes=args.processes)
+    dedup_seconds = time.perf_counter() - start
+    mismatches = int((converted["plain_text_body"] != expected).sum())
+
+    start = time.perf_counter()
+    fill_plain_text_body(df.copy(), num_processes=args.processes, fast_html=True)
+    fast_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+        cache_path = os.path.join(cache_directory, "html_cache.json")
+        cache = HTMLTextCache(cache_path)
+        fill_plain_text_body(df.copy(), cache, num_processes=args.processes)
+        cache.save()
+        start = time.perf_counter()
+        fill_plain_text_body(df.copy(), HTMLTextCache(cache_path), num_processes=args.processes)
+        cached_seconds = time.perf_counter() - start
+
+    print(f"Emails:             {args.count:,}, {df['html_body'].nunique():,} distinct bodies")
+    print(f"Row mismatches:     {mismatches}")
+    print(f"Row-by-row:         {row_seconds:.2f}s")
+    print(f"Deduplicated:       {dedup_seconds:.2f}s")
+    print(f"Deduplicated, lxml: {fast_seconds:.2f}s")
+    print(f"From a saved cache: {cached_seconds:.2f}s, loading included")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmarks IMAP extraction throughput against the local IMAP stand-in server.
+
+Compares the previous one-FETCH-per-message loop with the chunked UID FETCH pipeline of
+IMAPExtractor.fetch_emails_since_date, and with the same pipeline spread over a pool of
+connections, with a latency added to every command.
+
+Usage:
+    python -m src.benchmarks.imap_fetch --count 2000 --latency 0.02 --chunk-size 500 --connections 4
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from src.benchmarks.imap_stand_in import IMAPStandIn, make_mailboxes
+from src.extract.imap_extractor import IMAPExtractor
+
+
+def fetch_per_message(extractor: IMAPExtractor, since: datetime) -> List[Dict[str, Any]]:
+    """The previous fetch_emails_since_date, one FETCH round trip per message."""
+    result, data = extractor.imap.search(None, f'SINCE "{since.strftime("%d-%b-%Y")}"')
+    fetched_emails = []
+    for email_id in data[0].decode().split():
+        email_data = extractor.fetch_and_parse_email(email_id)
+        if email_data:
+            fetched_emails.append(email_data)
+    return fetched_emails
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=2000, help="number of synthetic messages")
+    arg_parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every IMAP command")
+    arg_parser.add_argument("--chunk-size", type=int, default=500, help="messages per UID FETCH")
+    arg_parser.add_argument("--connections", type=int, default=4, help="pooled connections")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    since = datetime(2024, 1, 1)
+    with IMAPStandIn(make_mailboxes(args.count, seed=args.seed), latency=args.latency) as server:
+        extractor = IMAPExtractor(
+            server.username, server.password, "127.0.0.1", server.port, ssl=False, fetch_chunk_size=args.chunk_size
+        )
+        extractor.imap.select("INBOX", readonly=True)
+
+        start = time.perf_counter()
+        per_message = fetch_per_message(extractor, since)
+        per_message_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunked = extractor.fetch_emails_since_date(since)
+        chunked_seconds = time.perf_counter() - start
+        extractor.close()
+
+        pooled_extractor = IMAPExtractor(
+            server.username,
+            server.password,
+            "127.0.0.1",
+            server.port,
+            ssl=False,
+            fetch_chunk_size=args.chunk_size,
+            num_connections=args.connections,
+        )
+        start = time.perf_counter()
+        pooled = pooled_extractor.fetch_folders_in_parallel(["INBOX"], since, headers_only=False)
+        pooled_seconds = time.perf_counter() - start
+        pooled_extractor.close()
+
+    mismatches = sum(a != b for a, b in zip(per_message, chunked)) + abs(len(per_message) - len(chunked))
+    mismatches += sum(a != b for a, b in zip(chunked, pooled)) + abs(len(chunked) - len(pooled))
+    print(f"Messages:          {args.count} with {args.latency * 1000:.0f}ms per command")
+    print(f"Row mismatches:    {mismatches}")
+    print(f"Per message FETCH: {per_message_seconds:.2f}s ({len(per_message) / per_message_seconds:,.0f} messages/s)")
+    print(f"Chunked UID FETCH: {chunked_seconds:.2f}s ({len(chunked) / chunked_seconds:,.0f} messages/s)")
+    print(f"Pooled UID FETCH:  {pooled_seconds:.2f}s ({len(pooled) / pooled_seconds:,.0f} messages/s)")
+    print(f"Speedup:           {per_message_seconds / chunked_seconds:.1f}x chunked, "
+          f"{per_message_seconds / pooled_seconds:.1f}x pooled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+"""
+A local, in-memory IMAP4rev1 stand-in server for benchmarking and testing the IMAP extractor.
+
+It implements the subset of IMAP the extractor uses (LOGIN, LIST, SELECT/EXAMINE, SEARCH,
+FETCH and their UID forms, and optionally ENABLE CONDSTORE) over a plain TCP socket, with a
+configurable latency added to every command to emulate a distant mail server.
+
+Usage:
+    python -m src.benchmarks.imap_stand_in --count 5000 --latency 0.05 --port 1143
+"""
+
+import argparse
+import random
+import re
+import socketserver
+import threading
+import time
+from datetime import date, datetime, timedelta
+from email import message_from_bytes
+from email.message import EmailMessage, Message
+from email.policy import compat32
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+DOMAINS = ["gmail.com", "hotmail.com", "qib.com.qa", "outlook.com", "yahoo.com", "ooredoo.qa"]
+
+CAPABILITIES = ["IMAP4rev1", "LITERAL+"]
+
+_TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()]+')
+_FETCH_ITEM = re.compile(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<[\d.]+>)?|[A-Z0-9.]+", re.IGNORECASE)
+
+
+class StoredMessage(NamedTuple):
+    uid: int
+    raw: bytes
+    internal_date: datetime
+
+
+class Mailbox:
+    """
+    A folder of the stand-in server.
+
+    Attributes:
+        uid_validity (int): The UIDVALIDITY of the folder.
+        highest_modseq (int): The HIGHESTMODSEQ of the folder, raised by every append.
+        messages (List[StoredMessage]): The messages, in UID order.
+    """
+
+    def __init__(self, raw_messages: List[bytes], uid_validity: int = 1) -> None:
+        self.uid_validity = uid_validity
+        self.highest_modseq = 1
+        self.messages: List[StoredMessage] = []
+        for raw in raw_messages:
+            self.append(raw)
+
+    @property
+    def uid_next(self) -> int:
+        return self.messages[-1].uid + 1 if self.messages else 1
+
+    def append(self, raw: bytes) -> StoredMessage:
+        """Appends a message with the next UID, dated from its Date header."""
+        date_header = message_from_bytes(raw, policy=compat32)["Date"]
+        internal_date = parsedate_to_datetime(date_header) if date_header else datetime.now()
+        message = StoredMessage(self.uid_next, raw, internal_date)
+        self.messages.append(message)
+        self.highest_modseq += 1
+        return message
+
+
+def make_message(
+    i: int, rng: random.Random, start: datetime = datetime(2024, 1, 1), attachment_size: int = 0
+) -> bytes:
+    """
+    Builds a realistic customer email with a plain text and an HTML part, replying to an
+    earlier message every few messages.
+
+    Args:
+        i (int): The index of the message, used for unique identifiers and the date.
+        rng (random.Random): The random generator.
+        start (datetime): The date of the first message; each message is a few minutes later.
+        attachment_size (int): The size of the PDF attached to every other message, 0 for none.
+
+    Returns:
+        bytes: The raw RFC 5322 message.
+    """
+    sender = f"user{rng.randint(0, 5000)}@{rng.choice(DOMAINS)}"
+    sent = (start + timedelta(minutes=7 * i)).astimezone()
+    message = EmailMessage()
+    message["From"] = f"Customer {i} <{sender}>"
+    message["To"] = "info@qib.com.qa"
+    if i % 4 == 0:
+        message["Cc"] = "support@qib.com.qa"
+    message["Subject"] = f"{'Re: ' if i % 3 else ''}Card request {i}"
+    message["Date"] = format_datetime(sent)
+    message["Message-ID"] = f"<msg{i}@{sender.split('@')[1]}>"
+    message["Received"] = f"from mx.{sender.split('@')[1]} by mx.qib.com.qa; {format_datetime(sent)}"
+    if i % 3 and i > 0:
+        parent = rng.randint(max(0, i - 50), i - 1)
+        message["In-Reply-To"] = f"<msg{parent}@parent>"
+        message["References"] = f"<msg{parent}@parent>"
+    words = ["card", "account", "transfer", "please", "help", "مرحبا", "بطاقة"]
+    text = " ".join(rng.choice(words) for _ in range(200))
+    message.set_content(text)
+    message.add_alternative(f"<html><body><p>{text}</p></body></html>", subtype="html")
+    if attachment_size and i % 2 == 0:
+        document = b"%PDF-1.4\n" + rng.randbytes(attachment_size)
+        message.add_attachment(document, maintype="application", subtype="pdf", filename=f"statement{i}.pdf")
+    return message.as_bytes(policy=message.policy.clone(linesep="\r\n"))
+
+
+def make_mailboxes(
+    count: int, folders: List[str] = ["INBOX"], seed: int = 0, attachment_size: int = 0
+) -> Dict[str, Mailbox]:
+    """
+    Builds folders of synthetic messages.
+
+    Args:
+        count (int): The number of messages per folder.
+        folders (List[str]): The folder names.
+        seed (int): The random seed.
+        attachment_size (int): The size of the PDF attached to every other message, 0 for none.
+
+    Returns:
+        Dict[str, Mailbox]: The folders by name.
+    """
+    rng = random.Random(seed)
+    return {
+        folder: Mailbox([make_message(i, rng, attachment_size=attachment_size) for i in range(count)])
+        for folder in folders
+    }
+
+
+def _tokenize(data: bytes) -> list:
+    """Splits a command into atoms, quoted strings and nested parenthesised lists."""
+    stack: list = [[]]
+    for token in _TOKEN.findall(data):
+        if token == b"(":
+            stack.append([])
+        elif token == b")":
+            nested = stack.pop()
+            stack[-1].append(nested)
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", token[1:-1]).decode())
+        else:
+            stack[-1].append(token.decode())
+    return stack[0]
+
+
+def _parse_message_set(message_set: str, largest: int) -> List[Tuple[int, int]]:
+    """Parses a message set such as "1:5,7,9:*" into inclusive ranges."""
+    ranges = []
+    for part in message_set.split(","):
+        start, _, stop = part.partition(":")
+        start_number = largest if start == "*" else int(start)
+        stop_number = start_number if not stop else largest if stop == "*" else int(stop)
+        ranges.append((min(start_number, stop_number), max(start_number, stop_number)))
+    return ranges
+
+
+def _in_message_set(number: int, ranges: List[Tuple[int, int]]) -> bool:
+    return any(start <= number <= stop for start, stop in ranges)
+
+
+def _quote(value: Optional[str]) -> str:
+    return "NIL" if value is None else '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _part_payload(part: Message) -> bytes:
+    """Returns the body of a part as transferred, still in its Content-Transfer-Encoding."""
+    payload = part.get_payload()
+    return payload.encode("ascii", "surrogateescape") if isinstance(payload, str) else b""
+
+
+def _bodystructure(part: Message) -> str:
+    """Builds the BODYSTRUCTURE of a message or part, with the disposition extension data."""
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        subtype = _quote(part.get_content_subtype())
+        return f'({children} {subtype} ("boundary" {_quote(part.get_boundary())}) NIL NIL NIL)'
+
+    params = " ".join(f"{_quote(key)} {_quote(value)}" for key, value in part.get_params()[1:])
+    payload = _part_payload(part)
+    fields = [
+        _quote(part.get_content_maintype()),
+        _quote(part.get_content_subtype()),
+        f"({params})" if params else "NIL",
+        "NIL",
+        "NIL",
+        _quote(part.get("Content-Transfer-Encoding", "7bit")),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    disposition = part.get_content_disposition()
+    filename = part.get_filename()
+    if disposition:
+        disposition_params = f"({_quote('filename')} {_quote(filename)})" if filename else "NIL"
+        fields += ["NIL", f"({_quote(disposition)} {disposition_params})", "NIL", "NIL"]
+    else:
+        fields += ["NIL", "NIL", "NIL", "NIL"]
+    return f"({' '.join(fields)})"
+
+
+def _body_part(message: Message, section: str) -> Message:
+    """Finds the part of a message addressed by a section number such as "1.2"."""
+    part = message
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != "1":
+            raise ValueError(f"no part {section}")
+    return part
+
+
+class IMAPStandIn(socketserver.ThreadingTCPServer):
+    """
+    An in-memory IMAP server, serving each connection on its own thread.
+
+    Attributes:
+        mailboxes (Dict[str, Mailbox]): The folders by name.
+        latency (float): The seconds waited before answering each command.
+        username (str): The accepted username.
+        password (str): The accepted password.
+        disconnect_every (int): Drop each connection after this many commands, 0 to never, to
+            exercise reconnects.
+        connection_count (int): The number of connections accepted.
+        command_count (int): The number of commands served, across connections.
+        bytes_sent (int): The number of bytes sent, across connections.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        mailboxes: Dict[str, Mailbox],
+        latency: float = 0.0,
+        username: str = "user",
+        password: str = "password",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        disconnect_every: int = 0,
+        condstore: bool = False,
+    ) -> None:
+        """
+        Initializes the server and binds it; call start to serve in the background.
+
+        Args:
+            mailboxes (Dict[str, Mailbox]): The folders by name.
+            latency (float): The seconds waited before answering each command.
+            username (str): The accepted username.
+            password (str): The accepted password.
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 for any free port.
+            disconnect_every (int): Drop each connection after this many commands, 0 to never.
+            condstore (bool): Advertise ENABLE and CONDSTORE, reporting HIGHESTMODSEQ on SELECT
+                once enabled.
+        """
+        self.mailboxes = mailboxes
+        self.latency = latency
+        self.username = username
+        self.password = password
+        self.capabilities = list(CAPABILITIES) + (["ENABLE", "CONDSTORE"] if condstore else [])
+        self.disconnect_every = disconnect_every
+        self.connection_count = 0
+        self.command_count = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        super().__init__((host, port), _IMAPHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "IMAPStandIn":
+        """Serves connections on a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving and closes the listening socket."""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "IMAPStandIn":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    """Serves the IMAP commands of a single connection."""
+
+    server: IMAPStandIn
+
+    def setup(self) -> None:
+        super().setup()
+        self.mailbox: Optional[Mailbox] = None
+        self.authenticated = False
+        self.condstore = False
+        self.raw_arguments = ""
+        self.commands = 0
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def handle(self) -> None:
+        self.send(b"* OK [CAPABILITY " + " ".join(self.server.capabilities).encode() + b"] IMAP4rev1 stand-in ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            command, _, arguments = rest.partition(b" ")
+            command = command.upper().decode()
+            uid = command == "UID"
+            if uid:
+                command, _, arguments = arguments.partition(b" ")
+                command = command.upper().decode()
+
+            time.sleep(self.server.latency)
+            self.commands += 1
+            if self.server.disconnect_every and self.commands % self.server.disconnect_every == 0:
+                return
+            with self.server.lock:
+                self.server.command_count += 1
+            self.raw_arguments = arguments.decode()
+            try:
+                status, text = self.dispatch(command, _tokenize(arguments), uid)
+            except Exception as e:
+                status, text = "BAD", f"{command} failed: {e}"
+            self.send(tag + f" {status} {text}".encode())
+            if command == "LOGOUT":
+                return
+
+    def send(self, data: bytes) -> None:
+        self.wfile.write(data + b"\r\n")
+        with self.server.lock:
+            self.server.bytes_sent += len(data) + 2
+
+    def dispatch(self, command: str, arguments: list, uid: bool) -> Tuple[str, str]:
+        handlers: Dict[str, Callable[[list, bool], Tuple[str, str]]] = {
+            "CAPABILITY": self.capability,
+            "NOOP": lambda arguments, uid: ("OK", "NOOP completed"),
+            "LOGOUT": self.logout,
+            "LOGIN": self.login,
+            "ENABLE": self.enable,
+            "LIST": self.list,
+            "SELECT": self.select,
+            "EXAMINE": self.select,
+            "CLOSE": self.close,
+            "SEARCH": self.search,
+            "FETCH": self.fetch,
+        }
+        if command not in handlers:
+            return "BAD", f"{command} not supported"
+        if command not in ("CAPABILITY", "NOOP", "LOGOUT", "LOGIN") and not self.authenticated:
+            return "NO", "not authenticated"
+        if command in ("SEARCH", "FETCH", "CLOSE") and self.mailbox is None:
+            return "NO", "no folder selected"
+        return handlers[command](arguments, uid)
+
+    def capability(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        self.send(b"* CAPABILITY " + " ".join(self.server.capabilities).encode())
+        return "OK", "CAPABILITY completed"
+
+    def logout(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        self.send(b"* BYE logging out")
+        return "OK", "LOGOUT completed"
+
+    def login(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        if arguments == [self.server.username, self.server.password]:
+            self.authenticated = True
+            return "OK", "LOGIN completed"
+        return "NO", "invalid credentials"
+
+    def enable(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        enabled = [name for name in arguments if name.upper() in self.server.capabilities]
+        self.condstore = self.condstore or "CONDSTORE" in (name.upper() for name in enabled)
+        self.send(("* ENABLED " + " ".join(enabled)).rstrip().encode())
+        return "OK", "ENABLE completed"
+
+    def list(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        for name in self.server.mailboxes:
+            self.send(f'* LIST (\\HasNoChildren) "/" "{name}"'.encode())
+        return "OK", "LIST completed"
+
+    def select(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        mailbox = self.server.mailboxes.get(arguments[0])
+        if mailbox is None:
+            self.mailbox = None
+            return "NO", f"no folder {arguments[0]}"
+        self.mailbox = mailbox
+        self.send(f"* {len(mailbox.messages)} EXISTS".encode())
+        self.send(b"* 0 RECENT")
+        self.send(b"* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)")
+        self.send(f"* OK [UIDVALIDITY {mailbox.uid_validity}] UIDs valid".encode())
+        self.send(f"* OK [UIDNEXT {mailbox.uid_next}] predicted next UID".encode())
+        if self.condstore:
+            self.send(f"* OK [HIGHESTMODSEQ {mailbox.highest_modseq}] highest mod-sequence".encode())
+        return "OK", "[READ-ONLY] SELECT completed"
+
+    def close(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        self.mailbox = None
+        return "OK", "CLOSE completed"
+
+    def search(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        if arguments and str(arguments[0]).upper() == "CHARSET":
+            arguments = arguments[2:]
+        assert self.mailbox is not None
+        largest_uid = self.mailbox.uid_next - 1
+        results = []
+        for sequence_number, message in enumerate(self.mailbox.messages, 1):
+            headers = message_from_bytes(message.raw.split(b"\r\n\r\n", 1)[0], policy=compat32)
+            keys = list(arguments)
+            if self.matches_all(keys, sequence_number, message, headers, largest_uid):
+                results.append(message.uid if uid else sequence_number)
+        self.send(("* SEARCH " + " ".join(str(result) for result in results)).rstrip().encode())
+        return "OK", "SEARCH completed"
+
+    def matches_all(self, keys: list, sequence_number: int, message: StoredMessage, headers, largest_uid: int) -> bool:
+        matched = True
+        while keys:
+            matched = self.matches(keys, sequence_number, message, headers, largest_uid) and matched
+        return matched
+
+    def matches(self, keys: list, sequence_number: int, message: StoredMessage, headers, largest_uid: int) -> bool:
+        """Pops one search key, with its arguments, from keys and evaluates it."""
+        key = keys.pop(0)
+        if isinstance(key, list):
+            return self.matches_all(list(key), sequence_number, message, headers, largest_uid)
+        name = key.upper()
+        if name == "ALL":
+            return True
+        if name == "OR":
+            left = self.matches(keys, sequence_number, message, headers, largest_uid)
+            right = self.matches(keys, sequence_number, message, headers, largest_uid)
+            return left or right
+        if name == "NOT":
+            return not self.matches(keys, sequence_number, message, headers, largest_uid)
+        if name in ("SINCE", "BEFORE", "ON"):
+            day = datetime.strptime(keys.pop(0), "%d-%b-%Y").date()
+            internal_day: date = message.internal_date.date()
+            return {"SINCE": internal_day >= day, "BEFORE": internal_day < day, "ON": internal_day == day}[name]
+        if name == "HEADER":
+            field, value = keys.pop(0), keys.pop(0)
+            return any(value.lower() in str(header).lower() for header in headers.get_all(field, []))
+        if name == "UID":
+            return _in_message_set(message.uid, _parse_message_set(keys.pop(0), largest_uid))
+        if re.fullmatch(r"[\d:*,]+", name):
+            return _in_message_set(sequence_number, _parse_message_set(name, len(self.mailbox.messages)))
+        raise ValueError(f"unsupported search key {key}")
+
+    def fetch(self, arguments: list, uid: bool) -> Tuple[str, str]:
+        assert self.mailbox is not None
+        message_set = arguments[0]
+        # Section specifiers hold nested lists, so the items are read from the raw arguments
+        item_names = _FETCH_ITEM.findall(self.raw_arguments.split(" ", 1)[1])
+        if uid and "UID" not in (name.upper() for name in item_names):
+            item_names.insert(0, "UID")
+
+        largest = self.mailbox.uid_next - 1 if uid else len(self.mailbox.messages)
+        ranges = _parse_message_set(message_set, largest)
+        for sequence_number, message in enumerate(self.mailbox.messages, 1):
+            if _in_message_set(message.uid if uid else sequence_number, ranges):
+                self.send_fetch_response(sequence_number, message, item_names)
+        return "OK", "FETCH completed"
+
+    def send_fetch_response(self, sequence_number: int, message: StoredMessage, item_names: List[str]) -> None:
+        """Sends one FETCH response, writing each body section as a literal."""
+        parts: List[bytes] = []
+        for item_name in item_names:
+            name = item_name.upper()
+            if name == "UID":
+                parts.append(f"UID {message.uid}".encode())
+            elif name == "FLAGS":
+                parts.append(b"FLAGS (\\Seen)")
+            elif name == "RFC822.SIZE":
+                parts.append(f"RFC822.SIZE {len(message.raw)}".encode())
+            elif name == "BODYSTRUCTURE":
+                structure = _bodystructure(message_from_bytes(message.raw, policy=compat32))
+                parts.append(f"BODYSTRUCTURE {structure}".encode())
+            elif name == "INTERNALDATE":
+                parts.append(f'INTERNALDATE "{message.internal_date.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode())
+            elif name in ("RFC822", "RFC822.HEADER") or name.startswith("BODY"):
+                section = name.replace(".PEEK", "")
+                literal = self.section(message, section)
+                parts.append(f"{section} {{{len(literal)}}}\r\n".encode() + literal)
+            else:
+                raise ValueError(f"unsupported fetch item {item_name}")
+        self.send(f"* {sequence_number} FETCH (".encode() + b" ".join(parts) + b")")
+
+    def section(self, message: StoredMessage, section: str) -> bytes:
+        """Returns the bytes of a body section such as RFC822, BODY[] or BODY[HEADER.FIELDS (...)]."""
+        header_block, _, body = message.raw.partition(b"\r\n\r\n")
+        if section in ("RFC822", "BODY[]"):
+            return message.raw
+        if section in ("RFC822.HEADER", "BODY[HEADER]"):
+            return header_block + b"\r\n\r\n"
+        if section == "BODY[TEXT]":
+            return body
+        part_match = re.fullmatch(r"BODY\[(\d+(?:\.\d+)*)\]", section)
+        if part_match:
+            return _part_payload(_body_part(message_from_bytes(message.raw, policy=compat32), part_match.group(1)))
+        fields_match = re.fullmatch(r"BODY\[HEADER\.FIELDS(\.NOT)? \(([^)]*)\)\]", section)
+        if fields_match:
+            fields = {field.lower() for field in fields_match.group(2).split()}
+            exclude = bool(fields_match.group(1))
+            lines = re.split(rb"\r\n(?![ \t])", header_block)
+            selected = [line for line in lines if (line.split(b":", 1)[0].decode().lower() in fields) != exclude]
+            return b"".join(line + b"\r\n" for line in selected) + b"\r\n"
+        raise ValueError(f"unsupported section {section}")
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=5000, help="number of synthetic messages per folder")
+    arg_parser.add_argument("--folders", nargs="+", default=["INBOX"], help="folder names")
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every command")
+    arg_parser.add_argument("--port", type=int, default=1143)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    server = IMAPStandIn(make_mailboxes(args.count, args.folders, args.seed), latency=args.latency, port=args.port)
+    print(f"Serving {len(args.folders)} folders of {args.count} messages on 127.0.0.1:{server.port}")
+    print(f"Log in as {server.username} / {server.password} with IMAPExtractor(..., port={server.port}, ssl=False)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmarks LanguageCache against the previous get_language, which classified every full text
+twice, and reports how often both agree.
+
+Usage:
+    python -m src.benchmarks.language_id --count 20000 --duplicates 0.3
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import pandas as pd
+from langid.langid import LanguageIdentifier, model
+
+from src.transform.language_id import LanguageCache
+
+SENTENCES = {
+    "en": [
+        "I would like to know the balance of my savings account.",
+        "Please block my credit card, it was stolen yesterday.",
+        "Kindly send me the statement for the last three months.",
+        "The transfer to my brother has not arrived yet.",
+    ],
+    "ar": [
+        "أرغب في معرفة رصيد حساب التوفير الخاص بي.",
+        "يرجى إيقاف بطاقتي الائتمانية فقد سرقت أمس.",
+        "أرجو إرسال كشف الحساب لآخر ثلاثة أشهر.",
+        "التحويل إلى أخي لم يصل حتى الآن.",
+    ],
+    "fr": [
+        "Je voudrais connaître le solde de mon compte d'épargne.",
+        "Veuillez bloquer ma carte de crédit, elle a été volée hier.",
+    ],
+}
+
+
+def make_texts(count: int, duplicates: float, seed: int = 0) -> pd.Series:
+    """
+    Builds texts of a few sentences, mostly English or Arabic, some with a line of the other
+    language, and some repeated.
+
+    Args:
+        count (int): The number of texts.
+        duplicates (float): The share of texts repeating an earlier one.
+        seed (int): The random seed.
+
+    Returns:
+        pd.Series: The texts.
+    """
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        if texts and rng.random() < duplicates:
+            texts.append(rng.choice(texts))
+            continue
+        language = rng.choices(["en", "ar", "fr"], weights=[6, 5, 1])[0]
+        sentences = rng.choices(SENTENCES[language], k=rng.randint(2, 40))
+        if rng.random() < 0.2:
+            sentences.append(rng.choice(SENTENCES["en" if language == "ar" else "ar"]))
+        texts.append(f"Reference {i}. " + " ".join(sentences))
+    return pd.Series(texts)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=20_000, help="number of synthetic texts")
+    arg_parser.add_argument("--duplicates", type=float, default=0.3, help="share of repeated texts")
+    arg_parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to the CPUs")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    texts = make_texts(args.count, args.duplicates, seed=args.seed)
+    identifier = LanguageIdentifier.from_modelstring(model, norm_probs=False)
+
+    def get_language_twice(message: str) -> str:
+        language = identifier.classify(message)[0]
+        if language in ["la", "qu"]:
+            return "en"
+        return identifier.classify(message)[0]
+
+    start = time.perf_counter()
+    expected = texts.map(get_language_twice)
+    previous_seconds = time.perf_counter() - start
+
+    cache = LanguageCache()
+    start = time.perf_counter()
+    languages = cache.identify(texts, num_processes=args.processes)
+    cached_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    cache.identify(texts, num_processes=args.processes)
+    rerun_seconds = time.perf_counter() - start
+
+    print(f"Texts:            {len(texts):,}, {texts.nunique():,} distinct")
+    print(f"Agreement:        {(languages == expected).mean():.2%}")
+    print(f"Previous:         {previous_seconds:.2f}s")
+    print(f"LanguageCache:    {cached_seconds:.2f}s")
+    print(f"Cached rerun:     {rerun_seconds:.2f}s")
+    print(pd.crosstab(expected, languages, rownames=["previous"], colnames=["new"]).to_string())
+
+
+if __name__ == "__main__":
+    main()
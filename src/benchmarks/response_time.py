@@ -0,0 +1,115 @@
+"""
+Benchmarks the indexed self-join of get_response_time against the previous row-by-row lookup,
+and times the per-thread and per-day/per-topic response time aggregates.
+
+The row-by-row lookup is quadratic, so it only runs on the first --loop-count messages and its
+results are checked against the vectorized ones on the same sample.
+
+Usage:
+    python -m src.benchmarks.response_time --count 1000000 --loop-count 2000
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from src.transform.message_transformer import (
+    get_response_time,
+    get_response_time_percentiles,
+    get_thread_response_stats,
+)
+
+
+def make_messages(count: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Builds synthetic threads of messages, each replying to the previous message of its thread.
+
+    Args:
+        count (int): The number of messages.
+        seed (int): The random seed.
+
+    Returns:
+        pd.DataFrame: The messages, with the columns used by the response time functions.
+    """
+    rng = np.random.default_rng(seed)
+    thread_of = np.sort(rng.integers(0, max(count // 4, 1), count))
+    first_of_thread = np.concatenate([[True], thread_of[1:] != thread_of[:-1]])
+    gaps = rng.exponential(3600, count).astype("timedelta64[s]")
+    starts = np.datetime64("2024-01-01") + rng.integers(0, 365 * 86400, count).astype("timedelta64[s]")
+    # Restart the clock at each thread and accumulate the gaps between its replies
+    thread_start = np.maximum.accumulate(np.where(first_of_thread, np.arange(count), 0))
+    elapsed = np.cumsum(gaps) - np.cumsum(gaps)[thread_start]
+    submit_times = starts[thread_start] + elapsed
+
+    message_ids = np.array([f"<{i}@bench.example>" for i in range(count)], dtype=object)
+    previous_ids = np.where(first_of_thread, None, np.roll(message_ids, 1))
+    return pd.DataFrame(
+        {
+            "message_id": message_ids,
+            "previous_message_id": previous_ids,
+            "submit_time": pd.to_datetime(submit_times).tz_localize(timezone.utc).to_pydatetime(),
+            "thread_id": message_ids[thread_start],
+            "topic_id": rng.integers(0, 20, count),
+        }
+    )
+
+
+def get_response_time_by_row(df: pd.DataFrame) -> pd.DataFrame:
+    """The previous implementation of get_response_time, looking up each previous message in turn."""
+    df["response_time"] = None
+    for index, row in df.iterrows():
+        previous_message_id = row["previous_message_id"]
+        if previous_message_id:
+            previous_row = df.loc[df["message_id"] == previous_message_id]
+            if len(previous_row) > 0:
+                previous_submit_time = datetime.fromisoformat(str(previous_row["submit_time"].iloc[0]))
+                current_submit_time = datetime.fromisoformat(str(row["submit_time"]))
+                response_time = (current_submit_time - previous_submit_time).total_seconds()
+                df.at[index, "response_time"] = response_time
+    return df
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--count", type=int, default=1_000_000, help="number of synthetic messages")
+    arg_parser.add_argument("--loop-count", type=int, default=2000, help="messages for the row-by-row lookup")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    df = make_messages(args.count, seed=args.seed)
+    sample = df.head(args.loop_count).copy()
+
+    start = time.perf_counter()
+    expected = get_response_time_by_row(sample.copy())["response_time"]
+    loop_seconds = time.perf_counter() - start
+    actual = get_response_time(sample.copy())["response_time"]
+    mismatches = int((expected.isna() != actual.isna()).sum())
+    known = expected.notna() & actual.notna()
+    mismatches += int((expected[known].astype(float) - actual[known].astype(float)).abs().gt(1e-6).sum())
+
+    start = time.perf_counter()
+    df = get_response_time(df)
+    join_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    thread_stats = get_thread_response_stats(df)
+    thread_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    by_day = get_response_time_percentiles(df, "day")
+    by_topic = get_response_time_percentiles(df, "topic_id")
+    percentile_seconds = time.perf_counter() - start
+
+    print(f"Sample mismatches:     {mismatches} of {args.loop_count}")
+    print(f"Row-by-row lookup:     {loop_seconds:.2f}s for {args.loop_count:,} messages")
+    print(f"Indexed self-join:     {join_seconds:.2f}s for {args.count:,} messages")
+    print(f"Thread aggregates:     {thread_seconds:.2f}s for {len(thread_stats):,} threads")
+    print(f"Day/topic percentiles: {percentile_seconds:.2f}s for {len(by_day):,} days, {len(by_topic):,} topics")
+    print(by_topic.head().to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import logging
 from os import path
+from typing import List
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -12,12 +13,14 @@ class Config(BaseModel):
         use_ollama (bool): Whether to use Ollama or not.
         llm_model_name (str): The name of the LLM model to use.
         embedding_model_name (str): The name of the embedding model to use.
+        embedding_batch_size (int): The number of texts the embedding model encodes per forward pass.
         pst_directory (str): The path to the PST directory.
         output_directory (str): The path to the output directory.
         db_host (str): The hostname of the database.
         db_user (str): The username of the database.
         db_name (str): The name of the database.
         db_password (str): The password of the database.
+        internal_domains (List[str]): The substrings marking a sender domain as internal.
     """
 
     model_config = ConfigDict(strict=True)
@@ -28,6 +31,7 @@ class Config(BaseModel):
 
     # Embeddings
     embedding_model_name: str = Field(default="all-MiniLM-L6-v2")
+    embedding_batch_size: int = Field(default=64)
 
     # PST
     pst_directory: str = Field(default="../../data/raw/")
@@ -39,6 +43,9 @@ class Config(BaseModel):
     db_name: str = Field(default="email_analysis")
     db_password: str = Field(default="password")
 
+    # Domains
+    internal_domains: List[str] = Field(default_factory=lambda: ["qib"])
+
     def normalize_paths(self):
         self.pst_directory = path.normcase(self.pst_directory)
         self.output_directory = path.normcase(self.output_directory)
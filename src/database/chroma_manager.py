@@ -1,32 +1,135 @@
-from typing import Any, Dict, List
+import atexit
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence
 
 import chromadb
 import numpy as np
 import pandas as pd
+import torch
 from chromadb.api.types import Documents, EmbeddingFunction, Embeddings, IncludeEnum
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
 from sentence_transformers import SentenceTransformer
-from tqdm.auto import tqdm
+
+from src.database.embedding_store import EmbeddingStore
+
+# Texts encoded per forward pass
+DEFAULT_EMBEDDING_BATCH_SIZE = 64
+
+# Below this many texts, encoding in this process costs less than sending them to the pool
+MIN_POOL_TEXTS = 1000
 
 
 class SentenceEmbedding(EmbeddingFunction[Documents]):
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2") -> None:
+    """
+    A long-lived sentence transformer encoder, with a pool of worker processes started on the
+    first large enough input and reused until stop_pool or exit.
+
+    The texts are sorted by length before being split into batches, so that each batch pads
+    its texts to a similar length, and the embeddings are returned in the original order.
+
+    Attributes:
+        model (SentenceTransformer): The sentence transformer.
+        batch_size (int): The number of texts encoded per forward pass.
+        num_processes (Optional[int]): The number of pool workers on CPU. Defaults to one per
+            CUDA device, or four on CPU.
+        encoded_count (int): The number of texts encoded so far.
+        encode_seconds (float): The seconds spent encoding so far.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE,
+        num_processes: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes the SentenceEmbedding, loading the model in this process.
+
+        Args:
+            model_name (str): The name of the sentence transformer model to use. Defaults to "all-MiniLM-L6-v2".
+            batch_size (int): The number of texts encoded per forward pass. Defaults to DEFAULT_EMBEDDING_BATCH_SIZE.
+            num_processes (Optional[int]): The number of pool workers on CPU. Defaults to one per
+                CUDA device, or four on CPU.
+        """
         self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self.num_processes = num_processes
+        self.encoded_count = 0
+        self.encode_seconds = 0.0
+        self._pool: Optional[Dict[str, Any]] = None
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.encode(input).tolist()
+
+    @property
+    def pool(self) -> Dict[str, Any]:
+        """The pool of worker processes, started on first use and stopped at exit."""
+        if self._pool is None:
+            target_devices = None
+            if self.num_processes and not torch.cuda.is_available():
+                target_devices = ["cpu"] * self.num_processes
+            # sentence-transformers spawns the workers, so the pool can start from a pipeline stage thread
+            self._pool = self.model.start_multi_process_pool(target_devices=target_devices)
+            atexit.register(self.stop_pool)
+            logging.info(f"Started a pool of {len(self._pool['processes'])} encoding processes")
+        return self._pool
+
+    def stop_pool(self) -> None:
+        """Stops the pool of worker processes, if started."""
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+            atexit.unregister(self.stop_pool)
+            logging.info("Stopped the pool of encoding processes")
+
+    def encode(self, texts: Sequence[Any]) -> np.ndarray:
+        """
+        Encodes texts, sorted by length into batches of similar lengths, across the pool when
+        there are at least MIN_POOL_TEXTS of them.
 
-    def __call__(self, input) -> Embeddings:
-        # embed the documents somehow
-        embeddings = []
-        pool = self.model.start_multi_process_pool()
-        docs = [str(doc) for doc in input]
-        for embedding in tqdm(self.model.encode_multi_process(docs, pool=pool)):
-            embeddings.append(embedding.tolist())
+        Args:
+            texts (Sequence[Any]): The texts, converted to strings.
+
+        Returns:
+            np.ndarray: The float32 embedding of each text, in the order of texts.
+        """
+        start_time = time.time()
+        docs = [str(text) for text in texts]
+        if not docs:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Longest first, so that a batch running out of memory fails early
+        order = np.argsort([-len(doc) for doc in docs], kind="stable")
+        sorted_docs = [docs[i] for i in order]
+        if len(docs) >= MIN_POOL_TEXTS:
+            sorted_embeddings = self.model.encode_multi_process(sorted_docs, pool=self.pool, batch_size=self.batch_size)
+        else:
+            sorted_embeddings = self.model.encode(
+                sorted_docs, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+            )
+        embeddings = np.empty_like(sorted_embeddings, dtype=np.float32)
+        embeddings[order] = sorted_embeddings
+
+        seconds = time.time() - start_time
+        self.encoded_count += len(docs)
+        self.encode_seconds += seconds
+        logging.info(f"Encoded {len(docs)} texts in {seconds:.1f}s ({len(docs) / max(seconds, 1e-9):.0f} texts/s)")
         return embeddings
 
+    def throughput(self) -> float:
+        """The number of texts encoded per second so far."""
+        return self.encoded_count / self.encode_seconds if self.encode_seconds else 0.0
+
 
 class ChromaManager:
     def __init__(
-        self, collection_name: str, path: str = "../../data/chroma", model_name: str = "all-MiniLM-L6-v2"
+        self,
+        collection_name: str,
+        path: str = "../../data/chroma",
+        model_name: str = "all-MiniLM-L6-v2",
+        batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE,
     ):
         """
         Initialize the ChromaManager.
@@ -35,12 +138,14 @@ class ChromaManager:
             collection_name (str): The name of the Chroma collection to create or access.
             path (str, optional): The path to store the Chroma collection. Defaults to "../../data/chroma".
             model_name (str, optional): The name of the sentence transformer model to use. Defaults to "all-MiniLM-L6-v2".
+            batch_size (int, optional): The number of texts encoded per forward pass. Defaults to 64.
         """
         settings = Settings()
         settings.allow_reset = True
         self.client = chromadb.PersistentClient(path=path, settings=settings)
+        self.embedding_function = SentenceEmbedding(model_name, batch_size=batch_size)
         self.collection = self.client.get_or_create_collection(
-            name=collection_name, embedding_function=SentenceEmbedding(model_name)
+            name=collection_name, embedding_function=self.embedding_function
         )
 
     def add_documents_from_df(self, df: pd.DataFrame):
@@ -96,3 +201,30 @@ class ChromaManager:
         # Join the embeddings with the original dataframe
         df_with_embeddings = pd.merge(df, embedding_df, on="message_id")
         return df_with_embeddings
+
+    def populate_embedding_store(self, df: pd.DataFrame, embedding_store: EmbeddingStore) -> EmbeddingStore:
+        """
+        Populates an embedding store with the embeddings of the given dataframe, taking the
+        ones in the Chroma collection and calculating the others, so that they can be read as
+        a float32 matrix rather than a column of lists.
+
+        Args:
+            df (pd.DataFrame): The dataframe containing the "clean_text" and "message_id" columns.
+            embedding_store (EmbeddingStore): The store to populate.
+
+        Returns:
+            EmbeddingStore: The populated store.
+        """
+        missing_ids = set(embedding_store.missing(df["message_id"].unique()))
+        logging.info(f"Found {df['message_id'].nunique() - len(missing_ids)} embeddings in the embedding store")
+        if missing_ids:
+            missing_df = df.loc[df["message_id"].isin(missing_ids)].drop_duplicates(subset=["message_id"])
+            existing_ids = set(self.collection.get(ids=missing_df["message_id"].tolist())["ids"])
+            df_without_embeddings = missing_df.loc[~missing_df["message_id"].isin(existing_ids)]
+            if len(df_without_embeddings) > 0:
+                self.add_documents_from_df(df_without_embeddings)
+            logging.info(f"Added {len(df_without_embeddings)} documents to the database")
+
+            embeddings = self.collection.get(ids=missing_df["message_id"].tolist(), include=[IncludeEnum.embeddings])
+            embedding_store.add(embeddings["ids"], np.asarray(embeddings["embeddings"], dtype=np.float32))
+        return embedding_store
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Rows per block when scanning the matrix for similar embeddings
+SIMILARITY_CHUNK_SIZE = 65_536
+
+
+class EmbeddingStore:
+    """
+    A float32 embedding matrix on disk, memory-mapped, with the message_id of each row.
+
+    The embeddings are appended to a raw float32 file, one contiguous row per message, and the
+    message_ids are kept in row order in an index JSON file. Reading the matrix maps the file
+    rather than loading it, so clustering and similarity code can take slices of it without
+    copying them into lists or a new array.
+
+    Attributes:
+        path (str): The directory of the matrix and index files.
+        dimension (Optional[int]): The number of values per embedding, set by the first add.
+        message_ids (List[str]): The message_id of each row.
+    """
+
+    def __init__(self, path: str, dimension: Optional[int] = None) -> None:
+        """
+        Initializes the EmbeddingStore, loading its index if it exists.
+
+        Args:
+            path (str): The directory of the matrix and index files, created if needed.
+            dimension (Optional[int]): The number of values per embedding. Defaults to the
+                dimension of the stored embeddings, or of the first ones added.
+
+        Raises:
+            ValueError: If dimension differs from the dimension of the stored embeddings.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        self.message_ids: List[str] = []
+        self._index: Optional[pd.Index] = None
+        self._matrix: Optional[np.memmap] = None
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as index_file:
+                index = json.load(index_file)
+            if dimension is not None and dimension != index["dimension"]:
+                raise ValueError(
+                    f"The store at {path} holds embeddings of dimension {index['dimension']}, not {dimension}"
+                )
+            self.dimension = index["dimension"]
+            self.message_ids = index["message_ids"]
+            self._truncate_unindexed_rows()
+            logging.info(f"Loaded {len(self.message_ids)} embeddings of dimension {self.dimension} from {path}")
+
+    @property
+    def matrix_path(self) -> str:
+        return os.path.join(self.path, "embeddings.f32")
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def __len__(self) -> int:
+        return len(self.message_ids)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self.index
+
+    @property
+    def index(self) -> pd.Index:
+        """The row of each message_id, as a pandas Index."""
+        if self._index is None:
+            self._index = pd.Index(self.message_ids)
+        return self._index
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The read-only memory-mapped matrix of every embedding, one row per message_id."""
+        if self.dimension is None or not self.message_ids:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        if self._matrix is None:
+            self._matrix = np.memmap(
+                self.matrix_path, dtype=np.float32, mode="r", shape=(len(self.message_ids), self.dimension)
+            )
+        return self._matrix
+
+    def rows(self, message_ids: Sequence[str]) -> np.ndarray:
+        """
+        Finds the rows of message_ids.
+
+        Args:
+            message_ids (Sequence[str]): The message_ids.
+
+        Returns:
+            np.ndarray: The row of each message_id, or -1 for the ones not stored.
+        """
+        return self.index.get_indexer(pd.Index(message_ids))
+
+    def missing(self, message_ids: Sequence[str]) -> List[str]:
+        """Lists the message_ids without a stored embedding."""
+        message_ids = list(message_ids)
+        return [message_id for message_id, row in zip(message_ids, self.rows(message_ids)) if row < 0]
+
+    def get(self, message_ids: Sequence[str]) -> np.ndarray:
+        """
+        Reads the embeddings of message_ids.
+
+        When message_ids are all the stored ones in row order, the memory-mapped matrix itself is
+        returned, and otherwise its rows are gathered into a new array.
+
+        Args:
+            message_ids (Sequence[str]): The message_ids.
+
+        Returns:
+            np.ndarray: The float32 embedding of each message_id, one row each.
+
+        Raises:
+            KeyError: If a message_id has no stored embedding.
+        """
+        rows = self.rows(message_ids)
+        if (rows < 0).any():
+            missing = [message_id for message_id, row in zip(message_ids, rows) if row < 0]
+            raise KeyError(f"{len(missing)} message_ids have no stored embedding, e.g. {missing[:3]}")
+        if len(rows) == len(self.message_ids) and (rows == np.arange(len(rows))).all():
+            return self.matrix
+        return self.matrix[rows]
+
+    def add(self, message_ids: Sequence[str], embeddings: np.ndarray) -> None:
+        """
+        Stores the embeddings of message_ids, replacing the ones already stored in place and
+        appending the others.
+
+        The rows are written before the index, which is replaced atomically, so an interrupted
+        add leaves the previous embeddings readable.
+
+        Args:
+            message_ids (Sequence[str]): The message_ids.
+            embeddings (np.ndarray): The embedding of each message_id, one row each.
+
+        Raises:
+            ValueError: If the embeddings do not have one row per message_id, or their dimension
+                differs from the stored ones.
+        """
+        message_ids = list(message_ids)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or len(embeddings) != len(message_ids):
+            raise ValueError(f"Expected {len(message_ids)} embeddings, got an array of shape {embeddings.shape}")
+        if self.dimension is None:
+            self.dimension = embeddings.shape[1]
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected embeddings of dimension {self.dimension}, got {embeddings.shape[1]}")
+        if not message_ids:
+            return
+
+        # The last embedding of a message_id given twice wins
+        is_last = ~pd.Index(message_ids).duplicated(keep="last")
+        message_ids = [message_id for message_id, last in zip(message_ids, is_last) if last]
+        embeddings = embeddings[is_last]
+        rows = self.rows(message_ids)
+        is_new = rows < 0
+
+        self._matrix = None
+        if (~is_new).any():
+            matrix = np.memmap(
+                self.matrix_path, dtype=np.float32, mode="r+", shape=(len(self.message_ids), self.dimension)
+            )
+            matrix[rows[~is_new]] = embeddings[~is_new]
+            matrix.flush()
+            del matrix
+        if is_new.any():
+            with open(self.matrix_path, "ab") as matrix_file:
+                matrix_file.write(np.ascontiguousarray(embeddings[is_new]).tobytes())
+            self.message_ids = self.message_ids + [
+                message_id for message_id, new in zip(message_ids, is_new) if new
+            ]
+            self._index = None
+        self.save_index()
+        logging.info(f"Stored {is_new.sum()} new and {(~is_new).sum()} updated embeddings in {self.path}")
+
+    def save_index(self) -> None:
+        """Writes the index to disk, replacing the previous version atomically."""
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump({"dimension": self.dimension, "message_ids": self.message_ids}, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def most_similar(
+        self, embedding: np.ndarray, k: int = 10, chunk_size: int = SIMILARITY_CHUNK_SIZE
+    ) -> List[Tuple[str, float]]:
+        """
+        Finds the stored embeddings most similar to an embedding by cosine similarity, scanning
+        the matrix in blocks of rows so that it is never loaded whole.
+
+        Args:
+            embedding (np.ndarray): The embedding to compare.
+            k (int): The number of message_ids to return.
+            chunk_size (int): The number of rows per block.
+
+        Returns:
+            List[Tuple[str, float]]: The k most similar message_ids with their similarity, most
+                similar first.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        matrix = self.matrix
+        similarities = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), chunk_size):
+            block = matrix[start : start + chunk_size]
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1.0
+            similarities[start : start + len(block)] = block @ query / norms
+
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k] if k else np.empty(0, dtype=int)
+        top = top[np.argsort(-similarities[top])]
+        return [(self.message_ids[row], float(similarities[row])) for row in top]
+
+    def _truncate_unindexed_rows(self) -> None:
+        """Drops the rows appended by an add interrupted before its index was saved."""
+        expected_size = len(self.message_ids) * self.dimension * np.dtype(np.float32).itemsize
+        if os.path.exists(self.matrix_path) and os.path.getsize(self.matrix_path) > expected_size:
+            logging.warning(f"Dropping embeddings of {self.path} written after its index was last saved")
+            os.truncate(self.matrix_path, expected_size)
@@ -0,0 +1,565 @@
+import asyncio
+import imaplib
+import itertools
+import logging
+import os
+import re
+import ssl as ssl_module
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import default
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import pandas as pd
+
+from src.extract.imap_connection_pool import CONNECTION_ERRORS
+from src.extract.imap_extractor import FETCH_CHUNK_SIZE, IMAPExtractor, compress_uids
+from src.extract.parsing_utils import INTERNAL_DOMAINS, parse_domain_info, parse_email_threading
+
+T = TypeVar("T")
+
+# The longest response line read without a literal, which bounds the size of a SEARCH response
+MAX_LINE_LENGTH = 64 * 1024 * 1024
+
+_LITERAL = re.compile(rb"\{(\d+)\}\r\n$")
+_UID = re.compile(rb"\bUID (\d+)")
+
+
+class AsyncIMAPConnection:
+    """
+    A minimal asyncio IMAP4rev1 client with the commands the extractor needs.
+
+    Only one command runs at a time on a connection. Errors follow imaplib, raising
+    imaplib.IMAP4.error for a NO or BAD response and imaplib.IMAP4.abort when the connection
+    drops, so the same CONNECTION_ERRORS trigger a reconnect.
+
+    Attributes:
+    ----------
+    reader : asyncio.StreamReader
+        The stream the responses are read from.
+    writer : asyncio.StreamWriter
+        The stream the commands are written to.
+    selected : Optional[str]
+        The currently selected folder.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.selected: Optional[str] = None
+        self.tags = itertools.count(1)
+
+    @classmethod
+    async def open(cls, server: str, port: int, ssl: bool) -> "AsyncIMAPConnection":
+        """
+        Open a connection and read the server greeting.
+
+        Parameters:
+        ----------
+        server : str
+            The IMAP server address.
+        port : int
+            The IMAP server port.
+        ssl : bool
+            Whether to connect over SSL.
+
+        Returns:
+        -------
+        AsyncIMAPConnection
+            The connection, not logged in yet.
+        """
+        ssl_context = ssl_module.create_default_context() if ssl else None
+        reader, writer = await asyncio.open_connection(server, port, ssl=ssl_context, limit=MAX_LINE_LENGTH)
+        connection = cls(reader, writer)
+        greeting, _ = await connection.read_response()
+        if not greeting.startswith((b"* OK", b"* PREAUTH")):
+            connection.close()
+            raise imaplib.IMAP4.error(f"unexpected greeting: {greeting.decode(errors='replace').strip()}")
+        return connection
+
+    async def read_response(self) -> Tuple[bytes, List[bytes]]:
+        """
+        Read one response, with the literals it contains.
+
+        Returns:
+        -------
+        Tuple[bytes, List[bytes]]
+            The text of the response with the literals left out, and the literals in order.
+        """
+        text = b""
+        literals = []
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("socket error: EOF")
+                text += line
+                match = _LITERAL.search(line)
+                if not match:
+                    return text, literals
+                literals.append(await self.reader.readexactly(int(match.group(1))))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            raise imaplib.IMAP4.abort(f"socket error: {e}") from e
+
+    async def command(self, name: str, *arguments: str) -> List[Tuple[bytes, List[bytes]]]:
+        """
+        Send a command and wait for its tagged completion.
+
+        Parameters:
+        ----------
+        name : str
+            The command, e.g. "LOGIN" or "UID FETCH".
+        *arguments : str
+            The arguments, already quoted where needed.
+
+        Returns:
+        -------
+        List[Tuple[bytes, List[bytes]]]
+            The untagged responses, each with its literals.
+        """
+        tag = f"A{next(self.tags):04d}".encode()
+        self.writer.write(b" ".join([tag, name.encode(), *(argument.encode() for argument in arguments)]) + b"\r\n")
+        await self.writer.drain()
+
+        untagged = []
+        while True:
+            text, literals = await self.read_response()
+            if text.startswith(tag + b" "):
+                status, _, message = text[len(tag) + 1 :].partition(b" ")
+                if status != b"OK":
+                    raise imaplib.IMAP4.error(f"{name} failed: {message.decode(errors='replace').strip()}")
+                return untagged
+            if text.startswith(b"* BYE") and name != "LOGOUT":
+                raise imaplib.IMAP4.abort(text.decode(errors="replace").strip())
+            untagged.append((text, literals))
+
+    async def login(self, username: str, password: str) -> None:
+        """Authenticate with a username and password."""
+        await self.command("LOGIN", quote(username), quote(password))
+
+    async def select(self, folder: str) -> None:
+        """Select a folder read-only, unless it is selected already."""
+        if self.selected != folder:
+            self.selected = None
+            await self.command("EXAMINE", quote(folder))
+            self.selected = folder
+
+    async def uid_search(self, criteria: str) -> List[str]:
+        """
+        Search the selected folder.
+
+        Parameters:
+        ----------
+        criteria : str
+            The IMAP search criteria, e.g. 'SINCE "01-Jan-2023"'.
+
+        Returns:
+        -------
+        List[str]
+            The matching UIDs.
+        """
+        uids = []
+        for text, _ in await self.command("UID SEARCH", criteria):
+            if text.startswith(b"* SEARCH"):
+                uids.extend(text[len(b"* SEARCH") :].decode().split())
+        return uids
+
+    async def uid_fetch(self, message_set: str, fetch_items: str) -> List[Tuple[str, bytes]]:
+        """
+        Run a UID FETCH that returns a single literal per message.
+
+        Parameters:
+        ----------
+        message_set : str
+            The UIDs to fetch, e.g. "1000:1499" or "4,8,15".
+        fetch_items : str
+            The fetch items, which must include UID and a single BODY section.
+
+        Returns:
+        -------
+        List[Tuple[str, bytes]]
+            The UID and the literal of each fetched message.
+        """
+        literals = []
+        for text, response_literals in await self.command("UID FETCH", message_set, fetch_items):
+            match = _UID.search(text)
+            if match and response_literals:
+                literals.append((match.group(1).decode(), response_literals[0]))
+        return literals
+
+    async def logout(self) -> None:
+        """Log out and close the connection."""
+        try:
+            await self.command("LOGOUT")
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Close the connection without logging out."""
+        self.writer.close()
+
+
+class AsyncIMAPConnectionPool:
+    """
+    A pool of authenticated asyncio IMAP connections shared by concurrent tasks.
+
+    The asyncio counterpart of IMAPConnectionPool: connections are opened lazily, up to size,
+    each one serves a single task at a time, and a task whose connection drops is retried on
+    a freshly opened one.
+
+    Attributes:
+    ----------
+    connect : Callable[[], Awaitable[AsyncIMAPConnection]]
+        Opens and authenticates a new connection.
+    size : int
+        The maximum number of open connections.
+    max_retries : int
+        The number of times a task is retried after a connection error.
+    """
+
+    def __init__(
+        self, connect: Callable[[], Awaitable[AsyncIMAPConnection]], size: int, max_retries: int = 3
+    ) -> None:
+        self.connect = connect
+        self.size = size
+        self.max_retries = max_retries
+        self.idle: List[AsyncIMAPConnection] = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def run(self, task: Callable[[AsyncIMAPConnection], Awaitable[T]]) -> T:
+        """
+        Run a task on a pooled connection, reconnecting and retrying if the connection drops.
+
+        Parameters:
+        ----------
+        task : Callable[[AsyncIMAPConnection], Awaitable[T]]
+            The task, called with the connection; it must be safe to repeat from the start.
+
+        Returns:
+        -------
+        T
+            The result of the task.
+        """
+        attempt = 0
+        async with self.slots:
+            while True:
+                connection = self.idle.pop() if self.idle else await self.connect()
+                try:
+                    result = await task(connection)
+                except CONNECTION_ERRORS as e:
+                    connection.close()
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+                    logging.warning(f"IMAP connection lost ({e}), retrying on a new connection")
+                    continue
+                except imaplib.IMAP4.error:
+                    # A NO or BAD response leaves the connection usable
+                    self.idle.append(connection)
+                    raise
+                except BaseException:
+                    # A cancelled task may leave a response half read
+                    connection.close()
+                    raise
+                self.idle.append(connection)
+                return result
+
+    async def close(self) -> None:
+        """Log out of every idle connection."""
+        connections, self.idle = self.idle, []
+        for connection in connections:
+            try:
+                await connection.logout()
+            except Exception:
+                pass
+
+
+class AsyncIMAPExtractor:
+    """
+    An asyncio IMAP extractor producing the same rows as IMAPExtractor.parse_email.
+
+    Fetches run concurrently over a pool of connections, and the MIME parsing is offloaded to
+    a pool of worker processes, so the event loop stays free for other coroutines such as the
+    async LLM stages. Each fetched chunk holds a slot until it is parsed, which bounds the raw
+    messages held in memory when parsing falls behind the network.
+
+    Attributes:
+    ----------
+    username : str
+        The email account username.
+    password : str
+        The email account password.
+    server : str
+        The IMAP server address.
+    port : int
+        The IMAP server port.
+    ssl : bool
+        Whether to connect over SSL.
+    fetch_chunk_size : int
+        The number of messages requested per UID FETCH.
+    max_connections : int
+        The maximum number of concurrent IMAP connections.
+    max_pending_chunks : int
+        The maximum number of chunks being fetched or waiting to be parsed.
+    parse_workers : int
+        The number of worker processes parsing the messages, 1 to parse on a thread.
+    pool : AsyncIMAPConnectionPool
+        The connections the fetches run on.
+    """
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        server: str = "imap.gmail.com",
+        port: Optional[int] = None,
+        ssl: bool = True,
+        fetch_chunk_size: int = FETCH_CHUNK_SIZE,
+        max_connections: int = 4,
+        max_pending_chunks: Optional[int] = None,
+        parse_workers: Optional[int] = None,
+        internal_domains: Optional[List[str]] = None,
+    ):
+        """
+        Initialize the AsyncIMAPExtractor without connecting; connections open on first use.
+
+        Parameters:
+        ----------
+        username : str
+            The email account username.
+        password : str
+            The email account password.
+        server : str, optional
+            The IMAP server address (default: 'imap.gmail.com').
+        port : Optional[int], optional
+            The IMAP server port (default: 993 with SSL, 143 without).
+        ssl : bool, optional
+            Whether to connect over SSL, disable for a local test server (default: True).
+        fetch_chunk_size : int, optional
+            The number of messages requested per UID FETCH (default: FETCH_CHUNK_SIZE).
+        max_connections : int, optional
+            The maximum number of concurrent IMAP connections (default: 4).
+        max_pending_chunks : Optional[int], optional
+            The maximum number of chunks being fetched or waiting to be parsed
+            (default: twice max_connections).
+        parse_workers : Optional[int], optional
+            The number of worker processes parsing the messages, 1 to parse on a thread
+            (default: the CPU count).
+        internal_domains : Optional[List[str]], optional
+            The substrings marking a sender domain as internal (default: INTERNAL_DOMAINS).
+        """
+        self.username = username
+        self.password = password
+        self.server = server
+        self.port = port or (993 if ssl else 143)
+        self.ssl = ssl
+        self.fetch_chunk_size = fetch_chunk_size
+        self.max_connections = max_connections
+        self.max_pending_chunks = max_pending_chunks or 2 * max_connections
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.internal_domains = INTERNAL_DOMAINS if internal_domains is None else internal_domains
+        self.pool = AsyncIMAPConnectionPool(self.connect, max_connections)
+        self.parse_executor: Optional[Executor] = None
+
+    async def __aenter__(self) -> "AsyncIMAPExtractor":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def connect(self) -> AsyncIMAPConnection:
+        """
+        Open and authenticate a new IMAP connection.
+
+        Returns:
+        -------
+        AsyncIMAPConnection
+            The logged in connection.
+        """
+        connection = await AsyncIMAPConnection.open(self.server, self.port, self.ssl)
+        try:
+            await connection.login(self.username, self.password)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    async def close(self) -> None:
+        """Logout of the IMAP connections and stop the parse workers."""
+        await self.pool.close()
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown(wait=False, cancel_futures=True)
+            self.parse_executor = None
+
+    async def extract_messages_from_imap(self, folders: List[str], since: datetime) -> pd.DataFrame:
+        """
+        Extract the messages since a date from the specified folders in the IMAP account.
+
+        Parameters:
+        ----------
+        folders : List[str]
+            List of folder names from which to extract emails.
+        since : datetime
+            Fetch emails since this date.
+
+        Returns:
+        -------
+        pd.DataFrame
+            DataFrame containing parsed email information, in folder and UID order.
+        """
+        start_time = time.time()
+        emails_list = await self.fetch_emails_since_date(folders, since)
+
+        emails_df = pd.DataFrame(emails_list)
+        emails_df = parse_email_threading(emails_df)
+        emails_df = parse_domain_info(emails_df, self.internal_domains)
+
+        logging.info(f"Total processing time: {time.time() - start_time:.2f} seconds")
+        logging.info(f"Retrieved {len(emails_df)} emails")
+        return emails_df
+
+    async def fetch_emails_since_date(self, folders: List[str], since: datetime) -> List[Dict[str, Any]]:
+        """
+        Fetch and parse the emails since a date from several folders concurrently.
+
+        Every folder is searched, then its UIDs are fetched in chunks of fetch_chunk_size
+        spread over the connection pool, and each chunk is parsed by the worker pool.
+
+        Parameters:
+        ----------
+        folders : List[str]
+            List of folder names from which to extract emails.
+        since : datetime
+            Date from which to fetch emails.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed emails, in folder and UID order.
+        """
+        date_string = since.strftime("%d-%b-%Y")  # Format date as "01-Jan-2023"
+        searches = await asyncio.gather(
+            *(self.search_folder(folder, f'SINCE "{date_string}"') for folder in folders), return_exceptions=True
+        )
+
+        pending_chunks = asyncio.Semaphore(self.max_pending_chunks)
+        fetches = []
+        for folder, uids in zip(folders, searches):
+            if isinstance(uids, BaseException):
+                logging.error(f"Error searching {folder}: {str(uids)}")
+                continue
+            uids = sorted(uids, key=int)
+            for i in range(0, len(uids), self.fetch_chunk_size):
+                message_set = compress_uids(uids[i : i + self.fetch_chunk_size])
+                fetches.append(self.fetch_and_parse_chunk(folder, message_set, pending_chunks))
+
+        fetched_emails = []
+        for chunk in await asyncio.gather(*fetches):
+            fetched_emails.extend(chunk)
+        return fetched_emails
+
+    async def search_folder(self, folder: str, criteria: str) -> List[str]:
+        """
+        Search a folder on a pooled connection.
+
+        Parameters:
+        ----------
+        folder : str
+            The name of the folder.
+        criteria : str
+            The IMAP search criteria.
+
+        Returns:
+        -------
+        List[str]
+            The matching UIDs.
+        """
+
+        async def task(connection: AsyncIMAPConnection) -> List[str]:
+            await connection.select(folder)
+            return await connection.uid_search(criteria)
+
+        return await self.pool.run(task)
+
+    async def fetch_and_parse_chunk(
+        self, folder: str, message_set: str, pending_chunks: asyncio.Semaphore
+    ) -> List[Dict[str, Any]]:
+        """
+        Fetch a chunk of messages on a pooled connection and parse it on the worker pool.
+
+        The chunk holds one of the pending_chunks slots from before it is fetched until it is
+        parsed, so that no more raw chunks pile up than the workers can keep up with.
+
+        Parameters:
+        ----------
+        folder : str
+            The name of the folder.
+        message_set : str
+            The UIDs to fetch, e.g. "1000:1499".
+        pending_chunks : asyncio.Semaphore
+            The slots bounding the chunks being fetched or waiting to be parsed.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed emails.
+        """
+
+        async def task(connection: AsyncIMAPConnection) -> List[Tuple[str, bytes]]:
+            await connection.select(folder)
+            return await connection.uid_fetch(message_set, "(UID BODY.PEEK[])")
+
+        async with pending_chunks:
+            try:
+                literals = await self.pool.run(task)
+            except Exception as e:
+                logging.error(f"Error fetching UIDs {message_set} from {folder}: {str(e)}")
+                return []
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.get_parse_executor(), _parse_raw_emails, literals)
+
+    def get_parse_executor(self) -> Executor:
+        """
+        Get the parse worker pool, starting it on first use.
+
+        Returns:
+        -------
+        Executor
+            A process pool of parse_workers processes, or a single thread if parse_workers is 1.
+        """
+        if self.parse_executor is None:
+            if self.parse_workers == 1:
+                self.parse_executor = ThreadPoolExecutor(max_workers=1)
+            else:
+                self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self.parse_executor
+
+
+def _parse_raw_emails(literals: List[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+    """
+    Parse a chunk of raw emails in a worker, skipping the ones that fail to parse.
+
+    Parameters:
+    ----------
+    literals : List[Tuple[str, bytes]]
+        The UID and the raw bytes of each email.
+
+    Returns:
+    -------
+    List[Dict[str, Any]]
+        The parsed emails, as returned by IMAPExtractor.parse_email.
+    """
+    parsed_emails = []
+    for uid, raw_email in literals:
+        try:
+            parsed_emails.append(IMAPExtractor.parse_email(BytesParser(policy=default).parsebytes(raw_email)))
+        except Exception as e:
+            logging.error(f"Error parsing email {uid}: {str(e)}")
+    return parsed_emails
+
+
+def quote(value: str) -> str:
+    """Quote a string argument of an IMAP command."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
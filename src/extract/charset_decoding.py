@@ -0,0 +1,190 @@
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import chardet
+
+# Encodings tried, in order, when the declared charset is missing or wrong
+LIKELY_ENCODINGS = ("utf-8", "windows-1256", "iso-8859-6")
+
+# Single-byte Arabic code pages decode almost any bytes, so their output is checked for Arabic text
+ARABIC_CODE_PAGES = {"windows-1256", "cp1256", "iso-8859-6"}
+
+# The number of bytes passed to chardet, and of decoded characters checked for Arabic text
+DETECTION_SAMPLE_SIZE = 8 * 1024
+
+# The number of windows the sample is spread over, from the first non-ASCII byte to the end of the body
+DETECTION_WINDOWS = 4
+
+# The share of the non-ASCII letters that must be Arabic for an Arabic code page to be accepted
+ARABIC_LETTER_RATIO = 0.6
+
+_HIGH_BYTE = re.compile(rb"[\x80-\xff]")
+_NON_ASCII_CHAR = re.compile(r"[^\x00-\x7f]")
+_ARABIC_LETTER = re.compile(r"[\u0600-\u06FF\u0750-\u077F\uFB50-\uFDFF\uFE70-\uFEFF]")
+_NON_ASCII_LETTER = re.compile(r"[^\W\d_a-zA-Z]")
+# Latin text decoded with an Arabic code page has Arabic letters inside Latin words
+_MIXED_SCRIPT = re.compile(r"[a-zA-Z][\u0600-\u06FF]|[\u0600-\u06FF][a-zA-Z]")
+
+
+class BodyDecoder:
+    """
+    Decodes message bodies, falling back from the declared charset to likely encodings,
+    then to charset detection on a bounded sample.
+
+    Samples skip the leading ASCII, such as the <style> head of an HTML body, and are spread
+    across the rest of the body, so that they hold the bytes telling encodings apart. When
+    detection on the sample only finds ASCII in a body with non-ASCII bytes, it runs again
+    on the whole body. ASCII is never cached, since it cannot decode such bodies.
+
+    The encoding found for a cache key, such as the sender domain, is tried first the next
+    time, so detection runs at most once per sender in the common case. Every decode is
+    counted and timed by the path that produced it: "declared", "cached", the likely
+    encoding, "detected" or "failed".
+
+    Attributes:
+        likely_encodings (Sequence[str]): The encodings tried before detection.
+        sample_size (int): The number of bytes passed to chardet.
+        cache (Dict[str, str]): The encoding that last worked for each cache key.
+        counts (Counter): The number of bodies decoded by each path.
+        seconds (Counter): The time spent decoding by each path.
+    """
+
+    def __init__(
+        self, likely_encodings: Sequence[str] = LIKELY_ENCODINGS, sample_size: int = DETECTION_SAMPLE_SIZE
+    ) -> None:
+        """
+        Initializes the BodyDecoder.
+
+        Args:
+            likely_encodings (Sequence[str]): The encodings tried before detection.
+            sample_size (int): The number of bytes passed to chardet.
+        """
+        self.likely_encodings = likely_encodings
+        self.sample_size = sample_size
+        self.cache: Dict[str, str] = {}
+        self.counts: Counter = Counter()
+        self.seconds: Counter = Counter()
+
+    def decode(self, body: bytes, encoding: Optional[str] = None, cache_key: Optional[str] = None) -> Optional[str]:
+        """
+        Decodes a body.
+
+        Args:
+            body (bytes): The body to decode.
+            encoding (Optional[str]): The charset declared in the Content-Type header, if any.
+            cache_key (Optional[str]): The key to cache the working encoding under, e.g. the sender domain.
+
+        Returns:
+            Optional[str]: The decoded body, or None if no encoding could be found.
+        """
+        start_time = time.perf_counter()
+        path, text = self._decode(body, encoding, cache_key)
+        self.counts[path] += 1
+        self.seconds[path] += time.perf_counter() - start_time
+        return text
+
+    def _decode(self, body: bytes, encoding: Optional[str], cache_key: Optional[str]) -> Tuple[str, Optional[str]]:
+        if encoding:
+            text = self._try_decode(body, encoding)
+            if text is not None:
+                return "declared", text
+
+        # A strict UTF-8 decode rarely succeeds on anything else, so it goes ahead of a cached
+        # single-byte code page that would decode any bytes
+        cached_encoding = self.cache.get(cache_key) if cache_key else None
+        candidates: List[Tuple[str, str]] = [("utf-8", "utf-8")] if "utf-8" in self.likely_encodings else []
+        if cached_encoding:
+            candidates.append((cached_encoding, "cached"))
+        candidates += [(candidate, candidate) for candidate in self.likely_encodings if candidate != "utf-8"]
+
+        for candidate, path in candidates:
+            text = self._try_decode(body, candidate)
+            if text is not None and (candidate.lower() not in ARABIC_CODE_PAGES or self._looks_arabic(text)):
+                if cache_key and path != "cached":
+                    self.cache[cache_key] = candidate
+                return path, text
+
+        first_high_byte = _HIGH_BYTE.search(body)
+        start = first_high_byte.start() if first_high_byte else 0
+        detected = chardet.detect(self._spread_sample(body, start))["encoding"]
+        if first_high_byte and self._is_inconclusive(detected) and len(body) - start > self.sample_size:
+            detected = chardet.detect(body)["encoding"]
+        if not detected or (first_high_byte and self._is_inconclusive(detected)):
+            return "failed", None
+        try:
+            text = body.decode(detected, errors="replace")
+        except LookupError:
+            return "failed", None
+        if cache_key and not self._is_inconclusive(detected):
+            self.cache[cache_key] = detected
+        return "detected", text
+
+    def _spread_sample(self, data: Sequence, start: int) -> Sequence:
+        """
+        Samples at most sample_size bytes or characters of data from start, in DETECTION_WINDOWS
+        windows spread evenly up to its end.
+        """
+        if len(data) - start <= self.sample_size:
+            return data[start:]
+        window_size = self.sample_size // DETECTION_WINDOWS
+        step = (len(data) - start - window_size) // (DETECTION_WINDOWS - 1)
+        windows = [data[start + i * step : start + i * step + window_size] for i in range(DETECTION_WINDOWS)]
+        return windows[0][:0].join(windows)
+
+    @staticmethod
+    def _is_inconclusive(encoding: Optional[str]) -> bool:
+        """Whether a detected encoding cannot decode non-ASCII bytes, e.g. "ascii"."""
+        return not encoding or encoding.lower().replace("-", "") in {"ascii", "usascii"}
+
+    @staticmethod
+    def _try_decode(body: bytes, encoding: str) -> Optional[str]:
+        try:
+            return body.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            return None
+
+    def _looks_arabic(self, text: str) -> bool:
+        first_non_ascii = _NON_ASCII_CHAR.search(text)
+        if first_non_ascii is None:
+            return False
+        sample = self._spread_sample(text, first_non_ascii.start())
+        non_ascii_letters = len(_NON_ASCII_LETTER.findall(sample))
+        arabic_letters = len(_ARABIC_LETTER.findall(sample))
+        return (
+            non_ascii_letters > 0
+            and arabic_letters >= ARABIC_LETTER_RATIO * non_ascii_letters
+            and len(_MIXED_SCRIPT.findall(sample)) * 10 < arabic_letters
+        )
+
+    def pop_stats(self) -> Tuple[Counter, Counter]:
+        """
+        Returns the decode counts and seconds per path, and resets them.
+
+        Returns:
+            Tuple[Counter, Counter]: The counts and seconds per path since the last call.
+        """
+        counts, seconds = self.counts, self.seconds
+        self.counts, self.seconds = Counter(), Counter()
+        return counts, seconds
+
+
+def format_decode_stats(counts: Counter, seconds: Counter) -> str:
+    """
+    Formats the decode counts and seconds per path for logging.
+
+    Args:
+        counts (Counter): The number of bodies decoded by each path.
+        seconds (Counter): The time spent decoding by each path.
+
+    Returns:
+        str: One line per path, most frequent first.
+    """
+    return "\n\t".join(
+        f"{path}: {count} bodies in {seconds[path]:.2f}s" for path, count in counts.most_common()
+    )
+
+
+# The decoder shared by parse_body within a process
+body_decoder = BodyDecoder()
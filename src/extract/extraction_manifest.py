@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional, Set
+
+import pypff
+
+from src.extract.parsing_utils import parse_identifiers
+from src.extract.pst_parsing_utils import safe_getattr
+
+# Bytes hashed from each end of a .pst file when fingerprinting it
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+
+# The MAPI property tag of the display name of the message store
+PR_DISPLAY_NAME = 0x3001
+
+
+class ExtractionManifest:
+    """
+    An on-disk record of the messages already extracted from .pst files.
+
+    Messages are keyed by the fingerprint of the .pst file they were read from plus their pypff
+    identifier, and by their Message-ID so that overlapping exports of the same mailbox are
+    recognised too. The latest delivery time extracted from each folder of each mailbox is kept as
+    a watermark, so that older messages of the same folder in a later export of the mailbox can
+    be skipped before their headers or bodies are read.
+
+    Attributes:
+        path (str): The path to the manifest JSON file.
+        file_identifiers (Dict[str, Set[int]]): The extracted pypff identifiers per file fingerprint.
+        message_ids (Set[str]): The extracted Message-IDs.
+        watermarks (Dict[str, int]): The latest PST delivery timestamp per watermark_key of a
+            message store name and folder path.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initializes the manifest, loading it from disk if it exists.
+
+        Args:
+            path (str): The path to the manifest JSON file.
+        """
+        self.path = path
+        self.file_identifiers: Dict[str, Set[int]] = {}
+        self.message_ids: Set[str] = set()
+        self.watermarks: Dict[str, int] = {}
+
+        if os.path.exists(path):
+            with open(path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            self.file_identifiers = {
+                fingerprint: set(identifiers) for fingerprint, identifiers in manifest["file_identifiers"].items()
+            }
+            self.message_ids = set(manifest["message_ids"])
+            self.watermarks = manifest["watermarks"]
+            logging.info(f"Loaded extraction manifest with {len(self.message_ids)} messages from {path}")
+
+    @staticmethod
+    def fingerprint(file_path: str) -> str:
+        """
+        Fingerprints a .pst file from its size and the bytes at either end.
+
+        Hashing the whole file would cost as much as reading it, while the size and the header
+        and tail blocks change whenever the export does.
+
+        Args:
+            file_path (str): The path to the .pst file.
+
+        Returns:
+            str: The hex digest of the fingerprint.
+        """
+        size = os.path.getsize(file_path)
+        digest = hashlib.sha1(str(size).encode())
+        with open(file_path, "rb") as pst_file:
+            digest.update(pst_file.read(FINGERPRINT_SAMPLE_SIZE))
+            pst_file.seek(max(0, size - FINGERPRINT_SAMPLE_SIZE))
+            digest.update(pst_file.read(FINGERPRINT_SAMPLE_SIZE))
+        return digest.hexdigest()
+
+    @staticmethod
+    def store_name(pst: pypff.file) -> Optional[str]:
+        """
+        Reads the display name of the message store of a .pst file.
+
+        Unlike the fingerprint, the store name is kept by every export of a mailbox, so it
+        relates the folders of a new monthly export to those of the previous ones.
+
+        Args:
+            pst (pypff.file): The opened .pst file.
+
+        Returns:
+            Optional[str]: The display name, or None if the message store has none.
+        """
+        store = safe_getattr(pst, "get_message_store")
+        for record_set in safe_getattr(store, "record_sets", []):
+            for entry in record_set.entries:
+                if safe_getattr(entry, "get_entry_type") == PR_DISPLAY_NAME:
+                    return safe_getattr(entry, "get_data_as_string") or None
+        return None
+
+    @staticmethod
+    def watermark_key(store_name: str, folder_name: str) -> str:
+        """
+        Keys the watermark of a folder of a mailbox.
+
+        Folder names alone would share a watermark between the Inbox of every mailbox, so a
+        message older than the latest one of another mailbox would be skipped.
+
+        Args:
+            store_name (str): The display name of the message store, see store_name.
+            folder_name (str): The path of the folder, e.g. "Inbox/Projects".
+
+        Returns:
+            str: The key of the folder's watermark.
+        """
+        return f"{store_name}/{folder_name}"
+
+    def is_recorded(
+        self, fingerprint: Optional[str], store_name: Optional[str], folder_name: str, message: pypff.message
+    ) -> bool:
+        """
+        Checks whether a message was already extracted, without reading its headers or body.
+
+        The pypff identifier within the same file is checked first, then the folder's delivery
+        time watermark. Messages that pass both are checked by Message-ID with has_message_id,
+        once their headers are scanned.
+
+        Args:
+            fingerprint (Optional[str]): The fingerprint of the .pst file holding the message.
+            store_name (Optional[str]): The display name of the message store holding the message.
+            folder_name (str): The path of the folder holding the message.
+            message (pypff.message): The message to check.
+
+        Returns:
+            bool: Whether the message was already extracted.
+        """
+        if fingerprint in self.file_identifiers:
+            if safe_getattr(message, "identifier") in self.file_identifiers[fingerprint]:
+                return True
+
+        watermark = self.watermarks.get(self.watermark_key(store_name, folder_name)) if store_name else None
+        if watermark is not None:
+            delivery_time = safe_getattr(message, "get_delivery_time_as_integer")
+            if delivery_time and delivery_time <= watermark:
+                return True
+        return False
+
+    def has_message_id(self, headers: Dict[str, str]) -> bool:
+        """
+        Checks whether a message was already extracted by its Message-ID.
+
+        Args:
+            headers (Dict[str, str]): The transport headers of the message, see parse_headers.
+
+        Returns:
+            bool: Whether a message with the same Message-ID was already extracted.
+        """
+        message_id = parse_identifiers(headers.get("message-id", None))
+        return bool(message_id) and message_id in self.message_ids
+
+    def add_messages(self, fingerprint: Optional[str], identifiers: Iterable[int], message_ids: Iterable[str]) -> None:
+        """
+        Records extracted messages.
+
+        Args:
+            fingerprint (Optional[str]): The fingerprint of the .pst file the messages were read from.
+            identifiers (Iterable[int]): The pypff identifiers of the messages.
+            message_ids (Iterable[str]): The Message-IDs of the messages.
+        """
+        if fingerprint:
+            self.file_identifiers.setdefault(fingerprint, set()).update(identifiers)
+        self.message_ids.update(message_id for message_id in message_ids if message_id)
+
+    def advance_watermark(self, store_name: Optional[str], folder_name: str, delivery_time: Optional[int]) -> None:
+        """
+        Moves a folder's watermark forward to the given delivery time.
+
+        Only call this once every message of the folder up to that time has been extracted, without
+        parse errors.
+
+        Args:
+            store_name (Optional[str]): The display name of the message store holding the folder.
+                Without one, no watermark is kept.
+            folder_name (str): The path of the folder.
+            delivery_time (Optional[int]): The latest PST delivery timestamp extracted from the folder.
+        """
+        if not store_name:
+            return
+        key = self.watermark_key(store_name, folder_name)
+        if delivery_time and delivery_time > self.watermarks.get(key, 0):
+            self.watermarks[key] = delivery_time
+
+    def save(self) -> None:
+        """Writes the manifest to disk, replacing the previous version atomically."""
+        manifest = {
+            "file_identifiers": {
+                fingerprint: sorted(identifiers) for fingerprint, identifiers in self.file_identifiers.items()
+            },
+            "message_ids": sorted(self.message_ids),
+            "watermarks": self.watermarks,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, self.path)
+        logging.info(f"Saved extraction manifest with {len(self.message_ids)} messages to {self.path}")
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import multiprocessing as mp
+import os
+import re
+from typing import Dict, Optional
+
+import html2text
+import pandas as pd
+from tqdm import tqdm
+
+try:
+    import lxml.html as lxml_html
+except ImportError:  # The fast extractor is optional, html2text handles every body without it
+    lxml_html = None
+
+# Below this many bodies to convert, starting worker processes costs more than it saves
+MIN_PARALLEL_CONVERSIONS = 64
+
+# Markup that html2text lays out and the fast extractor would flatten
+COMPLEX_MARKUP = re.compile(r"<\s*(?:table|ul|ol|dl|pre|blockquote|h[1-6])\b", re.IGNORECASE)
+PARAGRAPH_TAGS = ["p", "div", "hr", "h1", "h2", "h3", "h4", "h5", "h6"]
+LINE_TAGS = ["br", "li", "tr"]
+NON_TEXT_TAGS = ["head", "script", "style", "title"]
+
+
+def new_html_converter() -> html2text.HTML2Text:
+    """
+    Creates an html2text converter ignoring links, images and emphasis.
+
+    A converter carries state from one body to the next, which changes the whitespace of
+    the following conversions, so each body gets a new one.
+    """
+    converter = html2text.HTML2Text()
+    converter.ignore_links = True
+    converter.ignore_images = True
+    converter.ignore_emphasis = True
+    return converter
+
+
+def content_hash(text: str) -> str:
+    """
+    Hashes a text, the key of its conversion in HTMLTextCache.
+
+    Args:
+        text (str): The text to hash.
+
+    Returns:
+        str: The hex digest of the text.
+    """
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def is_simple_markup(html: str) -> bool:
+    """Whether an HTML body has no tables, lists, quotes or headings for html2text to lay out."""
+    return COMPLEX_MARKUP.search(html) is None
+
+
+def fast_html_to_text(html: str) -> str:
+    """
+    Extracts the text of simple HTML with lxml, an order of magnitude faster than html2text.
+
+    Paragraphs are separated by blank lines, line breaks start new lines, and the whitespace
+    within lines is collapsed. Unlike html2text, the lines are not wrapped.
+
+    Args:
+        html (str): The HTML body.
+
+    Returns:
+        str: The text of the body.
+    """
+    if not html.strip():
+        return ""
+    try:
+        document = lxml_html.document_fromstring(html)
+    except (ValueError, lxml_html.etree.ParserError):
+        return new_html_converter().handle(html)
+
+    for element in list(document.iter(*NON_TEXT_TAGS)):
+        element.drop_tree()
+    for element in document.iter(*PARAGRAPH_TAGS):
+        element.tail = "\n\n" + (element.tail or "")
+    for element in document.iter(*LINE_TAGS):
+        element.tail = "\n" + (element.tail or "")
+    lines = (" ".join(line.split()) for line in document.text_content().splitlines())
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() + "\n"
+
+
+def html_to_text(html: str, fast: bool = False) -> str:
+    """
+    Converts an HTML body to text.
+
+    Args:
+        html (str): The HTML body.
+        fast (bool): Whether to extract the text of simple markup with lxml rather than
+            html2text, when lxml is installed.
+
+    Returns:
+        str: The text of the body.
+    """
+    if fast and lxml_html is not None and is_simple_markup(html):
+        return fast_html_to_text(html)
+    return new_html_converter().handle(html)
+
+
+def _html_to_text_fast(html: str) -> str:
+    """html_to_text with the fast extractor, for the process pool."""
+    return html_to_text(html, fast=True)
+
+
+class HTMLTextCache:
+    """
+    The text converted from each distinct HTML body, keyed by content hash and optionally
+    persisted to disk.
+
+    Marketing and notification emails repeat the same HTML thousands of times, so each body
+    only has to be converted once across batches and runs.
+
+    Attributes:
+        path (Optional[str]): The path to the cache JSON file, or None to keep it in memory.
+        texts (Dict[str, str]): The text converted from each HTML body, by content hash.
+        hits (int): The number of bodies found in the cache.
+        misses (int): The number of bodies converted.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Initializes the cache, loading it from disk if it exists.
+
+        Args:
+            path (Optional[str]): The path to the cache JSON file, or None to keep it in memory.
+        """
+        self.path = path
+        self.texts: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            with open(path, "r") as cache_file:
+                self.texts = json.load(cache_file)
+            logging.info(f"Loaded {len(self.texts)} converted HTML bodies from {path}")
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def save(self) -> None:
+        """Writes the cache to disk, replacing the previous version atomically."""
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as cache_file:
+            json.dump(self.texts, cache_file)
+        os.replace(temp_path, self.path)
+        logging.info(f"Saved {len(self.texts)} converted HTML bodies to {self.path}")
+
+
+def convert_html_bodies(
+    html_bodies: pd.Series,
+    cache: Optional[HTMLTextCache] = None,
+    num_processes: Optional[int] = None,
+    fast: bool = False,
+) -> pd.Series:
+    """
+    Converts HTML bodies to text, converting each distinct body once.
+
+    The bodies are deduplicated, looked up in the cache by content hash, and the remaining
+    ones are converted across a process pool.
+
+    Args:
+        html_bodies (pd.Series): The HTML bodies, without nulls.
+        cache (Optional[HTMLTextCache]): The cache of converted bodies, updated with the new
+            conversions. Defaults to a cache of this call only.
+        num_processes (Optional[int]): The number of worker processes, defaults to the CPU count.
+        fast (bool): Whether to extract the text of simple markup with lxml.
+
+    Returns:
+        pd.Series: The text of each body, with the index of html_bodies.
+    """
+    cache = HTMLTextCache() if cache is None else cache
+    codes, unique_bodies = pd.factorize(html_bodies)
+    hashes = [content_hash(body) for body in unique_bodies]
+    missing = [i for i, body_hash in enumerate(hashes) if body_hash not in cache.texts]
+    cache.hits += len(unique_bodies) - len(missing)
+    cache.misses += len(missing)
+    logging.info(
+        f"Converting {len(missing)} HTML bodies, {len(html_bodies) - len(missing)} of {len(html_bodies)} "
+        "were duplicates or already converted"
+    )
+
+    convert = _html_to_text_fast if fast else html_to_text
+    missing_bodies = [unique_bodies[i] for i in missing]
+    num_processes = num_processes or mp.cpu_count()
+    if num_processes > 1 and len(missing) >= MIN_PARALLEL_CONVERSIONS:
+        chunksize = max(1, len(missing) // (4 * num_processes))
+        with mp.get_context("spawn").Pool(processes=num_processes) as pool:
+            texts = list(tqdm(pool.imap(convert, missing_bodies, chunksize=chunksize), total=len(missing)))
+    else:
+        texts = [convert(body) for body in tqdm(missing_bodies, disable=len(missing) < MIN_PARALLEL_CONVERSIONS)]
+    cache.texts.update((hashes[i], text) for i, text in zip(missing, texts))
+
+    unique_texts = pd.Series([cache.texts[body_hash] for body_hash in hashes], dtype=object)
+    return pd.Series(unique_texts.to_numpy()[codes], index=html_bodies.index, dtype=object)
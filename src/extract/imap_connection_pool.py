@@ -0,0 +1,119 @@
+import imaplib
+import logging
+import queue
+import threading
+from typing import Callable, List, TypeVar
+
+T = TypeVar("T")
+
+# The errors after which a connection is discarded and the task retried on a new one
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError)
+
+
+class IMAPConnectionPool:
+    """
+    A pool of authenticated IMAP connections shared by worker threads.
+
+    Connections are opened lazily, up to size, and each one is used by a single task at a
+    time, so every task selects its own folder. When a connection drops, the task is retried
+    on a freshly opened connection.
+
+    Attributes:
+        connect (Callable[[], imaplib.IMAP4]): Opens and authenticates a new connection.
+        size (int): The maximum number of open connections.
+        max_retries (int): The number of times a task is retried after a connection error.
+    """
+
+    def __init__(self, connect: Callable[[], imaplib.IMAP4], size: int, max_retries: int = 3) -> None:
+        """
+        Initializes the pool without opening any connection.
+
+        Args:
+            connect (Callable[[], imaplib.IMAP4]): Opens and authenticates a new connection.
+            size (int): The maximum number of open connections.
+            max_retries (int): The number of times a task is retried after a connection error.
+        """
+        self.connect = connect
+        self.size = size
+        self.max_retries = max_retries
+        self.idle: "queue.LifoQueue[imaplib.IMAP4]" = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self) -> imaplib.IMAP4:
+        """
+        Takes an idle connection, opening one if none is idle, waiting if all are in use.
+
+        Returns:
+            imaplib.IMAP4: The connection, to be given back with release.
+        """
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self.connect()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, imap: imaplib.IMAP4, broken: bool = False) -> None:
+        """
+        Gives a connection back to the pool.
+
+        Args:
+            imap (imaplib.IMAP4): The connection.
+            broken (bool): Whether the connection failed, in which case it is closed instead.
+        """
+        if broken:
+            try:
+                imap.shutdown()
+            except Exception:
+                pass
+        else:
+            self.idle.put(imap)
+        self.slots.release()
+
+    def run(self, task: Callable[[imaplib.IMAP4], T]) -> T:
+        """
+        Runs a task on a pooled connection, reconnecting and retrying if the connection drops.
+
+        The task must be safe to repeat from the start, e.g. by selecting its folder first.
+
+        Args:
+            task (Callable[[imaplib.IMAP4], T]): The task, called with the connection.
+
+        Returns:
+            T: The result of the task.
+        """
+        attempt = 0
+        while True:
+            imap = self.acquire()
+            try:
+                result = task(imap)
+            except CONNECTION_ERRORS as e:
+                self.release(imap, broken=True)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logging.warning(f"IMAP connection lost ({e}), retrying on a new connection")
+                continue
+            except BaseException:
+                self.release(imap)
+                raise
+            self.release(imap)
+            return result
+
+    def close(self) -> None:
+        """Logs out of every idle connection."""
+        connections: List[imaplib.IMAP4] = []
+        while True:
+            try:
+                connections.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        for imap in connections:
+            try:
+                imap.logout()
+            except Exception:
+                pass
@@ -2,18 +2,31 @@ import email
 import imaplib
 import logging
 import re
+import threading
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from email.parser import BytesParser
 from email.policy import default
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
 
 import pandas as pd
 from tqdm.auto import tqdm
 
-from src.extract.imap_parsing_utils import decode_str, parse_timestamp
+from src.extract.imap_connection_pool import CONNECTION_ERRORS, IMAPConnectionPool
+from src.extract.imap_parsing_utils import (
+    BodyPart,
+    decode_str,
+    decode_transfer_encoding,
+    parse_bodystructure,
+    parse_fetch_response,
+    parse_timestamp,
+)
+from src.extract.imap_sync_state import IMAPSyncState
+from src.extract.message_id_index import MessageIdIndex
 from src.extract.parsing_utils import (
-    charset_from_content_type,
+    INTERNAL_DOMAINS,
     parse_addresses,
     parse_domain_info,
     parse_email_threading,
@@ -23,6 +36,51 @@ from src.extract.parsing_utils import (
 
 logging.basicConfig(level=logging.INFO)
 
+# The headers needed for the identifier, address and timestamp columns
+HEADER_FIELDS = ["MESSAGE-ID", "IN-REPLY-TO", "REFERENCES", "FROM", "TO", "CC", "BCC", "SUBJECT", "DATE", "RECEIVED"]
+
+# The number of messages requested per UID FETCH when fetching headers or bodies
+FETCH_CHUNK_SIZE = 500
+
+# The number of UIDs of a folder fetched by one pooled connection at a time when extracting
+# with several connections
+UID_RANGE_SIZE = 2000
+
+# The body parts downloaded by selective fetching, every other part is recorded as an attachment
+TEXT_BODY_TYPES = ("text/plain", "text/html")
+
+# The number of Message-IDs combined into one nested OR search query
+MESSAGE_ID_SEARCH_BATCH_SIZE = 50
+
+# How fetch_emails_by_message_ids finds the UIDs of Message-IDs: batched SEARCH queries, or
+# an index of every Message-ID header of the folder
+MESSAGE_ID_LOOKUPS = ("search", "index")
+
+T = TypeVar("T")
+
+
+def compress_uids(uids: List[str]) -> str:
+    """
+    Build an IMAP message set from UIDs, collapsing consecutive UIDs into ranges.
+
+    Parameters:
+    ----------
+    uids : List[str]
+        The UIDs, in any order.
+
+    Returns:
+    -------
+    str
+        The message set, e.g. "1000:1499,1503,1507:1510".
+    """
+    ranges = []
+    for uid in sorted(int(uid) for uid in uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(start) if start == stop else f"{start}:{stop}" for start, stop in ranges)
+
 
 class IMAPExtractor:
     """
@@ -36,13 +94,47 @@ class IMAPExtractor:
         The email account password.
     server : str
         The IMAP server address (default: 'imap.gmail.com').
+    port : Optional[int]
+        The IMAP server port (default: the imaplib default for the connection type).
+    ssl : bool
+        Whether to connect over SSL (default: True).
+    fetch_chunk_size : int
+        The number of messages requested per UID FETCH (default: FETCH_CHUNK_SIZE).
+    message_id_lookup : str
+        How Message-IDs are resolved to UIDs, one of MESSAGE_ID_LOOKUPS (default: 'search').
+    message_id_index : MessageIdIndex
+        The Message-ID to UID cache of each folder.
+    sync_state : IMAPSyncState
+        The highest extracted UID of each folder, used by incremental extraction.
+    selective_fetch : bool
+        Whether only the text parts of emails are downloaded, guided by their BODYSTRUCTURE.
+    transfer_stats : Counter
+        The messages, message bytes, downloaded bytes and attachments seen by selective fetching.
+    pool : IMAPConnectionPool
+        The connections used to extract folders and UID ranges concurrently.
     imap : IMAP4_SSL
-        The IMAP connection object.
+        The pooled connection of the current pool task, or else a connection borrowed from
+        the pool for direct use, which the extraction methods give back before running their
+        folders as pool tasks.
     """
 
-    def __init__(self, username: str, password: str, server: str = "imap.gmail.com"):
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        server: str = "imap.gmail.com",
+        port: Optional[int] = None,
+        ssl: bool = True,
+        fetch_chunk_size: int = FETCH_CHUNK_SIZE,
+        message_id_lookup: str = "search",
+        message_id_index_path: Optional[str] = None,
+        num_connections: int = 1,
+        sync_state_path: Optional[str] = None,
+        selective_fetch: bool = False,
+        internal_domains: Optional[List[str]] = None,
+    ):
         """
-        Initialize the IMAPExtractor with credentials and establish an IMAP connection.
+        Initialize the IMAPExtractor with credentials and borrow a connection from its pool.
 
         Parameters:
         ----------
@@ -52,28 +144,131 @@ class IMAPExtractor:
             The email account password.
         server : str, optional
             The IMAP server address (default: 'imap.gmail.com').
+        port : Optional[int], optional
+            The IMAP server port (default: 993 with SSL, 143 without).
+        ssl : bool, optional
+            Whether to connect over SSL, disable for a local test server (default: True).
+        fetch_chunk_size : int, optional
+            The number of messages requested per UID FETCH (default: FETCH_CHUNK_SIZE).
+        message_id_lookup : str, optional
+            'search' to look Message-IDs up with nested OR SEARCH queries, or 'index' to
+            download the Message-ID header of every message of a folder once and resolve
+            them locally, which pays off when looking up many IDs (default: 'search').
+        message_id_index_path : Optional[str], optional
+            The JSON file in which the Message-ID to UID cache is kept between runs
+            (default: None, kept in memory only).
+        num_connections : int, optional
+            The number of connections used to extract folders, and UID ranges of large
+            folders, concurrently when extracting by date (default: 1).
+        sync_state_path : Optional[str], optional
+            The JSON file in which the highest extracted UID of each folder is kept between
+            incremental runs (default: None, kept in memory only).
+        selective_fetch : bool, optional
+            Fetch the BODYSTRUCTURE of emails first and download only their text/plain and
+            text/html parts, recording the other parts in an attachments column as name,
+            content type and size (default: False, the whole emails are downloaded).
+        internal_domains : Optional[List[str]], optional
+            The substrings marking a sender domain as internal (default: INTERNAL_DOMAINS).
         """
+        if message_id_lookup not in MESSAGE_ID_LOOKUPS:
+            raise ValueError(f"message_id_lookup must be one of {MESSAGE_ID_LOOKUPS}")
+
         self.username = username
         self.password = password
         self.server = server
-        self.imap = imaplib.IMAP4_SSL(self.server)
-        self.imap.login(self.username, self.password)
+        self.port = port
+        self.ssl = ssl
+        self.fetch_chunk_size = fetch_chunk_size
+        self.message_id_lookup = message_id_lookup
+        self.message_id_index = MessageIdIndex(message_id_index_path)
+        self.sync_state = IMAPSyncState(sync_state_path)
+        self.selective_fetch = selective_fetch
+        self.internal_domains = INTERNAL_DOMAINS if internal_domains is None else internal_domains
+        self.transfer_stats: Counter = Counter()
+        self.stats_lock = threading.Lock()
+        self.pool = IMAPConnectionPool(self.connect, num_connections)
+        self._local = threading.local()
+        # Logging in now reports bad credentials early, and the connection stays one of the pool's
+        self._imap: Optional[imaplib.IMAP4] = self.pool.acquire()
+
+    @property
+    def imap(self) -> imaplib.IMAP4:
+        """The connection of the pool task running on this thread, or the one borrowed from the pool."""
+        task_imap = getattr(self._local, "imap", None)
+        if task_imap is not None:
+            return task_imap
+        if self._imap is None:
+            self._imap = self.pool.acquire()
+        return self._imap
+
+    def release_imap(self) -> None:
+        """Give the borrowed connection back to the pool, so that pool tasks can use every connection."""
+        if self._imap is not None:
+            self.pool.release(self._imap)
+            self._imap = None
+
+    def connect(self) -> imaplib.IMAP4:
+        """
+        Open and authenticate a new IMAP connection.
+
+        Returns:
+        -------
+        imaplib.IMAP4
+            The logged in connection.
+        """
+        imap_class = imaplib.IMAP4_SSL if self.ssl else imaplib.IMAP4
+        imap = imap_class(self.server, self.port) if self.port else imap_class(self.server)
+        imap.login(self.username, self.password)
+        # With CONDSTORE enabled, SELECT reports the HIGHESTMODSEQ of the folder
+        if "CONDSTORE" in imap.capabilities and "ENABLE" in imap.capabilities:
+            imap.enable("CONDSTORE")
+        return imap
 
     def __del__(self):
         """Destructor method to close the IMAP connection when the object is destroyed."""
         self.close()
 
     def close(self):
-        """Logout and close the IMAP connection."""
+        """Logout and close the IMAP connections."""
         try:
-            self.imap.logout()
+            self.release_imap()
+            self.pool.close()
         except:
             pass
 
+    def run_on_pool(self, method: Callable[..., T], *args: Any) -> T:
+        """
+        Run an extractor method on a pooled connection, retried on a new one if it drops.
+
+        While the method runs, self.imap refers to the pooled connection on this thread.
+
+        Parameters:
+        ----------
+        method : Callable[..., T]
+            The method, which must select its folder itself.
+        *args : Any
+            The arguments of the method.
+
+        Returns:
+        -------
+        T
+            The result of the method.
+        """
+
+        def task(imap: imaplib.IMAP4) -> T:
+            self._local.imap = imap
+            try:
+                return method(*args)
+            finally:
+                self._local.imap = None
+
+        return self.pool.run(task)
+
     def list_mailboxes(self) -> None:
         """List all available mailboxes (folders) in the IMAP account."""
+        self.release_imap()
         print("Available mailboxes:")
-        for i, folder_info in enumerate(self.imap.list()[1], 1):
+        for i, folder_info in enumerate(self.pool.run(lambda imap: imap.list()[1]), 1):
             if not isinstance(folder_info, bytes):
                 continue
             folder = folder_info.decode().split('"')[1]
@@ -84,10 +279,15 @@ class IMAPExtractor:
         folders: List[str],
         message_ids: Optional[Set[str]] = None,
         since: Optional[datetime] = None,
+        headers_only: bool = False,
+        incremental: bool = False,
     ) -> pd.DataFrame:
         """
         Extract messages from the specified folders in the IMAP account.
 
+        Each folder is extracted as a task of the connection pool, so it is retried on a new
+        connection if the connection drops.
+
         Parameters:
         ----------
         folders : List[str]
@@ -96,6 +296,14 @@ class IMAPExtractor:
             Set of specific Message-IDs to fetch (default is None).
         since : Optional[datetime], optional
             Fetch emails since this date (default is None).
+        headers_only : bool, optional
+            Fetch only the headers of the emails since the given date, leaving out the body
+            columns and adding the imap_folder and imap_uid columns that fetch_bodies uses to
+            download the bodies later (default is False).
+        incremental : bool, optional
+            Fetch only the messages that arrived since the previous incremental run, tracked
+            per folder in sync_state. Folders never synced before, or whose UIDVALIDITY
+            changed, are fetched in full, or since the given date if any (default is False).
 
         Returns:
         -------
@@ -105,22 +313,41 @@ class IMAPExtractor:
         emails_list = []
         start_time = time.time()
         found_message_ids: Set[str] = set()
+        if message_ids:
+            message_ids = {message_id.strip("<>") for message_id in message_ids}
+        elif not since and not incremental and folders:
+            raise ValueError("Either message_ids, since or incremental must be provided")
 
-        for folder in folders:
+        def fetch_folder(folder: str, remaining_message_ids: Set[str]) -> Tuple[List[Dict[str, Any]], Set[str]]:
             self.imap.select(folder, readonly=True)
+            if remaining_message_ids:
+                return self.fetch_emails_by_message_ids(folder, remaining_message_ids)
+            if headers_only:
+                return self.fetch_headers_since_date(folder, since), set()
+            return self.fetch_emails_since_date(since), set()
 
-            if message_ids:
-                remaining_message_ids = message_ids - found_message_ids
-                emails_list.extend(self.fetch_emails_by_message_ids(remaining_message_ids)[0])
-                found_message_ids.update(remaining_message_ids)
-            elif since:
-                emails_list.extend(self.fetch_emails_since_date(since))
-            else:
-                raise ValueError("Either message_ids or since must be provided")
+        self.release_imap()
+        if incremental and not message_ids:
+            emails_list.extend(self.sync_folders(folders, since, headers_only))
+            folders = []
+        elif since and not message_ids and self.pool.size > 1:
+            emails_list.extend(self.fetch_folders_in_parallel(folders, since, headers_only))
+            folders = []
+
+        for folder in folders:
+            remaining_message_ids = message_ids - found_message_ids if message_ids else set()
+            if message_ids and not remaining_message_ids:
+                break
+            fetched_emails, found_in_folder = self.run_on_pool(fetch_folder, folder, remaining_message_ids)
+            emails_list.extend(fetched_emails)
+            found_message_ids.update(found_in_folder)
+
+        if message_ids:
+            self.message_id_index.save()
 
         emails_df = pd.DataFrame(emails_list)
         emails_df = parse_email_threading(emails_df)
-        emails_df = parse_domain_info(emails_df)
+        emails_df = parse_domain_info(emails_df, self.internal_domains)
 
         processing_time = time.time() - start_time
         total_emails = len(emails_df)
@@ -129,6 +356,8 @@ class IMAPExtractor:
 
         logging.info(f"Total processing time: {processing_time:.2f} seconds")
         logging.info(f"Retrieved {total_emails} emails")
+        if self.selective_fetch and self.transfer_stats["messages"]:
+            logging.info(self.format_transfer_stats())
         if message_ids:
             logging.info(
                 f"Found {found_message_ids_count} out of {requested_message_ids_count} requested message IDs"
@@ -136,14 +365,21 @@ class IMAPExtractor:
 
         return emails_df
 
-    def fetch_emails_by_message_ids(self, message_ids: Set[str]) -> Tuple[List[Dict[str, Any]], Set[str]]:
+    def fetch_emails_by_message_ids(self, folder: str, message_ids: Set[str]) -> Tuple[List[Dict[str, Any]], Set[str]]:
         """
-        Fetch emails based on specific Message-IDs.
+        Fetch emails based on specific Message-IDs from the selected folder.
+
+        The Message-IDs are first resolved to UIDs through the Message-ID index, then the
+        unresolved ones are looked up with batched SEARCH queries or by extending the index
+        with the folder's newer messages, depending on message_id_lookup. The found emails
+        are then fetched in chunks.
 
         Parameters:
         ----------
+        folder : str
+            The name of the selected folder, under which the resolved UIDs are cached.
         message_ids : Set[str]
-            Set of specific Message-IDs to fetch.
+            Set of specific Message-IDs to fetch, without angle brackets.
 
         Returns:
         -------
@@ -152,29 +388,134 @@ class IMAPExtractor:
         """
         fetched_emails = []
         found_message_ids = set()
+        uid_validity = self.get_uid_validity()
+
+        if self.message_id_lookup == "index":
+            self.index_message_ids(folder, uid_validity)
+        uids = self.message_id_index.resolve(folder, uid_validity, message_ids)
+        if self.message_id_lookup == "search":
+            uids.update(self.search_message_ids(folder, uid_validity, sorted(message_ids - uids.keys())))
+
+        message_ids_by_uid = {uid: message_id for message_id, uid in uids.items()}
+        for uid, parsed_email in self.fetch_parsed_emails(list(message_ids_by_uid), "Fetching emails by Message-ID"):
+            fetched_emails.append(parsed_email)
+            found_message_ids.add(message_ids_by_uid[uid])
+
+        return fetched_emails, found_message_ids
+
+    def get_uid_validity(self) -> int:
+        """
+        Get the UIDVALIDITY reported when the current folder was selected.
+
+        Returns:
+        -------
+        int
+            The UIDVALIDITY of the selected folder, or 0 if the server did not report it.
+        """
+        _, data = self.imap.response("UIDVALIDITY")
+        return int(data[0]) if data and data[0] else 0
 
-        for message_id in tqdm(message_ids, desc="Fetching emails by Message-ID", leave=False):
+    def search_message_ids(self, folder: str, uid_validity: int, message_ids: List[str]) -> Dict[str, str]:
+        """
+        Look Message-IDs up in the selected folder with nested OR SEARCH queries.
+
+        Each query matches MESSAGE_ID_SEARCH_BATCH_SIZE Message-IDs, and the Message-ID
+        headers of the matches are then fetched to map them back to their UIDs.
+
+        Parameters:
+        ----------
+        folder : str
+            The name of the selected folder.
+        uid_validity : int
+            The UIDVALIDITY of the selected folder.
+        message_ids : List[str]
+            The Message-IDs to look up.
+
+        Returns:
+        -------
+        Dict[str, str]
+            The UID of each Message-ID found.
+        """
+        matched_uids: List[str] = []
+        batch_starts = range(0, len(message_ids), MESSAGE_ID_SEARCH_BATCH_SIZE)
+        for i in tqdm(batch_starts, desc="Searching Message-IDs", leave=False):
+            batch = message_ids[i : i + MESSAGE_ID_SEARCH_BATCH_SIZE]
+            keys = " ".join(
+                'HEADER Message-ID "{}"'.format(message_id.replace("\\", "\\\\").replace('"', '\\"'))
+                for message_id in batch
+            )
             try:
-                cleaned_message_id = message_id.strip("<>")
-                search_query = f'HEADER Message-ID "{cleaned_message_id}"'
-                result, data = self.imap.search(None, search_query)
-
-                if result == "OK" and data and data[0] and data[0].decode():
-                    email_ids = data[0].decode().split()
-                    for email_id in email_ids:
-                        email_data = self.fetch_and_parse_email(email_id)
-                        if email_data:
-                            fetched_emails.append(email_data)
-                            found_message_ids.add(cleaned_message_id)
-                            break
+                result, data = self.imap.uid("SEARCH", None, "OR " * (len(batch) - 1) + keys)
+                if result == "OK" and data and data[0]:
+                    matched_uids.extend(data[0].decode().split())
+            except CONNECTION_ERRORS:
+                raise
             except Exception as e:
-                logging.error(f"Error fetching email with Message-ID {message_id}: {e}")
+                logging.error(f"Error searching {len(batch)} Message-IDs in {folder}: {e}")
 
-        return fetched_emails, found_message_ids
+        pairs = self.fetch_message_id_headers(sorted(set(matched_uids)), "Mapping Message-IDs")
+        self.message_id_index.add(folder, uid_validity, pairs)
+        requested_message_ids = set(message_ids)
+        return {message_id: uid for message_id, uid in pairs if message_id in requested_message_ids}
+
+    def index_message_ids(self, folder: str, uid_validity: int) -> None:
+        """
+        Extend the Message-ID index of the selected folder with the messages not indexed yet.
+
+        Parameters:
+        ----------
+        folder : str
+            The name of the selected folder.
+        uid_validity : int
+            The UIDVALIDITY of the selected folder.
+        """
+        indexed_uid = self.message_id_index.folder(folder, uid_validity)["indexed_uid"]
+        try:
+            result, data = self.imap.uid("SEARCH", None, f"UID {indexed_uid + 1}:*")
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            logging.error(f"Error listing the UIDs of {folder}: {e}")
+            return
+        if result != "OK" or not data or not data[0]:
+            return
+
+        # "n:*" always matches the last message, even when its UID is below n
+        uids = [uid for uid in data[0].decode().split() if int(uid) > indexed_uid]
+        pairs = self.fetch_message_id_headers(uids, f"Indexing Message-IDs of {folder}")
+        # Only mark the folder as indexed up to the last UID if no chunk failed
+        complete = len(pairs) == len(uids)
+        self.message_id_index.add(
+            folder, uid_validity, pairs, max(int(uid) for uid in uids) if uids and complete else None
+        )
+
+    def fetch_message_id_headers(self, uids: List[str], desc: str) -> List[Tuple[str, str]]:
+        """
+        Fetch the Message-ID header of messages of the selected folder.
+
+        Parameters:
+        ----------
+        uids : List[str]
+            The UIDs of the messages.
+        desc : str
+            The progress bar description.
+
+        Returns:
+        -------
+        List[Tuple[str, str]]
+            The Message-ID and the UID of each fetched message.
+        """
+        return [
+            (parse_identifiers(raw_header.decode(errors="replace")), uid)
+            for uid, raw_header in self.fetch_uid_chunks(uids, "(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])", desc)
+        ]
 
     def fetch_emails_since_date(self, since: datetime) -> List[Dict[str, Any]]:
         """
-        Fetch emails since a specific date.
+        Fetch emails since a specific date from the selected folder.
+
+        The matching UIDs are fetched in chunks of fetch_chunk_size with one UID FETCH each,
+        and each chunk is parsed while the next one is being downloaded.
 
         Parameters:
         ----------
@@ -186,24 +527,577 @@ class IMAPExtractor:
         List[Dict[str, Any]]
             A list of fetched email data.
         """
-        fetched_emails = []
         date_string = since.strftime("%d-%b-%Y")  # Format date as "01-Jan-2023"
-
         try:
-            search_query = f'SINCE "{date_string}"'
-            result, data = self.imap.search(None, search_query)
-
-            if result == "OK" and data and data[0] and data[0].decode():
-                email_ids = data[0].decode().split()
-                for email_id in tqdm(email_ids, desc="Fetching emails", leave=False):
-                    email_data = self.fetch_and_parse_email(email_id)
-                    if email_data:
-                        fetched_emails.append(email_data)
+            return self.fetch_emails_by_uids(None, self.search_uids_since_date(since))
+        except CONNECTION_ERRORS:
+            raise
         except Exception as e:
             logging.error(f"Error fetching emails since {date_string}: {str(e)}")
+        return []
+
+    def fetch_headers_since_date(self, folder: str, since: datetime) -> List[Dict[str, Any]]:
+        """
+        Fetch only the headers of the emails since a specific date from the selected folder.
 
+        Parameters:
+        ----------
+        folder : str
+            The name of the selected folder, recorded so the bodies can be fetched later.
+        since : datetime
+            Date from which to fetch emails.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed email headers.
+        """
+        date_string = since.strftime("%d-%b-%Y")  # Format date as "01-Jan-2023"
+        try:
+            return self.fetch_emails_by_uids(folder, self.search_uids_since_date(since), headers_only=True)
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            logging.error(f"Error fetching headers since {date_string}: {str(e)}")
+        return []
+
+    def fetch_bodies(self, emails_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fetch and decode the bodies of emails previously extracted with headers_only.
+
+        Only the emails in the given DataFrame are downloaded, so filtering the headers first
+        (external senders, duplicates, date range) avoids fetching bodies that would be dropped.
+        Each folder is fetched as a task of the connection pool.
+
+        Parameters:
+        ----------
+        emails_df : pd.DataFrame
+            DataFrame of parsed headers with the imap_folder and imap_uid columns.
+
+        Returns:
+        -------
+        pd.DataFrame
+            The DataFrame with the html_body and plain_text_body columns added.
+        """
+
+        def fetch_folder_bodies(folder: str, uids: List[str]) -> List[Dict[str, Any]]:
+            self.imap.select(folder, readonly=True)
+            return [
+                {
+                    "imap_folder": folder,
+                    "imap_uid": uid,
+                    "html_body": parsed_email["html_body"],
+                    "plain_text_body": parsed_email["plain_text_body"],
+                }
+                for uid, parsed_email in self.fetch_parsed_emails(uids, f"Fetching bodies from {folder}")
+            ]
+
+        self.release_imap()
+        bodies = []
+        for folder, folder_df in emails_df.groupby("imap_folder"):
+            bodies.extend(self.run_on_pool(fetch_folder_bodies, folder, folder_df["imap_uid"].tolist()))
+
+        bodies_df = pd.DataFrame(bodies, columns=["imap_folder", "imap_uid", "html_body", "plain_text_body"])
+        return emails_df.merge(bodies_df, on=["imap_folder", "imap_uid"], how="left")
+
+    def sync_folders(
+        self, folders: List[str], since: Optional[datetime], headers_only: bool
+    ) -> List[Dict[str, Any]]:
+        """
+        Fetch the messages that arrived in several folders since the previous incremental run.
+
+        The folders are synced concurrently over the connection pool, and the sync state is
+        saved once all of them are done.
+
+        Parameters:
+        ----------
+        folders : List[str]
+            List of folder names from which to extract emails.
+        since : Optional[datetime]
+            Date from which to fetch emails of the folders that have no sync state yet.
+        headers_only : bool
+            Fetch only the headers, adding the imap_folder and imap_uid columns.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed emails, or of parsed email headers with headers_only.
+        """
+        fetched_emails = []
+        self.release_imap()
+        with ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            syncs = [
+                executor.submit(self.run_on_pool, self.sync_folder, folder, since, headers_only) for folder in folders
+            ]
+            for folder, sync in zip(folders, syncs):
+                try:
+                    fetched_emails.extend(sync.result())
+                except Exception as e:
+                    logging.error(f"Error syncing {folder}: {str(e)}")
+        self.sync_state.save()
         return fetched_emails
 
+    def sync_folder(self, folder: str, since: Optional[datetime], headers_only: bool) -> List[Dict[str, Any]]:
+        """
+        Select a folder and fetch the messages above the highest UID extracted from it.
+
+        The folder is skipped without any search when its UIDNEXT, or its HIGHESTMODSEQ on
+        servers supporting CONDSTORE, shows that nothing arrived. The sync state only moves
+        forward when every new message was downloaded, so failed chunks are retried next run.
+        Messages that were downloaded but cannot be parsed are logged and left behind, since
+        fetching them again would fail the same way.
+
+        Parameters:
+        ----------
+        folder : str
+            The name of the folder.
+        since : Optional[datetime]
+            Date from which to fetch emails if the folder has to be synced from scratch.
+        headers_only : bool
+            Fetch only the headers, adding the imap_folder and imap_uid columns.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed emails, or of parsed email headers with headers_only.
+        """
+        self.imap.select(folder, readonly=True)
+        uid_validity = self.get_uid_validity()
+        uid_next = self.get_select_response_code("UIDNEXT")
+        highest_modseq = self.get_select_response_code("HIGHESTMODSEQ")
+        state = self.sync_state.folder(folder, uid_validity)
+
+        if state is None:
+            uids = self.search_uids_since_date(since) if since else self.search_uids("ALL")
+            last_uid = 0
+        else:
+            last_uid = state["last_uid"]
+            nothing_new = (uid_next is not None and uid_next <= last_uid + 1) or (
+                highest_modseq is not None and highest_modseq == state.get("highest_modseq")
+            )
+            # "n:*" always matches the last message, even when its UID is below n
+            uids = [] if nothing_new else [uid for uid in self.search_uids(f"UID {last_uid + 1}:*") if int(uid) > last_uid]
+
+        fetched_uids: Set[str] = set()
+        fetched_emails = self.fetch_emails_by_uids(folder, uids, headers_only, fetched_uids)
+        if len(fetched_emails) < len(fetched_uids):
+            logging.warning(f"Skipped {len(fetched_uids) - len(fetched_emails)} unparseable emails of {folder}")
+        if len(fetched_uids) == len(uids):
+            last_uid = max([last_uid, uid_next - 1 if uid_next else 0] + [int(uid) for uid in uids])
+            self.sync_state.advance(folder, uid_validity, last_uid, highest_modseq)
+        logging.info(f"Synced {len(fetched_emails)} new emails from {folder}")
+        return fetched_emails
+
+    def get_select_response_code(self, code: str) -> Optional[int]:
+        """
+        Get a numeric response code, such as UIDNEXT, reported when the current folder was selected.
+
+        Parameters:
+        ----------
+        code : str
+            The response code.
+
+        Returns:
+        -------
+        Optional[int]
+            The value of the response code, or None if the server did not report it.
+        """
+        _, data = self.imap.response(code)
+        return int(data[0]) if data and data[0] else None
+
+    def fetch_folders_in_parallel(
+        self, folders: List[str], since: datetime, headers_only: bool
+    ) -> List[Dict[str, Any]]:
+        """
+        Fetch the emails since a specific date from several folders over the connection pool.
+
+        Each folder is searched on its own connection, then its UIDs are split into ranges of
+        UID_RANGE_SIZE that are fetched and parsed concurrently. The results keep the order
+        of the folders and of the UIDs within each folder.
+
+        Parameters:
+        ----------
+        folders : List[str]
+            List of folder names from which to extract emails.
+        since : datetime
+            Date from which to fetch emails.
+        headers_only : bool
+            Fetch only the headers, adding the imap_folder and imap_uid columns.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed emails, or of parsed email headers with headers_only.
+        """
+
+        def search_folder(folder: str) -> List[str]:
+            self.imap.select(folder, readonly=True)
+            return self.search_uids_since_date(since)
+
+        def fetch_range(folder: str, uids: List[str]) -> List[Dict[str, Any]]:
+            self.imap.select(folder, readonly=True)
+            return self.fetch_emails_by_uids(folder, uids, headers_only)
+
+        self.release_imap()
+        with ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            searches = [executor.submit(self.run_on_pool, search_folder, folder) for folder in folders]
+            fetches = []
+            for folder, search in zip(folders, searches):
+                try:
+                    uids = sorted(search.result(), key=int)
+                except Exception as e:
+                    logging.error(f"Error searching {folder}: {str(e)}")
+                    continue
+                for i in range(0, len(uids), UID_RANGE_SIZE):
+                    uid_range = uids[i : i + UID_RANGE_SIZE]
+                    fetches.append((folder, executor.submit(self.run_on_pool, fetch_range, folder, uid_range)))
+
+            fetched_emails = []
+            for folder, fetch in fetches:
+                try:
+                    fetched_emails.extend(fetch.result())
+                except Exception as e:
+                    logging.error(f"Error fetching emails from {folder}: {str(e)}")
+        return fetched_emails
+
+    def search_uids_since_date(self, since: datetime) -> List[str]:
+        """
+        Search the selected folder for the UIDs of the emails since a date.
+
+        Parameters:
+        ----------
+        since : datetime
+            Date from which to fetch emails.
+
+        Returns:
+        -------
+        List[str]
+            The matching UIDs.
+        """
+        date_string = since.strftime("%d-%b-%Y")  # Format date as "01-Jan-2023"
+        return self.search_uids(f'SINCE "{date_string}"')
+
+    def search_uids(self, criteria: str) -> List[str]:
+        """
+        Search the selected folder for the UIDs of the emails matching a search criteria.
+
+        Parameters:
+        ----------
+        criteria : str
+            The IMAP search criteria, e.g. 'SINCE "01-Jan-2023"' or "UID 1000:*".
+
+        Returns:
+        -------
+        List[str]
+            The matching UIDs.
+        """
+        result, data = self.imap.uid("SEARCH", None, criteria)
+        if result == "OK" and data and data[0] and data[0].decode():
+            return data[0].decode().split()
+        return []
+
+    def fetch_emails_by_uids(
+        self,
+        folder: Optional[str],
+        uids: List[str],
+        headers_only: bool = False,
+        fetched_uids: Optional[Set[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Fetch and parse emails of the selected folder by UID.
+
+        Parameters:
+        ----------
+        folder : Optional[str]
+            The name of the selected folder, recorded in the imap_folder column with headers_only.
+        uids : List[str]
+            The UIDs to fetch.
+        headers_only : bool, optional
+            Fetch only the headers, adding the imap_folder and imap_uid columns (default is False).
+        fetched_uids : Optional[Set[str]], optional
+            Collects the UIDs that were downloaded, including those that failed to parse.
+
+        Returns:
+        -------
+        List[Dict[str, Any]]
+            A list of parsed emails, or of parsed email headers with headers_only.
+        """
+        if not headers_only:
+            return [
+                parsed_email for _, parsed_email in self.fetch_parsed_emails(uids, "Fetching emails", fetched_uids)
+            ]
+
+        fetched_emails = []
+        fetch_items = f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+        for uid, raw_headers in self.fetch_uid_chunks(uids, fetch_items, "Fetching headers"):
+            if fetched_uids is not None:
+                fetched_uids.add(uid)
+            try:
+                msg = BytesParser(policy=default).parsebytes(raw_headers, headersonly=True)
+                fetched_emails.append({**self.parse_email_headers(msg), "imap_folder": folder, "imap_uid": uid})
+            except Exception as e:
+                logging.error(f"Error parsing email {uid}: {str(e)}")
+        return fetched_emails
+
+    def fetch_parsed_emails(
+        self, uids: List[str], desc: str, fetched_uids: Optional[Set[str]] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Fetch and parse whole emails of the selected folder by UID, skipping those that fail to parse.
+
+        With selective_fetch, only the headers and text parts are downloaded; see fetch_text_parts.
+
+        Parameters:
+        ----------
+        uids : List[str]
+            The UIDs to fetch.
+        desc : str
+            The progress bar description.
+        fetched_uids : Optional[Set[str]], optional
+            Collects the UIDs that were downloaded, including those that failed to parse.
+
+        Returns:
+        -------
+        Iterator[Tuple[str, Dict[str, Any]]]
+            The UID and the parsed email of each fetched message.
+        """
+        if self.selective_fetch:
+            for uid, (parts, items) in self.prefetch_uid_chunks(uids, self.fetch_text_parts, desc):
+                if fetched_uids is not None:
+                    fetched_uids.add(uid)
+                try:
+                    yield uid, self.parse_text_parts(parts, items)
+                except Exception as e:
+                    logging.error(f"Error parsing email {uid}: {str(e)}")
+            return
+
+        for uid, raw_email in self.fetch_uid_chunks(uids, "(UID BODY.PEEK[])", desc):
+            if fetched_uids is not None:
+                fetched_uids.add(uid)
+            try:
+                yield uid, self.parse_email(BytesParser(policy=default).parsebytes(raw_email))
+            except Exception as e:
+                logging.error(f"Error parsing email {uid}: {str(e)}")
+
+    def fetch_uid_chunks(self, uids: List[str], fetch_items: str, desc: str) -> Iterator[Tuple[str, bytes]]:
+        """
+        Fetch messages of the selected folder in chunks of fetch_chunk_size UIDs.
+
+        Parameters:
+        ----------
+        uids : List[str]
+            The UIDs to fetch.
+        fetch_items : str
+            The fetch items, which must include UID and a single BODY section.
+        desc : str
+            The progress bar description.
+
+        Returns:
+        -------
+        Iterator[Tuple[str, bytes]]
+            The UID and the literal of each fetched message.
+        """
+        yield from self.prefetch_uid_chunks(
+            uids, lambda message_set, imap: self.fetch_uid_literals(message_set, fetch_items, imap), desc
+        )
+
+    def prefetch_uid_chunks(
+        self, uids: List[str], fetch_chunk: Callable[[str, imaplib.IMAP4], List[Tuple[str, T]]], desc: str
+    ) -> Iterator[Tuple[str, T]]:
+        """
+        Download messages of the selected folder in chunks of fetch_chunk_size UIDs.
+
+        The UIDs are sorted and each chunk is sent as a compact message set such as
+        "1000:1499". The next chunk is downloaded on a background thread while the caller
+        parses the current one, so parsing overlaps with the network round trip. Only that
+        thread uses the connection until the iteration ends. Connection errors are raised so
+        that the connection pool can reconnect, other errors skip the chunk.
+
+        Parameters:
+        ----------
+        uids : List[str]
+            The UIDs to fetch.
+        fetch_chunk : Callable[[str, imaplib.IMAP4], List[Tuple[str, T]]]
+            Downloads the messages of a message set over a connection, returning each UID
+            with its data.
+        desc : str
+            The progress bar description.
+
+        Returns:
+        -------
+        Iterator[Tuple[str, T]]
+            The UID and the data of each fetched message.
+        """
+        uids = sorted(uids, key=int)
+        message_sets = [
+            compress_uids(uids[i : i + self.fetch_chunk_size]) for i in range(0, len(uids), self.fetch_chunk_size)
+        ]
+        if not message_sets:
+            return
+
+        imap = self.imap
+        with ThreadPoolExecutor(max_workers=1) as executor, tqdm(total=len(uids), desc=desc, leave=False) as pbar:
+            pending = executor.submit(fetch_chunk, message_sets[0], imap)
+            for i in range(len(message_sets)):
+                try:
+                    literals = pending.result()
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    logging.error(f"Error fetching UIDs {message_sets[i]}: {str(e)}")
+                    literals = []
+                if i + 1 < len(message_sets):
+                    pending = executor.submit(fetch_chunk, message_sets[i + 1], imap)
+                yield from literals
+                pbar.update(min(self.fetch_chunk_size, len(uids) - i * self.fetch_chunk_size))
+
+    def fetch_uid_literals(
+        self, message_set: str, fetch_items: str, imap: Optional[imaplib.IMAP4] = None
+    ) -> List[Tuple[str, bytes]]:
+        """
+        Run a UID FETCH that returns a single literal per message.
+
+        Parameters:
+        ----------
+        message_set : str
+            The UIDs to fetch, e.g. "1000:1499" or "4,8,15".
+        fetch_items : str
+            The fetch items, which must include UID and a single BODY section.
+        imap : Optional[imaplib.IMAP4], optional
+            The connection to use, when called from another thread (default: self.imap).
+
+        Returns:
+        -------
+        List[Tuple[str, bytes]]
+            The UID and the literal of each fetched message.
+        """
+        result, msg_data = (imap or self.imap).uid("FETCH", message_set, fetch_items)
+        literals = []
+        if result == "OK":
+            for item in msg_data:
+                if isinstance(item, tuple):
+                    match = re.search(rb"UID (\d+)", item[0])
+                    if match:
+                        literals.append((match.group(1).decode(), item[1]))
+        return literals
+
+    def fetch_text_parts(
+        self, message_set: str, imap: Optional[imaplib.IMAP4] = None
+    ) -> List[Tuple[str, Tuple[List[BodyPart], Dict[str, Any]]]]:
+        """
+        Download the headers and text parts of messages, guided by their BODYSTRUCTURE.
+
+        A first UID FETCH returns the size and BODYSTRUCTURE of every message. Messages with
+        the same text part sections, e.g. 1.1 and 1.2 for a multipart/alternative body next to
+        an attachment, are then fetched together with one BODY.PEEK[section] per text part, so
+        attachments are never downloaded. The bytes saved are added to transfer_stats.
+
+        Parameters:
+        ----------
+        message_set : str
+            The UIDs to fetch, e.g. "1000:1499" or "4,8,15".
+        imap : Optional[imaplib.IMAP4], optional
+            The connection to use, when called from another thread (default: self.imap).
+
+        Returns:
+        -------
+        List[Tuple[str, Tuple[List[BodyPart], Dict[str, Any]]]]
+            The UID of each fetched message, with its body parts and fetched data items.
+        """
+        imap = imap or self.imap
+        result, msg_data = imap.uid("FETCH", message_set, "(UID RFC822.SIZE BODYSTRUCTURE)")
+        if result != "OK":
+            return []
+
+        sizes: Dict[str, int] = {}
+        structures: Dict[str, List[BodyPart]] = {}
+        for items in parse_fetch_response(msg_data):
+            if items.get("UID") and isinstance(items.get("BODYSTRUCTURE"), list):
+                sizes[items["UID"]] = int(items.get("RFC822.SIZE") or 0)
+                structures[items["UID"]] = parse_bodystructure(items["BODYSTRUCTURE"])
+
+        uids_by_sections: Dict[Tuple[str, ...], List[str]] = defaultdict(list)
+        for uid, parts in structures.items():
+            uids_by_sections[tuple(part.section for part in parts if is_text_body(part))].append(uid)
+
+        fetched: Dict[str, Dict[str, Any]] = {}
+        header_item = f"BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})]"
+        for sections, uids in uids_by_sections.items():
+            fetch_items = " ".join(["UID", header_item] + [f"BODY.PEEK[{section}]" for section in sections])
+            result, msg_data = imap.uid("FETCH", compress_uids(uids), f"({fetch_items})")
+            if result == "OK":
+                for items in parse_fetch_response(msg_data):
+                    if items.get("UID") in structures:
+                        fetched[items["UID"]] = items
+
+        with self.stats_lock:
+            for uid, items in fetched.items():
+                self.transfer_stats["messages"] += 1
+                self.transfer_stats["message_bytes"] += sizes[uid]
+                self.transfer_stats["downloaded_bytes"] += sum(
+                    len(value) for value in items.values() if isinstance(value, bytes)
+                )
+                self.transfer_stats["attachments"] += sum(not is_text_body(part) for part in structures[uid])
+        return [(uid, (structures[uid], fetched[uid])) for uid in sorted(fetched, key=int)]
+
+    @staticmethod
+    def parse_text_parts(parts: List[BodyPart], items: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parse an email from its fetched headers and text parts.
+
+        Parameters:
+        ----------
+        parts : List[BodyPart]
+            The body parts of the email, from its BODYSTRUCTURE.
+        items : Dict[str, Any]
+            The fetched data items, with the header fields and one BODY[section] per text part.
+
+        Returns:
+        -------
+        Dict[str, Any]
+            The same columns as parse_email, plus the attachments column listing the name,
+            content type and size of every other part.
+        """
+        raw_headers = next(value for name, value in items.items() if name.startswith("BODY[HEADER"))
+        msg = BytesParser(policy=default).parsebytes(raw_headers, headersonly=True)
+        headers = IMAPExtractor.parse_email_headers(msg)
+
+        html_body = ""
+        plain_text_body = ""
+        for part in parts:
+            if not is_text_body(part):
+                continue
+            payload = decode_transfer_encoding(items.get(f"BODY[{part.section}]") or b"", part.encoding)
+            # Like parse_email_bodies, a single part email is always the plain text body
+            if part.content_type == "text/html" and len(parts) > 1:
+                html_body += payload.decode(errors="ignore")
+            else:
+                plain_text_body += payload.decode(errors="ignore")
+
+        attachments = [
+            {"name": part.filename, "content_type": part.content_type, "size": part.size}
+            for part in parts
+            if not is_text_body(part)
+        ]
+        return {**IMAPExtractor.email_record(headers, html_body, plain_text_body), "attachments": attachments}
+
+    def format_transfer_stats(self) -> str:
+        """
+        Summarize the bytes saved by selective fetching.
+
+        Returns:
+        -------
+        str
+            The number of messages and attachments, and the bytes downloaded out of the bytes
+            the whole messages would have taken.
+        """
+        stats = self.transfer_stats
+        saved = 1 - stats["downloaded_bytes"] / stats["message_bytes"] if stats["message_bytes"] else 0.0
+        return (
+            f"Selective fetch downloaded {stats['downloaded_bytes']:,} of {stats['message_bytes']:,} bytes "
+            f"({saved:.0%} saved) for {stats['messages']:,} emails, skipping {stats['attachments']:,} attachments"
+        )
+
     def fetch_and_parse_email(self, email_id: str) -> Optional[Dict[str, Any]]:
         """
         Fetch and parse a single email by its ID.
@@ -228,7 +1122,8 @@ class IMAPExtractor:
             logging.error(f"Error fetching and parsing email {email_id}: {str(e)}")
         return None
 
-    def parse_email(self, email: email.message.Message) -> Dict[str, Any]:
+    @staticmethod
+    def parse_email(email: email.message.Message) -> Dict[str, Any]:
         """
         Parse an email message and extract relevant information.
 
@@ -242,18 +1137,70 @@ class IMAPExtractor:
         Dict[str, Any]
             A dictionary containing parsed email metadata, body, and addresses.
         """
+        headers = IMAPExtractor.parse_email_headers(email)
+        html_body, plain_text_body = IMAPExtractor.parse_email_bodies(email)
+        return IMAPExtractor.email_record(headers, html_body, plain_text_body)
+
+    @staticmethod
+    def email_record(headers: Dict[str, Any], html_body: str, plain_text_body: str) -> Dict[str, Any]:
+        """
+        Combine the parsed headers and the bodies of an email into its row.
+
+        Parameters:
+        ----------
+        headers : Dict[str, Any]
+            The parsed headers, as returned by parse_email_headers.
+        html_body : str
+            The HTML body.
+        plain_text_body : str
+            The plain text body.
+
+        Returns:
+        -------
+        Dict[str, Any]
+            A dictionary containing parsed email metadata, body, and addresses.
+        """
+        return {
+            "message_id": headers["message_id"],
+            "subject": headers["subject"],
+            "subject_prefix": headers["subject_prefix"],
+            "submit_time": headers["submit_time"],
+            "delivery_time": headers["delivery_time"],
+            "html_body": html_body,
+            "plain_text_body": plain_text_body,
+            "from_name": headers["from_name"],
+            "from_address": headers["from_address"],
+            "to_address": headers["to_address"],
+            "cc_address": headers["cc_address"],
+            "bcc_address": headers["bcc_address"],
+            "previous_message_id": headers["previous_message_id"],
+            "references": headers["references"],
+        }
+
+    @staticmethod
+    def parse_email_headers(email: email.message.Message) -> Dict[str, Any]:
+        """
+        Parse the metadata, identifiers, timestamps and addresses of an email message.
+
+        Parameters:
+        ----------
+        email : email.message.Message
+            The email message, or just its headers.
+
+        Returns:
+        -------
+        Dict[str, Any]
+            A dictionary containing every parsed column except the bodies.
+        """
         # Metadata
-        from_name = decode_str(email["From"].split("<")[0])
+        from_name = decode_str((email["From"] or "").split("<")[0])
         subject = decode_str(email["Subject"])
         subject_prefix = prefix_from_subject(subject)
 
         # Timestamps
         submit_time = parse_timestamp(email["Date"])
-        delivery_time = parse_timestamp(email["Received"].split(";")[-1].strip())
-
-        # Headers
-        content_type = email.get_content_type()
-        charset = charset_from_content_type(content_type)
+        # Sent mail has no Received header
+        delivery_time = parse_timestamp((email["Received"] or "").split(";")[-1].strip())
 
         # Identifiers
         message_id = parse_identifiers(email["Message-ID"])
@@ -266,27 +1213,12 @@ class IMAPExtractor:
         cc_address = parse_addresses(email["CC"])
         bcc_address = parse_addresses(email["BCC"])
 
-        # Body types
-        html_body = ""
-        plain_text_body = ""
-
-        if email.is_multipart():
-            for part in email.walk():
-                if part.get_content_type() == "text/plain":
-                    plain_text_body += part.get_payload(decode=True).decode(errors="ignore")
-                elif part.get_content_type() == "text/html":
-                    html_body += part.get_payload(decode=True).decode(errors="ignore")
-        else:
-            plain_text_body = email.get_payload(decode=True).decode(errors="ignore")
-
         return {
             "message_id": message_id,
             "subject": subject,
             "subject_prefix": subject_prefix,
             "submit_time": submit_time,
             "delivery_time": delivery_time,
-            "html_body": html_body,
-            "plain_text_body": plain_text_body,
             "from_name": from_name,
             "from_address": from_address,
             "to_address": to_address,
@@ -295,3 +1227,49 @@ class IMAPExtractor:
             "previous_message_id": previous_message_id,
             "references": references,
         }
+
+    @staticmethod
+    def parse_email_bodies(email: email.message.Message) -> Tuple[str, str]:
+        """
+        Decode the HTML and plain text bodies of an email message.
+
+        Parameters:
+        ----------
+        email : email.message.Message
+            The email message to decode.
+
+        Returns:
+        -------
+        Tuple[str, str]
+            The HTML body and the plain text body.
+        """
+        html_body = ""
+        plain_text_body = ""
+
+        if email.is_multipart():
+            for part in email.walk():
+                if part.get_content_type() == "text/plain":
+                    plain_text_body += part.get_payload(decode=True).decode(errors="ignore")
+                elif part.get_content_type() == "text/html":
+                    html_body += part.get_payload(decode=True).decode(errors="ignore")
+        else:
+            plain_text_body = email.get_payload(decode=True).decode(errors="ignore")
+
+        return html_body, plain_text_body
+
+
+def is_text_body(part: BodyPart) -> bool:
+    """
+    Whether a body part is downloaded by selective fetching, as opposed to recorded as an attachment.
+
+    Parameters:
+    ----------
+    part : BodyPart
+        The body part.
+
+    Returns:
+    -------
+    bool
+        Whether the part is a text/plain or text/html part not marked as an attachment.
+    """
+    return part.content_type in TEXT_BODY_TYPES and part.disposition != "attachment"
@@ -1,7 +1,11 @@
+import base64
+import itertools
+import quopri
+import re
 from datetime import datetime
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
-from typing import Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 
 
 def decode_str(string: Optional[str]) -> str:
@@ -35,3 +39,132 @@ def parse_timestamp(email_date: Optional[str]) -> Optional[datetime]:
     if not email_date:
         return None
     return parsedate_to_datetime(email_date)
+
+
+class BodyPart(NamedTuple):
+    """A leaf part of a message's BODYSTRUCTURE, addressed by its BODY[section] number."""
+
+    section: str
+    content_type: str
+    charset: Optional[str]
+    encoding: str
+    size: int
+    filename: Optional[str]
+    disposition: Optional[str]
+
+
+_FETCH_TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|\{\d+\}|[^\s()"\[{]+(?:\[[^\]]*\](?:<[\d.]+>)?)?')
+
+
+def parse_fetch_response(msg_data: List[Union[bytes, Tuple[bytes, bytes]]]) -> List[Dict[str, Any]]:
+    """
+    Parse the data of an imaplib FETCH response into the data items of each message.
+
+    Unlike picking the literals out of the response, this keeps every item of a message
+    together, e.g. UID, RFC822.SIZE, BODYSTRUCTURE and several BODY[section] literals.
+
+    Args:
+        msg_data: The data returned by imaplib for a FETCH or UID FETCH command.
+
+    Returns:
+        The data items of each message, keyed by upper-case item name such as "BODY[1]". Lists
+        are nested Python lists, literals are bytes, and strings, numbers and NIL are str or None.
+    """
+    stack: List[list] = [[]]
+    for item in msg_data:
+        segments = [item[0], item[1]] if isinstance(item, tuple) else [item]
+        for i, segment in enumerate(segments):
+            if not isinstance(segment, bytes):
+                continue
+            if i == 1:
+                stack[-1].append(segment)
+                continue
+            for token in _FETCH_TOKEN.findall(segment):
+                if token == b"(":
+                    stack.append([])
+                elif token == b")":
+                    nested = stack.pop()
+                    stack[-1].append(nested)
+                elif token.startswith(b"{"):
+                    continue
+                elif token.startswith(b'"'):
+                    stack[-1].append(re.sub(rb"\\(.)", rb"\1", token[1:-1]).decode(errors="replace"))
+                else:
+                    atom = token.decode(errors="replace")
+                    stack[-1].append(None if atom.upper() == "NIL" else atom)
+
+    messages = []
+    for items in stack[0]:
+        if isinstance(items, list):
+            messages.append({str(name).upper(): value for name, value in zip(items[::2], items[1::2])})
+    return messages
+
+
+def parse_bodystructure(structure: list, section: str = "") -> List[BodyPart]:
+    """
+    Flatten a parsed BODYSTRUCTURE into its leaf parts.
+
+    Nested multiparts are walked, while an attached message/rfc822 is one leaf part since its
+    content is never shown as the body.
+
+    Args:
+        structure: The BODYSTRUCTURE as returned by parse_fetch_response.
+        section: The section number of the structure, empty for the whole message.
+
+    Returns:
+        The leaf parts in order.
+    """
+    if structure and isinstance(structure[0], list):
+        parts: List[BodyPart] = []
+        # The child parts come first, followed by the multipart subtype and extension data
+        children = itertools.takewhile(lambda value: isinstance(value, list), structure)
+        for i, child in enumerate(children, 1):
+            parts.extend(parse_bodystructure(child, f"{section}.{i}" if section else str(i)))
+        return parts
+
+    content_type = f"{structure[0]}/{structure[1]}".lower()
+    params = _pairs(structure[2])
+    # The extension data follows the basic fields, plus the line count of text parts and the
+    # envelope, body and line count of message/rfc822 parts
+    extension = structure[8 if content_type.startswith("text/") else 10 if content_type == "message/rfc822" else 7 :]
+    disposition_type, disposition_params = None, {}
+    if len(extension) > 1 and isinstance(extension[1], list) and extension[1]:
+        disposition_type = str(extension[1][0]).lower()
+        disposition_params = _pairs(extension[1][1] if len(extension[1]) > 1 else None)
+
+    return [
+        BodyPart(
+            section=section or "1",
+            content_type=content_type,
+            charset=params.get("charset"),
+            encoding=str(structure[5] or "7bit").lower(),
+            size=int(structure[6] or 0),
+            filename=decode_str(disposition_params.get("filename") or params.get("name")) or None,
+            disposition=disposition_type,
+        )
+    ]
+
+
+def _pairs(values: Optional[list]) -> Dict[str, str]:
+    """Turn a parenthesized list of attribute and value pairs into a dictionary."""
+    if not isinstance(values, list):
+        return {}
+    return {str(key).lower(): value for key, value in zip(values[::2], values[1::2]) if isinstance(value, str)}
+
+
+def decode_transfer_encoding(payload: bytes, encoding: str) -> bytes:
+    """
+    Undo the Content-Transfer-Encoding of a body part.
+
+    Args:
+        payload: The body part as fetched with BODY[section].
+        encoding: The transfer encoding from the BODYSTRUCTURE, e.g. "base64".
+
+    Returns:
+        The decoded bytes, or the payload itself for 7bit, 8bit and binary parts.
+    """
+    if encoding == "base64":
+        return base64.b64decode(payload)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+
+class IMAPSyncState:
+    """
+    The incremental sync position of each IMAP folder, optionally persisted to disk.
+
+    Each folder records the UIDVALIDITY its UIDs belong to, the highest UID already extracted
+    and, on servers supporting CONDSTORE, the HIGHESTMODSEQ seen at that time. UIDs only grow
+    within a UIDVALIDITY, so the next run only has to fetch the UIDs above last_uid, and can
+    skip a folder whose UIDNEXT or HIGHESTMODSEQ did not move. A folder whose UIDVALIDITY
+    changed has to be resynced from scratch.
+
+    Attributes:
+        path (Optional[str]): The path to the state JSON file, or None to keep it in memory.
+        folders (Dict[str, Dict]): The uid_validity, last_uid and highest_modseq of each folder.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Initializes the state, loading it from disk if it exists.
+
+        Args:
+            path (Optional[str]): The path to the state JSON file, or None to keep it in memory.
+        """
+        self.path = path
+        self.folders: Dict[str, Dict] = {}
+
+        if path and os.path.exists(path):
+            with open(path, "r") as state_file:
+                self.folders = json.load(state_file)
+            logging.info(f"Loaded the IMAP sync state of {len(self.folders)} folders from {path}")
+
+    def folder(self, folder: str, uid_validity: int) -> Optional[Dict]:
+        """
+        Returns the state of a folder, or None if it has to be resynced from scratch.
+
+        Args:
+            folder (str): The name of the folder.
+            uid_validity (int): The current UIDVALIDITY of the folder.
+
+        Returns:
+            Optional[Dict]: The uid_validity, last_uid and highest_modseq of the folder, or None
+                if it was never synced or its UIDVALIDITY changed.
+        """
+        entry = self.folders.get(folder)
+        if entry is not None and entry["uid_validity"] != uid_validity:
+            logging.info(f"UIDVALIDITY of {folder} changed, resyncing it from scratch")
+            del self.folders[folder]
+            return None
+        return entry
+
+    def advance(
+        self, folder: str, uid_validity: int, last_uid: int, highest_modseq: Optional[int] = None
+    ) -> None:
+        """
+        Records that every message of a folder up to a UID was extracted.
+
+        Args:
+            folder (str): The name of the folder.
+            uid_validity (int): The UIDVALIDITY the UID belongs to.
+            last_uid (int): The highest UID extracted.
+            highest_modseq (Optional[int]): The HIGHESTMODSEQ of the folder when it was selected,
+                or None if the server does not support CONDSTORE.
+        """
+        entry = self.folder(folder, uid_validity) or {"uid_validity": uid_validity, "last_uid": 0}
+        entry["last_uid"] = max(entry["last_uid"], last_uid)
+        entry["highest_modseq"] = highest_modseq
+        self.folders[folder] = entry
+
+    def save(self) -> None:
+        """Writes the state to disk, replacing the previous version atomically."""
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(self.folders, state_file)
+        os.replace(temp_path, self.path)
+        logging.info(f"Saved the IMAP sync state of {len(self.folders)} folders to {self.path}")
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class MessageIdIndex:
+    """
+    A cache of the UID of each Message-ID in the IMAP folders, optionally persisted to disk.
+
+    Each folder's entry is tied to its UIDVALIDITY, and is dropped when the server reports a
+    different one since its UIDs no longer mean the same messages. Alongside the resolved
+    Message-IDs, the entry records the highest UID whose Message-ID header was indexed, so
+    that a folder index only has to be extended with the messages that arrived since.
+
+    Attributes:
+        path (Optional[str]): The path to the index JSON file, or None to keep it in memory.
+        folders (Dict[str, Dict]): The uid_validity, indexed_uid and uids of each folder.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Initializes the index, loading it from disk if it exists.
+
+        Args:
+            path (Optional[str]): The path to the index JSON file, or None to keep it in memory.
+        """
+        self.path = path
+        self.folders: Dict[str, Dict] = {}
+
+        if path and os.path.exists(path):
+            with open(path, "r") as index_file:
+                self.folders = json.load(index_file)
+            logging.info(f"Loaded the Message-ID index of {len(self.folders)} folders from {path}")
+
+    def folder(self, folder: str, uid_validity: int) -> Dict:
+        """
+        Returns the entry of a folder, resetting it if its UIDVALIDITY changed.
+
+        Args:
+            folder (str): The name of the folder.
+            uid_validity (int): The current UIDVALIDITY of the folder.
+
+        Returns:
+            Dict: The uid_validity, indexed_uid and uids (Message-ID to UID) of the folder.
+        """
+        entry = self.folders.get(folder)
+        if entry is None or entry["uid_validity"] != uid_validity:
+            if entry is not None:
+                logging.info(f"UIDVALIDITY of {folder} changed, dropping its Message-ID index")
+            entry = {"uid_validity": uid_validity, "indexed_uid": 0, "uids": {}}
+            self.folders[folder] = entry
+        return entry
+
+    def resolve(self, folder: str, uid_validity: int, message_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        Looks up the UIDs of Message-IDs in a folder.
+
+        Args:
+            folder (str): The name of the folder.
+            uid_validity (int): The current UIDVALIDITY of the folder.
+            message_ids (Iterable[str]): The Message-IDs to look up.
+
+        Returns:
+            Dict[str, str]: The UID of each Message-ID found in the index.
+        """
+        uids = self.folder(folder, uid_validity)["uids"]
+        return {message_id: uids[message_id] for message_id in message_ids if message_id in uids}
+
+    def add(
+        self, folder: str, uid_validity: int, uids: Iterable[Tuple[str, str]], indexed_uid: Optional[int] = None
+    ) -> None:
+        """
+        Records the UIDs of Message-IDs in a folder.
+
+        Args:
+            folder (str): The name of the folder.
+            uid_validity (int): The current UIDVALIDITY of the folder.
+            uids (Iterable[Tuple[str, str]]): The Message-ID and UID pairs.
+            indexed_uid (Optional[int]): The highest UID up to which every Message-ID header of
+                the folder was indexed, if the pairs come from a full scan.
+        """
+        entry = self.folder(folder, uid_validity)
+        entry["uids"].update((message_id, uid) for message_id, uid in uids if message_id)
+        if indexed_uid is not None:
+            entry["indexed_uid"] = max(entry["indexed_uid"], indexed_uid)
+
+    def save(self) -> None:
+        """Writes the index to disk, replacing the previous version atomically."""
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(self.folders, index_file)
+        os.replace(temp_path, self.path)
+        logging.info(f"Saved the Message-ID index of {len(self.folders)} folders to {self.path}")
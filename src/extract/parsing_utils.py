@@ -1,19 +1,24 @@
 import re
 from email.utils import getaddresses
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
-import chardet
-import html2text
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 from tqdm import tqdm
 
-htmlConverter = html2text.HTML2Text()
-htmlConverter.ignore_links = True
-htmlConverter.ignore_images = True
-htmlConverter.ignore_emphasis = True
+from src.extract.charset_decoding import body_decoder
+from src.extract.html_conversion import HTMLTextCache, convert_html_bodies
+from src.extract.thread_graph import ThreadGraph
 
 tqdm.pandas()
 
+ADDRESS_FIELDS = ["from_address", "to_address", "cc_address", "bcc_address"]
+# Sender domains containing any of these are internal
+INTERNAL_DOMAINS = ["qib"]
+# The text between the first "@" of each comma-separated address and the next "@" or comma
+DOMAIN_PATTERN = r"(?:^|,)[^,@]*@([^,@]*)"
+
 
 def parse_addresses(address: Optional[str]) -> Optional[str]:
     """
@@ -109,14 +114,15 @@ def prefix_from_subject(subject: Optional[str]) -> Optional[str]:
     return None
 
 
-def parse_body(body: Optional[bytes], encoding: Optional[str]) -> Optional[str]:
+def parse_body(body: Optional[bytes], encoding: Optional[str], cache_key: Optional[str] = None) -> Optional[str]:
     """
     Decode a bytes object into a string, using the given encoding.
 
-    If the encoding is not given, the bytes object is decoded using the
-    default encoding. If decoding fails with a UnicodeDecodeError, the
-    encoding is detected using chardet and the bytes object is decoded
-    with the detected encoding. If decoding still fails, None is returned.
+    If the encoding is not given or decoding with it fails, the likely encodings
+    (utf-8, windows-1256, iso-8859-6) are tried, then the encoding is detected with
+    chardet on a bounded sample of the bytes. The encoding found is cached under
+    cache_key and tried first for the next body with the same key. If no encoding
+    can be found, None is returned. See charset_decoding.BodyDecoder.
 
     Parameters
     ----------
@@ -124,6 +130,8 @@ def parse_body(body: Optional[bytes], encoding: Optional[str]) -> Optional[str]:
         The bytes object to decode.
     encoding : Optional[str]
         The encoding to use for decoding.
+    cache_key : Optional[str]
+        The key to cache the detected encoding under, e.g. the sender domain.
 
     Returns
     -------
@@ -131,11 +139,7 @@ def parse_body(body: Optional[bytes], encoding: Optional[str]) -> Optional[str]:
         The decoded string, or None if decoding fails.
     """
     if body:
-        try:
-            return body.decode(encoding) if encoding else body.decode()
-        except UnicodeDecodeError:
-            encoding = chardet.detect(body)["encoding"]
-            return body.decode(encoding, errors="replace") if encoding else None
+        return body_decoder.decode(body, encoding, cache_key)
     return None
 
 
@@ -143,12 +147,12 @@ def parse_email_threading(df: pd.DataFrame) -> pd.DataFrame:
     """
     Parse the threading information of a DataFrame of emails.
 
-    The method infers the threading information of a series of emails from the
-    "previous_message_id" and "references" fields. The "first_in_thread" column is
-    set to True if the email is the first in a thread, i.e. if it is not a reply
-    to any other email. The "num_previous_messages" column is set to the number of
-    emails in the thread that occurred before this email. The "thread_id" column
-    is set to the id of the first email in the thread.
+    The method builds the reply graph of the emails from the "previous_message_id" and
+    "references" fields, see ThreadGraph. The "first_in_thread" column is set to True if
+    the email is the first in a thread, i.e. if it is not a reply to any other email. The
+    "num_previous_messages" column is set to the number of emails in the thread that
+    occurred before this email. The "thread_id" column is set to the id of the first email
+    in the thread, which may be missing from the DataFrame.
 
     Parameters
     ----------
@@ -160,71 +164,179 @@ def parse_email_threading(df: pd.DataFrame) -> pd.DataFrame:
     pd.DataFrame
         The DataFrame with the added threading information columns.
     """
-    df["first_in_thread"] = (
-        df["previous_message_id"].isnull() & df["references"].isnull()
-        if "references" in df.columns and "previous_message_id" in df.columns
-        else None
-    )
-    df["num_previous_messages"] = df["references"].str.count(",") + 1
-    df["thread_id"] = df["references"].apply(lambda x: x.split(",")[0] if x else None)
+    for column, values in ThreadGraph.from_dataframe(df).thread_columns().items():
+        df[column] = values
     return df
 
 
-def parse_domain_info(df: pd.DataFrame) -> pd.DataFrame:
+def concat_message_batches(batches: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate batches of parsed emails into a single DataFrame.
+
+    Threading is computed per batch when emails are parsed in batches, so a reply and its
+    parent in different batches are threaded apart. The threading columns are computed again
+    on the whole DataFrame, so the result does not depend on the batch size. The categorical
+    columns, e.g. sender_domain, are unioned across the batches, which pd.concat would turn
+    into object columns whenever the batches hold different categories.
+
+    Parameters
+    ----------
+    batches : Sequence[pd.DataFrame]
+        The batches of emails, each with the threading and domain information columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        The emails of every batch, in order, with a fresh index.
+    """
+    if not batches:
+        return pd.DataFrame()
+    df = pd.concat(batches, ignore_index=True)
+    for column in batches[0].select_dtypes("category").columns:
+        df[column] = union_categoricals([batch[column] for batch in batches], sort_categories=True)
+    return parse_email_threading(df)
+
+
+def _split_domains(df: pd.DataFrame, fields: Sequence[str]):
+    """
+    Split every address of the given fields into its domain, interning both.
+
+    Each distinct address string is only split once, as the same senders and recipient
+    lists recur across a mailbox, and its domains are spread back to every row holding
+    it through CSR-style offsets. The domains are coded against their sorted categories,
+    so that ordering the codes orders the domains.
+
+    Returns the row position, field position and domain code of every address with a
+    domain, ordered by field and then by row, and the domain categories.
+    """
+    row_count = len(df)
+    values = np.concatenate([df[field].to_numpy(dtype=object) for field in fields] or [np.zeros(0, dtype=object)])
+    value_codes, unique_values = pd.factorize(values)
+
+    found = pd.Series(unique_values, dtype=object).str.findall(DOMAIN_PATTERN).explode().str.strip()
+    found = found[found.notna() & (found != "")]
+    domain_codes, categories = pd.factorize(found.to_numpy(dtype=object), sort=True)
+
+    # The extra count is the zero domains of missing values, whose code is -1
+    counts = np.bincount(found.index.to_numpy(dtype=np.int64), minlength=len(unique_values) + 1)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    lengths = counts[value_codes]
+    entries = np.repeat(np.arange(len(values)), lengths)
+    within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes = domain_codes[offsets[value_codes[entries]] + within]
+    return entries % max(row_count, 1), entries // max(row_count, 1), codes, pd.Index(categories)
+
+
+def explode_domains(df: pd.DataFrame, fields: Sequence[str] = ADDRESS_FIELDS) -> pd.DataFrame:
+    """
+    Split the address fields of a DataFrame of emails into one row per address domain.
+
+    Every address field is split and exploded in a single pass, and the domains are
+    interned as a categorical, as a mailbox only ever sees a few thousand distinct
+    domains. The result has the shape of the domains table.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame of emails, with comma-separated addresses in the address fields.
+    fields : Sequence[str]
+        The address fields to split, skipping those missing from the DataFrame.
+
+    Returns
+    -------
+    pd.DataFrame
+        The "message_id", "field" and "domain" of every address with a domain, indexed by
+        the index of its email in df. The field and domain columns are categoricals.
+    """
+    present_fields = [field for field in fields if field in df.columns]
+    rows, field_positions, codes, categories = _split_domains(df, present_fields)
+    message_ids = df["message_id"].to_numpy(dtype=object) if "message_id" in df.columns else np.full(len(df), None)
+    return pd.DataFrame(
+        {
+            "message_id": message_ids[rows],
+            "field": pd.Categorical.from_codes(field_positions, categories=present_fields),
+            "domain": pd.Categorical.from_codes(codes, categories=categories),
+        },
+        index=df.index[rows],
+    )
+
+
+def parse_domain_info(df: pd.DataFrame, internal_domains: Sequence[str] = INTERNAL_DOMAINS) -> pd.DataFrame:
     """
     Parse domain information from a DataFrame of emails.
 
     The method infers the sender domain and all domains mentioned in the email
     from the "from_address", "to_address", "cc_address", and "bcc_address"
     fields. It also infers whether the email is internal or external based on
-    whether the sender domain is "qib" or not.
+    whether the sender domain contains one of the internal domains.
+
+    The addresses are split once for all fields, and sender_domain and all_domains
+    are categoricals, so the internal check only runs once per distinct sender
+    domain. Missing address fields yield an empty sender_domain and all_domains.
 
     Parameters
     ----------
     df : pd.DataFrame
         The DataFrame of emails.
+    internal_domains : Sequence[str]
+        The substrings marking a sender domain as internal, "qib" by default.
 
     Returns
     -------
     pd.DataFrame
         The DataFrame with the added domain information columns.
     """
-    def get_domain(address: Optional[str]) -> str:
-        if address and "@" in address:
-            return address.strip().split("@")[1]
-        return ""
-
-    def get_domains(addresses: Optional[str]) -> List[str]:
-        if addresses:
-            return [get_domain(address) for address in addresses.split(",")]
-        return []
-
-    def extract_unique_domains(row):
-        domains = set(get_domains(row["from_address"]))
-
-        for field in ["to_address", "cc_address", "bcc_address"]:
-            domains.update(get_domains(row[field]))
-
-        return ", ".join(sorted(domains))
-
-    df["sender_domain"] = df["from_address"].apply(get_domain)
-    df["all_domains"] = df.apply(extract_unique_domains, axis=1)
-    df["is_internal"] = df["sender_domain"].apply(
-        lambda x: "qib" in x #any("qib" in domain for domain in str(x).split(", "))
-    )
+    present_fields = [field for field in ADDRESS_FIELDS if field in df.columns]
+    rows, fields, codes, categories = _split_domains(df, present_fields)
+    domains = categories.to_numpy(dtype=object)
+
+    # The first domain of the sender field is the sender domain
+    sender_domain = np.full(len(df), "", dtype=object)
+    is_sender = fields == (present_fields.index("from_address") if "from_address" in present_fields else -1)
+    sender_rows, first_positions = np.unique(rows[is_sender], return_index=True)
+    sender_domain[sender_rows] = domains[codes[is_sender][first_positions]]
+    df["sender_domain"] = pd.Categorical(sender_domain)
+
+    # Sort the distinct domains of each row by code, then concatenate them in a single reduction
+    keys = np.unique(rows.astype(np.int64) * max(len(domains), 1) + codes)
+    unique_rows, unique_codes = keys // max(len(domains), 1), keys % max(len(domains), 1)
+    all_domains = np.full(len(df), "", dtype=object)
+    if len(keys):
+        starts = np.flatnonzero(np.concatenate([[True], unique_rows[1:] != unique_rows[:-1]]))
+        joined = np.add.reduceat((categories + ", ").to_numpy(dtype=object)[unique_codes], starts)
+        all_domains[unique_rows[starts]] = [row_domains[:-2] for row_domains in joined]
+    df["all_domains"] = pd.Categorical(all_domains)
+
+    sender_categories = df["sender_domain"].cat.categories
+    is_internal = np.array([any(marker in domain for marker in internal_domains) for domain in sender_categories])
+    df["is_internal"] = is_internal.astype(bool)[df["sender_domain"].cat.codes.to_numpy()]
     return df
 
 
-def fill_plain_text_body(df: pd.DataFrame) -> pd.DataFrame:
+def fill_plain_text_body(
+    df: pd.DataFrame,
+    cache: Optional[HTMLTextCache] = None,
+    num_processes: Optional[int] = None,
+    fast_html: bool = False,
+) -> pd.DataFrame:
     """
     Fill the plain_text_body column with converted HTML text if it is null. A boolean
     column named plain_text_is_converted is also added to indicate which rows were
     converted.
 
+    Each distinct HTML body is converted once, across a process pool, and reused from
+    the cache when it was converted before.
+
     Parameters
     ----------
     df : pd.DataFrame
         The DataFrame of emails.
+    cache : Optional[HTMLTextCache]
+        The cache of converted HTML bodies, updated with the new conversions.
+    num_processes : Optional[int]
+        The number of worker processes converting the bodies, defaults to the CPU count.
+    fast_html : bool
+        Whether to extract the text of simple markup with lxml rather than html2text.
 
     Returns
     -------
@@ -232,13 +344,12 @@ def fill_plain_text_body(df: pd.DataFrame) -> pd.DataFrame:
         The DataFrame with the filled plain_text_body column and the new
         plain_text_is_converted column.
     """
-    replace_df = df.loc[df["html_body"].notnull() & df["plain_text_body"].isnull()].copy()
-    replace_df["plain_text_body"] = replace_df["html_body"].progress_apply(htmlConverter.handle)
-
-    df.loc[df["html_body"].notnull() & df["plain_text_body"].isnull(), "plain_text_is_converted"] = True
-    df.loc[df["html_body"].notnull() & df["plain_text_body"].isnull(), "plain_text_body"] = replace_df[
-        "plain_text_body"
-    ]
-
-    df["plain_text_is_converted"] = df["plain_text_is_converted"].fillna(False)
+    is_converted = (df["html_body"].notnull() & df["plain_text_body"].isnull()).to_numpy()
+    if is_converted.any():
+        df.loc[is_converted, "plain_text_body"] = convert_html_bodies(
+            df.loc[is_converted, "html_body"], cache, num_processes, fast_html
+        )
+    if "plain_text_is_converted" in df.columns:
+        is_converted |= df["plain_text_is_converted"].fillna(False).astype(bool).to_numpy()
+    df["plain_text_is_converted"] = is_converted
     return df
@@ -1,15 +1,22 @@
 import logging
 import multiprocessing as mp
-from multiprocessing.pool import ThreadPool as Pool
-from typing import Any, Dict, List, Optional, Set, Union
+import time
+from collections import Counter, defaultdict, deque
+from fnmatch import fnmatch
+from multiprocessing.pool import AsyncResult
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
-import html2text
 import pandas as pd
 import pypff
 from tqdm import tqdm
 
+from src.extract.charset_decoding import body_decoder, format_decode_stats
+from src.extract.extraction_manifest import ExtractionManifest
+from src.extract.html_conversion import HTMLTextCache
 from src.extract.parsing_utils import (
+    INTERNAL_DOMAINS,
     charset_from_content_type,
+    concat_message_batches,
     fill_plain_text_body,
     parse_addresses,
     parse_body,
@@ -19,14 +26,58 @@ from src.extract.parsing_utils import (
     prefix_from_subject,
 )
 from src.extract.pst_parsing_utils import parse_headers, parse_timestamp, safe_getattr
-
-htmlConverter = html2text.HTML2Text()
-htmlConverter.ignore_links = True
-htmlConverter.ignore_images = True
-htmlConverter.ignore_emphasis = True
+from src.extract.thread_graph import ThreadGraph
 
 tqdm.pandas()
 
+DEFAULT_BATCH_SIZE = 1000
+
+# Folders holding non-email items, skipped unless explicitly included
+DEFAULT_EXCLUDE_FOLDERS = ["Calendar", "Contacts", "Journal", "Notes", "Tasks", "Sync Issues"]
+
+
+class PSTFolder(NamedTuple):
+    """A folder of a .pst file, addressed by the index of each sub-folder below the root folder."""
+
+    path: Tuple[int, ...]
+    name: str
+    message_count: int
+
+
+class MessageRange(NamedTuple):
+    """A contiguous range of message indexes in a .pst folder, the unit of work of the process pool."""
+
+    file_path: str
+    folder_path: Tuple[int, ...]
+    folder_name: str
+    start: int
+    stop: int
+    fingerprint: Optional[str] = None
+    store_name: Optional[str] = None
+
+
+class ParsedRange(NamedTuple):
+    """The result of parsing a message range in a worker process."""
+
+    columns: Dict[str, List[Any]]
+    seconds: float
+    skipped: int
+    errors: int
+    identifiers: List[int]
+    max_delivery_time: Optional[int]
+    decode_counts: Counter
+    decode_seconds: Counter
+
+
+# .pst files opened by the current worker process, keyed by file path
+_open_pst_files: Dict[str, pypff.file] = {}
+
+# The extraction manifest of the current worker process, if re-ingestion is incremental
+_manifest: Optional[ExtractionManifest] = None
+
+# Whether the current worker process skips decoding the message bodies
+_headers_only = False
+
 
 class PSTExtractor:
     """
@@ -38,6 +89,15 @@ class PSTExtractor:
         file_paths: Union[str, List[str]],
         sample: Optional[int] = None,
         fill_missing_data: bool = False,
+        lazy: bool = False,
+        num_processes: Optional[int] = None,
+        include_folders: Optional[List[str]] = None,
+        exclude_folders: Optional[List[str]] = None,
+        manifest_path: Optional[str] = None,
+        headers_only: bool = False,
+        internal_domains: Optional[List[str]] = None,
+        html_cache_path: Optional[str] = None,
+        fast_html: bool = False,
     ):
         """
         Initializes the PSTExtractor.
@@ -46,45 +106,323 @@ class PSTExtractor:
             file_paths: A path to a .pst file or a list of paths to .pst files.
             sample: The number of messages to sample from the extracted data.
             fill_missing_data: Whether to fill the missing information in the extracted data.
+            lazy: Whether to skip the eager extraction, leaving the caller to consume iter_batches.
+            num_processes: The number of worker processes used for parsing, defaults to the CPU count.
+            include_folders: Glob patterns of the folders to extract, e.g. "Inbox" or "Inbox/*".
+                A folder matching a pattern is extracted along with all of its subfolders.
+                Defaults to every folder.
+            exclude_folders: Glob patterns of the folders to skip along with their subfolders.
+                Defaults to DEFAULT_EXCLUDE_FOLDERS.
+            manifest_path: The path to an extraction manifest. When given, messages recorded in the
+                manifest by a previous run are skipped, and the manifest is updated at the end.
+            headers_only: Whether to skip decoding the bodies, which can be loaded later for the
+                filtered messages with load_bodies. The pst_file, pst_folder_path and pst_index
+                columns are added to locate each message again.
+            internal_domains: The substrings marking a sender domain as internal. Defaults to
+                INTERNAL_DOMAINS.
+            html_cache_path: The path to the cache of HTML bodies converted to text when filling
+                the missing plain text bodies, kept between runs. Defaults to a cache of this run only.
+            fast_html: Whether to extract the text of simple HTML bodies with lxml rather than html2text.
         """
         self.file_paths = file_paths if isinstance(file_paths, list) else [file_paths]
         self.sample = sample
-        self.messages = []
+        self.fill_missing_data = fill_missing_data
+        self.num_processes = num_processes or mp.cpu_count()
+        self.include_folders = include_folders
+        self.exclude_folders = DEFAULT_EXCLUDE_FOLDERS if exclude_folders is None else exclude_folders
+        self.folder_stats = pd.DataFrame()
+        self.manifest = ExtractionManifest(manifest_path) if manifest_path else None
+        self.headers_only = headers_only
+        self.internal_domains = INTERNAL_DOMAINS if internal_domains is None else internal_domains
+        self.html_cache = HTMLTextCache(html_cache_path)
+        self.fast_html = fast_html
+        self.new_message_count = 0
+        self.skipped_message_count = 0
+        self.decode_counts: Counter = Counter()
+        self.decode_seconds: Counter = Counter()
+        self.missing_email_ids: Set[str] = set()
+        self.message_df: Optional[pd.DataFrame] = None
+
+        if lazy:
+            return
+
+        self.message_df = concat_message_batches(list(self.iter_batches()))
+
+    def iter_batches(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        """
+        Lazily walks the .pst files and yields batches of parsed messages.
+
+        The messages of every selected folder are split into contiguous index ranges of
+        batch_size, which are parsed by a pool of worker processes that each open the .pst files
+        themselves. Only a bounded number of ranges are in flight at once, so peak memory stays
+        flat regardless of the size of the archive. Threading and domain columns are computed per
+        batch, see concat_message_batches to combine the batches, and missing_email_ids and
+        folder_stats are updated once the iteration is exhausted.
+
+        If a manifest is used, messages it already records are skipped before their bodies are
+        decoded, references to them are not reported as missing, and the manifest is saved once
+        the iteration is exhausted.
+
+        Args:
+            batch_size: The maximum number of messages in each batch.
+
+        Yields:
+            A dataframe of the parsed messages in each batch.
+        """
+        message_ranges = self.plan_message_ranges(batch_size)
+        total = sum(message_range.stop - message_range.start for message_range in message_ranges)
+        seen_message_ids: Set[str] = set()
+        referenced_message_ids: Set[str] = set()
+        folder_stats: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: {"messages": 0, "seconds": 0.0})
+        max_delivery_times: Dict[Tuple[Optional[str], str], int] = {}
+        failed_folders: Set[Tuple[Optional[str], str]] = set()
+        self.new_message_count = 0
+        self.skipped_message_count = 0
+        self.decode_counts, self.decode_seconds = Counter(), Counter()
+
+        logging.info(f"Found {total} messages in total")
+        logging.info(
+            f"Using {self.num_processes} processes to parse {len(message_ranges)} batches of up to {batch_size} messages"
+        )
+
+        with tqdm(total=total) as pbar:
+            for message_range, parsed in self.parse_message_ranges(message_ranges):
+                stats = folder_stats[(message_range.file_path, message_range.folder_name)]
+                stats["seconds"] += parsed.seconds
+                self.skipped_message_count += parsed.skipped
+                self.decode_counts.update(parsed.decode_counts)
+                self.decode_seconds.update(parsed.decode_seconds)
+                pbar.update(parsed.skipped)
+                folder_key = (message_range.store_name, message_range.folder_name)
+                if parsed.errors:
+                    failed_folders.add(folder_key)
+                if parsed.max_delivery_time:
+                    latest = max(parsed.max_delivery_time, max_delivery_times.get(folder_key, 0))
+                    max_delivery_times[folder_key] = latest
+                if not parsed.columns:
+                    continue
+
+                stats["messages"] += len(parsed.columns["message_id"])
+                batch_df = self.process_batch(pd.DataFrame(parsed.columns))
+                pbar.update(len(batch_df))
+                self.new_message_count += len(batch_df)
+                if self.manifest:
+                    self.manifest.add_messages(message_range.fingerprint, parsed.identifiers, batch_df["message_id"])
+                seen_message_ids.update(batch_df["message_id"].dropna())
+                referenced_message_ids.update(self.get_referenced_message_ids(batch_df))
+
+                yield batch_df
+
+        logging.info("Extracting missing email ids")
+        self.missing_email_ids = referenced_message_ids - seen_message_ids
+        if self.manifest:
+            # Skipped messages were recorded with their Message-IDs by the run that extracted them
+            self.missing_email_ids -= self.manifest.message_ids
+        self.folder_stats = self.summarize_folder_stats(folder_stats)
+        logging.info(f"Extracted {self.new_message_count} new messages, skipped {self.skipped_message_count}")
+        if self.decode_counts:
+            logging.info("Body decoding paths:\n\t" + format_decode_stats(self.decode_counts, self.decode_seconds))
+
+        if self.manifest:
+            # A sampled run does not read every message below the latest delivery time, and a
+            # message that failed to parse would be skipped for good below the watermark
+            if not self.sample:
+                for (store_name, folder_name), delivery_time in max_delivery_times.items():
+                    if (store_name, folder_name) in failed_folders:
+                        logging.warning(f"Keeping the watermark of {folder_name}, some of its messages failed to parse")
+                        continue
+                    self.manifest.advance_watermark(store_name, folder_name, delivery_time)
+            self.manifest.save()
+        if self.fill_missing_data and not self.headers_only:
+            self.html_cache.save()
+
+    def summarize_folder_stats(self, folder_stats: Dict[Tuple[str, str], Dict[str, float]]) -> pd.DataFrame:
+        """
+        Logs and tabulates the number of messages parsed and the time spent per folder.
+
+        Args:
+            folder_stats: The message count and parse seconds keyed by (file path, folder name).
+
+        Returns:
+            A dataframe with the file_path, folder, messages, seconds and messages_per_second columns.
+        """
+        stats_df = pd.DataFrame(
+            [{"file_path": file_path, "folder": folder, **stats} for (file_path, folder), stats in folder_stats.items()],
+            columns=["file_path", "folder", "messages", "seconds"],
+        )
+        stats_df["messages_per_second"] = stats_df["messages"] / stats_df["seconds"].where(stats_df["seconds"] > 0)
+        stats_df = stats_df.sort_values("messages", ascending=False, ignore_index=True)
+
+        logging.info(
+            "Parsed folders:\n\t"
+            + "\n\t".join(
+                f"{row.folder} ({row.file_path}): {row.messages:.0f} messages in {row.seconds:.2f}s"
+                for row in stats_df.itertuples()
+            )
+        )
+        return stats_df
+
+    def plan_message_ranges(self, batch_size: int) -> List[MessageRange]:
+        """
+        Splits the messages of every selected folder of every .pst file into contiguous index ranges.
+
+        Ranges are interleaved across folders and files, so that independent folder subtrees are
+        parsed by the workers at the same time rather than one after another.
+
+        Args:
+            batch_size: The maximum number of messages in each range.
+
+        Returns:
+            A list of message ranges, truncated to the sample size.
+        """
+        remaining = self.sample if self.sample else None
+        folder_ranges: List[List[MessageRange]] = []
+
+        if remaining:
+            logging.info(f"Sampling {remaining} messages")
 
         for file_path in self.file_paths:
             logging.info(f"Opening {file_path} for extraction")
-            folder = self.retrieve_folder(file_path)
-            if folder:
-                logging.info(f"Extracting messages from {file_path}")
-                messages = self.extract_messages_from_pst(folder)
-                self.messages.extend(messages)
-
-        logging.info(f"Found {len(self.messages)} messages in total")
+            fingerprint = ExtractionManifest.fingerprint(file_path) if self.manifest else None
+            store_name = ExtractionManifest.store_name(self.open_pst_file(file_path)) if self.manifest else None
+            for folder in self.retrieve_folders(file_path):
+                count = folder.message_count
+                if remaining is not None:
+                    count = min(count, remaining)
+                    remaining -= count
+                folder_ranges.append(
+                    [
+                        MessageRange(
+                            file_path,
+                            folder.path,
+                            folder.name,
+                            start,
+                            min(start + batch_size, count),
+                            fingerprint,
+                            store_name,
+                        )
+                        for start in range(0, count, batch_size)
+                    ]
+                )
+                if remaining is not None and remaining <= 0:
+                    break
+            if remaining is not None and remaining <= 0:
+                break
+
+        message_ranges: List[MessageRange] = []
+        for i in range(max((len(ranges) for ranges in folder_ranges), default=0)):
+            message_ranges.extend(ranges[i] for ranges in folder_ranges if i < len(ranges))
+        return message_ranges
+
+    def parse_message_ranges(self, message_ranges: List[MessageRange]) -> Iterator[Tuple[MessageRange, ParsedRange]]:
+        """
+        Parses the message ranges across the process pool, in order.
 
-        if self.sample:
-            logging.info(f"Sampling {self.sample} messages")
-            self.messages = self.messages[: self.sample]
+        At most two ranges per process are submitted ahead of the consumer, which keeps the
+        workers busy without letting parsed batches pile up in memory.
 
-        logging.info("Parsing messages")
-        message_df = self.parse_messages(self.messages)
+        Args:
+            message_ranges: The message ranges to parse.
 
-        if fill_missing_data:
-            logging.info("Filling missing data")
-            message_df = fill_plain_text_body(message_df)
+        Yields:
+            Each range and the result of parsing it.
+        """
+        if self.num_processes == 1:
+            _init_worker(self.manifest, self.headers_only)
+            for message_range in message_ranges:
+                yield message_range, _parse_message_range(message_range)
+            return
+
+        pending_ranges = iter(message_ranges)
+        with mp.get_context("spawn").Pool(
+            processes=self.num_processes, initializer=_init_worker, initargs=(self.manifest, self.headers_only)
+        ) as pool:
+            in_flight: Deque[Tuple[MessageRange, AsyncResult]] = deque()
+            for message_range in pending_ranges:
+                in_flight.append((message_range, pool.apply_async(_parse_message_range, (message_range,))))
+                if len(in_flight) >= 2 * self.num_processes:
+                    break
+
+            while in_flight:
+                message_range, result = in_flight.popleft()
+                parsed = result.get()
+                next_range = next(pending_ranges, None)
+                if next_range is not None:
+                    in_flight.append((next_range, pool.apply_async(_parse_message_range, (next_range,))))
+                yield message_range, parsed
+
+    def process_batch(self, batch_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the derived columns to a batch of parsed messages.
 
-        logging.info("Parsing email threading")
-        message_df = parse_email_threading(message_df)
+        Args:
+            batch_df: The dataframe of parsed messages.
 
-        logging.info("Parsing domain info")
-        message_df = parse_domain_info(message_df)
+        Returns:
+            The dataframe with the filled bodies, threading and domain columns.
+        """
+        if self.fill_missing_data and not self.headers_only:
+            # The parse workers already occupy the CPUs while batches are processed
+            batch_df = fill_plain_text_body(batch_df, self.html_cache, num_processes=1, fast_html=self.fast_html)
+        batch_df = parse_email_threading(batch_df)
+        batch_df = parse_domain_info(batch_df, self.internal_domains)
+        return batch_df
+
+    def load_bodies(self, message_df: pd.DataFrame, batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Decodes the bodies of messages previously extracted with headers_only.
 
-        logging.info("Extracting missing email ids")
-        self.missing_email_ids = self.get_missing_message_ids(message_df)
+        Only the messages in the given dataframe are read again, so filtering the headers first
+        (external senders, duplicates, date range) avoids decoding bodies that would be dropped.
 
-        self.message_df = message_df
-        logging.info(f"Extracted {len(message_df)} messages")
+        Args:
+            message_df: The dataframe of parsed headers, with the pst_file, pst_folder_path and
+                pst_index columns.
+            batch_size: The maximum number of messages decoded per worker task.
 
-    def open_pst_file(self, file_path: str) -> pypff.file:
+        Returns:
+            The dataframe with the html_body and plain_text_body columns added, and filled if
+            fill_missing_data is set.
+        """
+        tasks: List[Tuple[str, Tuple[int, ...], List[int]]] = []
+        for (file_path, folder_path), folder_df in message_df.groupby(["pst_file", "pst_folder_path"], sort=False):
+            indexes = folder_df["pst_index"].tolist()
+            for start in range(0, len(indexes), batch_size):
+                tasks.append((file_path, folder_path, indexes[start : start + batch_size]))
+
+        logging.info(f"Decoding the bodies of {len(message_df)} messages")
+        bodies: List[pd.DataFrame] = []
+        decode_counts: Counter = Counter()
+        decode_seconds: Counter = Counter()
+        with tqdm(total=len(message_df)) as pbar:
+            if self.num_processes == 1:
+                results = map(_parse_message_bodies, tasks)
+                for columns, counts, seconds in results:
+                    bodies.append(pd.DataFrame(columns))
+                    decode_counts.update(counts)
+                    decode_seconds.update(seconds)
+                    pbar.update(len(bodies[-1]))
+            else:
+                with mp.get_context("spawn").Pool(processes=self.num_processes) as pool:
+                    for columns, counts, seconds in pool.imap(_parse_message_bodies, tasks):
+                        bodies.append(pd.DataFrame(columns))
+                        decode_counts.update(counts)
+                        decode_seconds.update(seconds)
+                        pbar.update(len(bodies[-1]))
+        if decode_counts:
+            logging.info("Body decoding paths:\n\t" + format_decode_stats(decode_counts, decode_seconds))
+
+        body_columns = ["pst_file", "pst_folder_path", "pst_index", "html_body", "plain_text_body"]
+        bodies_df = pd.concat(bodies, ignore_index=True) if bodies else pd.DataFrame(columns=body_columns)
+        message_df = message_df.merge(bodies_df, on=["pst_file", "pst_folder_path", "pst_index"], how="left")
+
+        if self.fill_missing_data:
+            message_df = fill_plain_text_body(message_df, self.html_cache, self.num_processes, self.fast_html)
+            self.html_cache.save()
+        return message_df
+
+    @staticmethod
+    def open_pst_file(file_path: str) -> pypff.file:
         """
         Opens a .pst file.
 
@@ -98,144 +436,153 @@ class PSTExtractor:
         pst.open(file_path)
         return pst
 
-    def get_outlook_data_file_from_pst(self, pst: pypff.file) -> pypff.folder:
+    @staticmethod
+    def locate_folder(pst: pypff.file, folder_path: Tuple[int, ...]) -> pypff.folder:
         """
-        Gets the "Top of Outlook data file" folder from the .pst file.
+        Walks from the root folder of the .pst file down a path of sub-folder indexes.
 
         Args:
             pst: The pypff.file object.
+            folder_path: The sub-folder index at each level below the root folder.
 
         Returns:
             A pypff.folder object.
         """
-        root: pypff.folder = pst.get_root_folder()
-        root_folders: List[pypff.folder] = [
-            root.get_sub_folder(i) for i in range(root.get_number_of_sub_folders())
-        ]
-        data: Dict[str, pypff.folder] = {i.get_name(): i for i in root_folders}
-        return data["Top of Outlook data file"]
-
-    def get_pypff_folders(self, folder: pypff.folder) -> Dict[str, pypff.folder]:
+        folder: pypff.folder = pst.get_root_folder()
+        for index in folder_path:
+            folder = folder.get_sub_folder(index)
+        return folder
+
+    def walk_folders(
+        self, folder: pypff.folder, folder_path: Tuple[int, ...] = (), name: str = ""
+    ) -> Iterator[PSTFolder]:
         """
-        Gets the subfolders of the given folder.
+        Recursively walks the subfolders of a folder.
 
         Args:
-            folder: The folder to get the subfolders from.
+            folder: The folder to walk.
+            folder_path: The sub-folder index path of the folder.
+            name: The slash-separated name of the folder, relative to where the walk started.
 
-        Returns:
-            A dictionary of the subfolders with their names as the keys.
+        Yields:
+            Each subfolder at any depth, parents before their children.
         """
-        folders: List[pypff.folder] = [
-            folder.get_sub_folder(i) for i in range(folder.get_number_of_sub_folders())
-        ]
-        folders.append(folder)
-        return {i.get_name(): i for i in folders}
+        for i in range(folder.get_number_of_sub_folders()):
+            sub_folder: pypff.folder = folder.get_sub_folder(i)
+            sub_folder_path = folder_path + (i,)
+            sub_folder_name = sub_folder.get_name() or str(i)
+            if name:
+                sub_folder_name = f"{name}/{sub_folder_name}"
+
+            yield PSTFolder(sub_folder_path, sub_folder_name, sub_folder.get_number_of_sub_messages())
+            yield from self.walk_folders(sub_folder, sub_folder_path, sub_folder_name)
 
-    def retrieve_message(self, message: pypff.message) -> pypff.message:
+    def is_folder_selected(self, name: str) -> bool:
         """
-        Retrieves a message from the folder.
+        Checks a folder name against the include and exclude patterns.
+
+        A pattern matches a folder if it matches the folder's name, its full path or the path of
+        any of its parent folders, so including or excluding a folder also covers its subfolders.
 
         Args:
-            message: The message to retrieve.
+            name: The slash-separated name of the folder.
 
         Returns:
-            The retrieved message.
+            Whether the folder should be extracted.
         """
-        return message
+        parts = name.split("/")
+        candidates = [name.lower(), parts[-1].lower()] + ["/".join(parts[:i]).lower() for i in range(1, len(parts))]
 
-    def retrieve_folder(self, file_path: str) -> Optional[pypff.folder]:
+        def _matches(patterns: List[str]) -> bool:
+            return any(fnmatch(candidate, pattern.lower()) for pattern in patterns for candidate in candidates)
+
+        if _matches(self.exclude_folders):
+            return False
+        return self.include_folders is None or _matches(self.include_folders)
+
+    def retrieve_folders(self, file_path: str) -> List[PSTFolder]:
         """
-        Retrieves the folder from the .pst file.
+        Retrieves the non-empty folders to extract from the .pst file, at any depth.
 
         Args:
             file_path: The path to the .pst file.
 
         Returns:
-            The folder object if it was found, otherwise None.
+            The selected folders, or an empty list if the file could not be read.
         """
         try:
             pst: pypff.file = self.open_pst_file(file_path)
-            outlook_data_file: pypff.folder = self.get_outlook_data_file_from_pst(pst)
-            folders: Dict[str, pypff.folder] = self.get_pypff_folders(outlook_data_file)
-
-            folder_info = sorted([(name, len(folder.sub_messages)) for name, folder in folders.items()], key=lambda x: x[1], reverse=True)
-            logging.info(f"Found {len(folders)} folders:\n\t" + "\n\t".join([f"{name}: {count} messages" for name, count in folder_info]))
-
-            if "Inbox" in folders:
-                return folders["Inbox"]
-            elif len(outlook_data_file.sub_messages) > 0:
-                logging.info(f"Using Outlook data file folder")
-                return outlook_data_file
+            root: pypff.folder = pst.get_root_folder()
+            root_names = [root.get_sub_folder(i).get_name() for i in range(root.get_number_of_sub_folders())]
+            if "Top of Outlook data file" in root_names:
+                data_file_path: Tuple[int, ...] = (root_names.index("Top of Outlook data file"),)
             else:
-                logging.error("Inbox folder not found, and Outlook data file folder is empty")
-                return None
+                data_file_path = ()
+            outlook_data_file: pypff.folder = self.locate_folder(pst, data_file_path)
+
+            folders = [
+                folder
+                for folder in [
+                    PSTFolder(data_file_path, "Top of Outlook data file", outlook_data_file.get_number_of_sub_messages()),
+                    *self.walk_folders(outlook_data_file, data_file_path),
+                ]
+                if folder.message_count > 0
+            ]
+            selected = [folder for folder in folders if self.is_folder_selected(folder.name)]
+
+            folder_info = sorted(folders, key=lambda x: x.message_count, reverse=True)
+            logging.info(
+                f"Found {len(folders)} non-empty folders, {len(selected)} selected:\n\t"
+                + "\n\t".join(
+                    f"{'+' if folder in selected else '-'} {folder.name}: {folder.message_count} messages"
+                    for folder in folder_info
+                )
+            )
+            return selected
         except Exception as e:
-            logging.error(f"Error retrieving folder from {file_path}: {e}")
-            return None
+            logging.error(f"Error retrieving folders from {file_path}: {e}")
+            return []
 
-    def extract_messages_from_pst(self, folder: pypff.folder) -> List[pypff.message]:
+    def get_missing_message_ids(self, message_df: pd.DataFrame) -> Set[str]:
         """
-        Extracts the messages from the folder.
+        Gets the missing message ids from the message dataframe.
 
         Args:
-            folder: The folder to extract the messages from.
+            message_df: The message dataframe.
 
         Returns:
-            A list of the extracted messages.
+            A set of the missing message ids.
         """
-        sub_messages = list(folder.sub_messages)
-        total = len(sub_messages)
-
-        num_processes = mp.cpu_count()
-        chunk_size = int(total / num_processes)
-
-        logging.info(f"Using {num_processes} processes with a chunk size of {chunk_size}")
-
-        with Pool(processes=num_processes) as pool:
-            with tqdm(total=total) as pbar:
-                message_array = []
-                for message in pool.imap_unordered(
-                    self.retrieve_message, sub_messages, chunksize=chunk_size
-                ):
-                    message_array.append(message)
-                    pbar.update(1)
-
-        return message_array
+        existing_message_ids = set(message_df["message_id"].values)
+        return self.get_referenced_message_ids(message_df) - existing_message_ids
 
-    def get_missing_message_ids(self, message_df: pd.DataFrame) -> Set[str]:
+    def get_referenced_message_ids(self, message_df: pd.DataFrame) -> Set[str]:
         """
-        Gets the missing message ids from the message dataframe.
+        Gets the message ids referenced by the replies in the message dataframe.
+
+        Forwarded messages are left out, since the threads they quote are not part of the mailbox.
 
         Args:
             message_df: The message dataframe.
 
         Returns:
-            A set of the missing message ids.
+            A set of the referenced message ids.
         """
-        existing_message_ids = set(message_df["message_id"].values)
-        missing_message_ids: Set[str] = set()
-        for _, row in message_df.iterrows():
-            if (
-                (row["references"] is None and row["previous_message_id"] is None)
-                or row["subject_prefix"]
-                and "fw" in row["subject_prefix"]
-            ):
-                continue
-            if row["references"]:
-                for reference in row["references"].split(","):
-                    if reference not in existing_message_ids:
-                        missing_message_ids.add(reference)
-            if row["previous_message_id"] and row["previous_message_id"] not in existing_message_ids:
-                missing_message_ids.add(row["previous_message_id"])
-
-        return missing_message_ids
+        is_forward = message_df["subject_prefix"].fillna("").str.contains("fw", regex=False)
+        return ThreadGraph.from_dataframe(message_df.loc[~is_forward]).referenced_message_ids()
 
-    def parse_message(self, message: pypff.message) -> Dict[str, Any]:
+    @staticmethod
+    def parse_message(
+        message: pypff.message, headers_only: bool = False, headers: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
         """
         Parses a message and extracts the relevant information.
 
         Args:
             message: The message to parse.
+            headers_only: Whether to leave out the bodies, which are the expensive part to decode.
+            headers: The transport headers already scanned from the message, see parse_headers.
+                Defaults to scanning them.
 
         Returns:
             A dictionary of the extracted information.
@@ -250,7 +597,8 @@ class PSTExtractor:
         delivery_time = parse_timestamp(safe_getattr(message, "get_delivery_time_as_integer"))
 
         # Headers
-        headers = parse_headers(message)
+        if headers is None:
+            headers = parse_headers(message)
         content_type = headers.get("content-type", None)
         charset = charset_from_content_type(content_type)
 
@@ -265,18 +613,14 @@ class PSTExtractor:
         cc_address = parse_addresses(headers.get("cc", None))
         bcc_address = parse_addresses(headers.get("bcc", None))
 
-        # Body types
-        html_body = parse_body(safe_getattr(message, "html_body"), charset)
-        plain_text_body = parse_body(safe_getattr(message, "plain_text_body"), charset)
-
-        return {
+        record = {
             "message_id": message_id,
             "subject": subject,
             "subject_prefix": subject_prefix,
             "submit_time": submit_time,
             "delivery_time": delivery_time,
-            "html_body": html_body,
-            "plain_text_body": plain_text_body,
+            "html_body": None,
+            "plain_text_body": None,
             "from_name": from_name,
             "from_address": from_address,
             "to_address": to_address,
@@ -286,6 +630,36 @@ class PSTExtractor:
             "references": references,
         }
 
+        if headers_only:
+            del record["html_body"], record["plain_text_body"]
+        else:
+            # Body types
+            record["html_body"], record["plain_text_body"] = PSTExtractor.parse_message_bodies(
+                message, charset, from_address
+            )
+
+        return record
+
+    @staticmethod
+    def parse_message_bodies(
+        message: pypff.message, charset: Optional[str], from_address: Optional[str] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Decodes the HTML and plain text bodies of a message.
+
+        Args:
+            message: The message to decode.
+            charset: The charset declared in the Content-Type header, if any.
+            from_address: The sender address, whose domain keys the detected charset cache.
+
+        Returns:
+            The HTML body and the plain text body.
+        """
+        sender_domain = from_address.rsplit("@", 1)[-1] if from_address else None
+        html_body = parse_body(safe_getattr(message, "html_body"), charset, sender_domain)
+        plain_text_body = parse_body(safe_getattr(message, "plain_text_body"), charset, sender_domain)
+        return html_body, plain_text_body
+
     def parse_messages(self, messages: List[pypff.message]) -> pd.DataFrame:
         """
         Parses the messages and extracts the relevant information.
@@ -296,17 +670,130 @@ class PSTExtractor:
         Returns:
             A dataframe of the extracted information.
         """
-        num_processes = mp.cpu_count()
-        chunk_size = max(1, len(messages) // num_processes)
+        return pd.DataFrame([self.parse_message(message) for message in tqdm(messages)])
+
+
+def _init_worker(manifest: Optional[ExtractionManifest], headers_only: bool) -> None:
+    """
+    Sets up a worker process.
+
+    Args:
+        manifest: The extraction manifest to check messages against, if any.
+        headers_only: Whether to skip decoding the message bodies.
+    """
+    global _manifest, _headers_only
+    _manifest = manifest
+    _headers_only = headers_only
+
+
+def _open_folder(file_path: str, folder_path: Tuple[int, ...]) -> pypff.folder:
+    """
+    Opens a folder of a .pst file, opening the file only once per worker process.
+
+    Args:
+        file_path: The path to the .pst file.
+        folder_path: The sub-folder index path of the folder.
+
+    Returns:
+        A pypff.folder object.
+    """
+    if file_path not in _open_pst_files:
+        _open_pst_files[file_path] = PSTExtractor.open_pst_file(file_path)
+    return PSTExtractor.locate_folder(_open_pst_files[file_path], folder_path)
+
 
-        logging.info(f"Using {num_processes} processes with a chunk size of {chunk_size}")
+def _parse_message_range(message_range: MessageRange) -> ParsedRange:
+    """
+    Parses a contiguous range of messages in a worker process.
+
+    Each worker opens a .pst file once and reuses it for every range it is given. The records
+    are returned column by column, which pickles far more compactly than a list of dictionaries.
+    Messages already recorded in the worker's manifest are skipped before being parsed.
+
+    Args:
+        message_range: The range of messages to parse.
+
+    Returns:
+        The parsed columns, the seconds spent, the number of skipped messages and of messages that
+        failed to parse, the pypff identifiers and latest delivery time of the parsed messages, and
+        the body decoding stats.
+    """
+    start_time = time.time()
+    file_path, folder_path, folder_name, start, stop, fingerprint, store_name = message_range
+    folder = _open_folder(file_path, folder_path)
+
+    columns: Dict[str, List[Any]] = defaultdict(list)
+    identifiers: List[int] = []
+    max_delivery_time: Optional[int] = None
+    skipped = 0
+    errors = 0
+    for index in range(start, stop):
+        try:
+            message = folder.get_sub_message(index)
+            if _manifest and _manifest.is_recorded(fingerprint, store_name, folder_name, message):
+                skipped += 1
+                continue
+            # The headers are scanned once, for the Message-ID check and the record
+            headers = parse_headers(message)
+            if _manifest and _manifest.has_message_id(headers):
+                skipped += 1
+                continue
+            record = PSTExtractor.parse_message(message, _headers_only, headers)
+        except Exception as e:
+            logging.error(f"Error parsing message {index} of {file_path}: {e}")
+            errors += 1
+            continue
+        if _headers_only:
+            record.update({"pst_file": file_path, "pst_folder_path": folder_path, "pst_index": index})
+        for key, value in record.items():
+            columns[key].append(value)
+
+        identifiers.append(safe_getattr(message, "identifier"))
+        delivery_time = safe_getattr(message, "get_delivery_time_as_integer")
+        if delivery_time and (max_delivery_time is None or delivery_time > max_delivery_time):
+            max_delivery_time = delivery_time
+
+    return ParsedRange(
+        dict(columns),
+        time.time() - start_time,
+        skipped,
+        errors,
+        identifiers,
+        max_delivery_time,
+        *body_decoder.pop_stats(),
+    )
+
+
+def _parse_message_bodies(
+    task: Tuple[str, Tuple[int, ...], List[int]]
+) -> Tuple[Dict[str, List[Any]], Counter, Counter]:
+    """
+    Decodes the bodies of the given messages of a .pst folder in a worker process.
 
-        results = []
-        with Pool(processes=num_processes) as pool:
-            total = len(messages)
-            with tqdm(total=total) as pbar:
-                for result in pool.imap_unordered(self.parse_message, messages, chunksize=chunk_size):
-                    results.append(result)
-                    pbar.update(1)
+    Args:
+        task: The path to the .pst file, the sub-folder index path and the message indexes.
 
-        return pd.DataFrame(results)
+    Returns:
+        A dictionary of the locator and body columns of the decoded messages, and the body
+        decoding counts and seconds per path.
+    """
+    file_path, folder_path, indexes = task
+    folder = _open_folder(file_path, folder_path)
+
+    columns: Dict[str, List[Any]] = defaultdict(list)
+    for index in indexes:
+        try:
+            message = folder.get_sub_message(index)
+            headers = parse_headers(message)
+            charset = charset_from_content_type(headers.get("content-type", None))
+            from_address = parse_addresses(headers.get("from", None))
+            html_body, plain_text_body = PSTExtractor.parse_message_bodies(message, charset, from_address)
+        except Exception as e:
+            logging.error(f"Error decoding message {index} of {file_path}: {e}")
+            continue
+        columns["pst_file"].append(file_path)
+        columns["pst_folder_path"].append(folder_path)
+        columns["pst_index"].append(index)
+        columns["html_body"].append(html_body)
+        columns["plain_text_body"].append(plain_text_body)
+    return (dict(columns), *body_decoder.pop_stats())
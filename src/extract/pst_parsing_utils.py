@@ -1,10 +1,24 @@
+import re
 from datetime import datetime, timedelta, timezone
+from email.header import decode_header, make_header
 from email.parser import HeaderParser
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
 
 import pandas as pd
 import pypff
 
+# The headers read by PSTExtractor, lower-cased
+TRANSPORT_HEADER_FIELDS = ("content-type", "message-id", "in-reply-to", "references", "from", "to", "cc", "bcc")
+
+# A header line with its folded continuation lines, as recognised by email.feedparser: a name of
+# printable characters followed by a colon. Any other non-blank line is captured in the last group.
+_HEADER_LINE = re.compile(
+    r"^(?:([\041-\071\073-\176]+):[ \t]*(.*(?:\r?\n[ \t].*)*)|(?![ \t]|\r?$)(.))", re.MULTILINE
+)
+
+# A line break followed by whitespace, which RFC 5322 unfolding removes
+_FOLD = re.compile(r"\r?\n(?=[ \t])")
+
 
 def safe_getattr(obj, attr, default=None):
     """
@@ -26,19 +40,58 @@ def safe_getattr(obj, attr, default=None):
         return default
 
 
-def parse_headers(message: pypff.message) -> Dict[str, Any]:
+def parse_headers(message: pypff.message, fields: Iterable[str] = TRANSPORT_HEADER_FIELDS) -> Dict[str, Any]:
     """
     Parse email headers from a pypff.message object into a dictionary.
 
-    The keys are lower-cased to ensure consistency.
+    The keys are lower-cased to ensure consistency. Only the requested fields are
+    extracted, see scan_headers.
 
     :param message: pypff.message object
+    :param fields: names of the headers to extract
     :return: dictionary of email headers
     """
-    
     headers = message.get_transport_headers()
-    parsed_headers = HeaderParser().parsestr(headers)
-    return {k.lower(): v for k, v in parsed_headers.items()} if parsed_headers else {}
+    return scan_headers(headers, fields) if headers else {}
+
+
+def scan_headers(headers: str, fields: Iterable[str], decode_fields: Iterable[str] = ()) -> Dict[str, str]:
+    """
+    Extract the requested fields from a raw header block with a single regex pass.
+
+    Folded values are unfolded as per RFC 5322. If a field occurs more than once, the
+    last occurrence wins, as it did when the headers were parsed into a dictionary.
+    Encoded-words (RFC 2047) are decoded for the fields in decode_fields only, since
+    decoding an address header can introduce commas that break address splitting.
+    Header blocks with lines that are neither headers nor continuations fall back to
+    the stdlib HeaderParser.
+
+    :param headers: raw header block
+    :param fields: names of the headers to extract
+    :param decode_fields: names of the headers whose encoded-words should be decoded
+    :return: dictionary of the lower-cased header names to their values
+    """
+    ends = [end for end in (headers.find("\r\n\r\n"), headers.find("\n\n")) if end >= 0]
+    if ends:
+        headers = headers[: min(ends)]
+
+    wanted = frozenset(field.lower() for field in fields)
+    scanned: Dict[str, str] = {}
+    for name, value, malformed in _HEADER_LINE.findall(headers):
+        if malformed:
+            parsed_headers = HeaderParser().parsestr(headers)
+            scanned = {k.lower(): str(v) for k, v in parsed_headers.items() if k.lower() in wanted}
+            break
+        name = name.lower()
+        if name in wanted:
+            scanned[name] = _FOLD.sub("", value).strip(" \t\r")
+
+    for field in wanted.intersection(decode_fields).intersection(scanned):
+        try:
+            scanned[field] = str(make_header(decode_header(scanned[field])))
+        except Exception:
+            pass
+    return scanned
 
 
 def parse_timestamp(timestamp: Optional[int]) -> Optional[datetime]:
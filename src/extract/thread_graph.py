@@ -0,0 +1,280 @@
+import logging
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+# Pointer jumping halves the remaining distance to the root on every pass, so only a reply
+# cycle in malformed headers can keep it from converging within this many passes
+MAX_JUMP_PASSES = 64
+
+
+class ThreadGraph:
+    """
+    The reply graph of a set of emails, with every Message-ID coded as an integer node.
+
+    The nodes are the Message-IDs of the emails and every Message-ID they refer to through
+    In-Reply-To or References, including the ancestors missing from the emails. The graph is
+    built in one vectorized pass over the DataFrame. The parent, root and depth of every node
+    are arrays indexed by node code, and children and thread members are kept as CSR-style
+    offsets into sorted node arrays, so every query below is O(1) or linear in its result.
+    The queries about one Message-ID raise a KeyError when it is not in the graph.
+
+    A message's parent is its In-Reply-To, or else the last entry of its References. The
+    References of a message also link each listed ancestor to the entry before it, which
+    threads messages whose direct parents are missing.
+
+    Attributes
+    ----------
+    message_ids : pd.Index
+        The Message-ID of each node, positioned by node code.
+    is_message : np.ndarray
+        Whether each node is one of the emails, rather than a missing ancestor.
+    is_referenced : np.ndarray
+        Whether each node is referred to by the In-Reply-To or References of an email.
+    parent : np.ndarray
+        The parent code of each node, -1 for thread roots.
+    root : np.ndarray
+        The root code of each node's thread.
+    depth : np.ndarray
+        The number of ancestors of each node.
+    row_codes : np.ndarray
+        The node code of each row of the DataFrame the graph was built from, -1 for rows
+        without a Message-ID.
+    row_parents : np.ndarray
+        The parent code of each row of the DataFrame, -1 for rows that reply to nothing.
+    """
+
+    def __init__(
+        self,
+        message_ids: pd.Index,
+        is_message: np.ndarray,
+        is_referenced: np.ndarray,
+        parent: np.ndarray,
+        row_codes: np.ndarray,
+        row_parents: np.ndarray,
+    ) -> None:
+        """
+        Initializes the graph from its nodes and parent links, resolving roots and depths.
+
+        Parameters
+        ----------
+        message_ids : pd.Index
+            The Message-ID of each node, positioned by node code.
+        is_message : np.ndarray
+            Whether each node is one of the emails.
+        is_referenced : np.ndarray
+            Whether each node is referred to by an email.
+        parent : np.ndarray
+            The parent code of each node, -1 for thread roots.
+        row_codes : np.ndarray
+            The node code of each row, -1 for rows without a Message-ID.
+        row_parents : np.ndarray
+            The parent code of each row, -1 for rows that reply to nothing.
+        """
+        self.message_ids = message_ids
+        self.is_message = is_message
+        self.is_referenced = is_referenced
+        self.parent = parent
+        self.row_codes = row_codes
+        self.row_parents = row_parents
+        self.root, self.depth = self._resolve_roots()
+        self._children_order, self._children_offsets = _group_offsets(self.parent)
+        self._member_order, self._member_offsets = _group_offsets(np.where(self.is_message, self.root, -1))
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "ThreadGraph":
+        """
+        Builds the graph of a DataFrame of emails.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The DataFrame of emails, with the "message_id", "previous_message_id" and
+            "references" columns, the latter holding comma-separated Message-IDs.
+
+        Returns
+        -------
+        ThreadGraph
+            The reply graph of the emails.
+        """
+        row_count = len(df)
+        own_ids = _column(df, "message_id")
+        previous_ids = _column(df, "previous_message_id")
+
+        references = pd.Series(_column(df, "references")).str.split(r",\s*").explode()
+        references = references[references.notna() & (references != "")]
+        reference_rows = references.index.to_numpy(dtype=np.int64)
+
+        codes, uniques = pd.factorize(np.concatenate([own_ids, previous_ids, references.to_numpy(dtype=object)]))
+        own_codes = codes[:row_count]
+        previous_codes = codes[row_count : 2 * row_count]
+        reference_codes = codes[2 * row_count :]
+        node_count = len(uniques)
+
+        parent = np.full(node_count, -1, dtype=np.int64)
+        # Each References entry follows its parent
+        same_row = reference_rows[1:] == reference_rows[:-1]
+        parent[reference_codes[1:][same_row]] = reference_codes[:-1][same_row]
+
+        last_reference = np.full(row_count, -1, dtype=np.int64)
+        is_last = np.append(~same_row, True) if len(reference_rows) else np.zeros(0, dtype=bool)
+        last_reference[reference_rows[is_last]] = reference_codes[is_last]
+        row_parents = np.where(previous_codes >= 0, previous_codes, last_reference)
+        has_id = own_codes >= 0
+        parent[own_codes[has_id]] = row_parents[has_id]
+        parent[parent == np.arange(node_count)] = -1
+
+        is_message = np.zeros(node_count, dtype=bool)
+        is_message[own_codes[has_id]] = True
+        is_referenced = np.zeros(node_count, dtype=bool)
+        is_referenced[reference_codes] = True
+        is_referenced[previous_codes[previous_codes >= 0]] = True
+
+        return cls(pd.Index(uniques), is_message, is_referenced, parent, own_codes, row_parents)
+
+    def _resolve_roots(self):
+        """Computes the root and depth of every node by pointer jumping, cutting reply cycles."""
+        nodes = np.arange(len(self.parent))
+        for _ in range(2):
+            ancestor = np.where(self.parent >= 0, self.parent, nodes)
+            depth = (self.parent >= 0).astype(np.int64)
+            for _ in range(MAX_JUMP_PASSES):
+                if np.array_equal(ancestor, ancestor[ancestor]):
+                    break
+                depth = depth + depth[ancestor]
+                ancestor = ancestor[ancestor]
+
+            # A chain ending in a cycle jumps onto the cycle rather than onto a root without a parent
+            ends_in_cycle = self.parent[ancestor] >= 0
+            if not ends_in_cycle.any():
+                return ancestor, depth
+
+            # Walk each cycle from the node its chains jumped onto, so that only the nodes on the
+            # cycle are cut and the replies hanging off it keep their parents
+            on_cycle = np.zeros(len(nodes), dtype=bool)
+            frontier = np.unique(ancestor[ends_in_cycle])
+            while len(frontier):
+                on_cycle[frontier] = True
+                frontier = np.unique(self.parent[frontier])
+                frontier = frontier[~on_cycle[frontier]]
+            logging.warning(f"Cutting {int(on_cycle.sum())} emails out of reply cycles")
+            self.parent = np.where(on_cycle, -1, self.parent)
+        return np.where(self.parent >= 0, self.parent, nodes), (self.parent >= 0).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.message_ids)
+
+    def code(self, message_id: str) -> int:
+        """
+        Gets the node code of a Message-ID.
+
+        Parameters
+        ----------
+        message_id : str
+            The Message-ID.
+
+        Returns
+        -------
+        int
+            The node code, or -1 if the Message-ID is not in the graph.
+        """
+        return int(self.message_ids.get_indexer([message_id])[0])
+
+    def _known_code(self, message_id: str) -> int:
+        """Gets the node code of a Message-ID, raising a KeyError if it is not in the graph."""
+        code = self.code(message_id)
+        if code < 0:
+            raise KeyError(message_id)
+        return code
+
+    def parent_of(self, message_id: str) -> Optional[str]:
+        """Gets the Message-ID an email replies to, or None for a thread root."""
+        parent = self.parent[self._known_code(message_id)]
+        return self.message_ids[parent] if parent >= 0 else None
+
+    def root_of(self, message_id: str) -> str:
+        """Gets the Message-ID of the first email of an email's thread."""
+        return self.message_ids[self.root[self._known_code(message_id)]]
+
+    def depth_of(self, message_id: str) -> int:
+        """Gets the number of emails an email's thread holds before it."""
+        return int(self.depth[self._known_code(message_id)])
+
+    def children_of(self, message_id: str) -> List[str]:
+        """Gets the Message-IDs of the direct replies to an email."""
+        code = self._known_code(message_id)
+        start, stop = self._children_offsets[code], self._children_offsets[code + 1]
+        return self.message_ids[self._children_order[start:stop]].tolist()
+
+    def thread_members(self, message_id: str) -> List[str]:
+        """Gets the Message-IDs of the emails in the thread of an email, ordered by depth."""
+        root = self.root[self._known_code(message_id)]
+        members = self._member_order[self._member_offsets[root] : self._member_offsets[root + 1]]
+        return self.message_ids[members[np.argsort(self.depth[members], kind="stable")]].tolist()
+
+    def roots(self) -> pd.Index:
+        """Gets the Message-IDs of the thread roots that hold at least one of the emails."""
+        return self.message_ids[np.unique(self.root[self.is_message])]
+
+    def thread_sizes(self) -> pd.Series:
+        """Gets the number of emails in each thread, indexed by the Message-ID of its root."""
+        sizes = np.diff(self._member_offsets)
+        has_members = sizes > 0
+        return pd.Series(sizes[has_members], index=self.message_ids[has_members], name="thread_size")
+
+    def missing_message_ids(self) -> Set[str]:
+        """Gets the Message-IDs referred to by the emails but missing from them."""
+        return set(self.message_ids[self.is_referenced & ~self.is_message])
+
+    def referenced_message_ids(self) -> Set[str]:
+        """Gets the Message-IDs referred to by the In-Reply-To or References of the emails."""
+        return set(self.message_ids[self.is_referenced])
+
+    def thread_columns(self) -> Dict[str, np.ndarray]:
+        """
+        Gets the threading columns of the rows the graph was built from.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            The "first_in_thread", "num_previous_messages" and "thread_id" of every row, where
+            thread_id is the Message-ID of the thread root, possibly a missing ancestor.
+        """
+        has_id = self.row_codes >= 0
+        has_parent = self.row_parents >= 0
+        depth = np.zeros(len(self.row_codes), dtype=np.int64)
+        root = np.full(len(self.row_codes), -1, dtype=np.int64)
+        # Rows without a Message-ID are not nodes, so they are placed through their parent
+        placed_by_parent = ~has_id & has_parent
+        depth[has_id] = self.depth[self.row_codes[has_id]]
+        depth[placed_by_parent] = self.depth[self.row_parents[placed_by_parent]] + 1
+        root[has_id] = self.root[self.row_codes[has_id]]
+        root[placed_by_parent] = self.root[self.row_parents[placed_by_parent]]
+
+        thread_id = np.full(len(self.row_codes), None, dtype=object)
+        thread_id[root >= 0] = self.message_ids.to_numpy(dtype=object)[root[root >= 0]]
+        return {"first_in_thread": ~has_parent, "num_previous_messages": depth, "thread_id": thread_id}
+
+
+def _column(df: pd.DataFrame, column: str) -> np.ndarray:
+    """Gets a column of identifiers as an object array, all None if the column is absent."""
+    if column not in df.columns:
+        return np.full(len(df), None, dtype=object)
+    values = df[column].to_numpy(dtype=object)
+    return np.where(pd.isna(values) | (values == ""), None, values)
+
+
+def _group_offsets(groups: np.ndarray):
+    """
+    Sorts node codes by group code into CSR-style offsets, skipping nodes in group -1.
+
+    Returns the node codes sorted by group, and the offset of each group's first node, so the
+    nodes of group g are order[offsets[g] : offsets[g + 1]].
+    """
+    in_group = groups >= 0
+    nodes = np.flatnonzero(in_group)
+    order = nodes[np.argsort(groups[in_group], kind="stable")]
+    counts = np.bincount(groups[in_group], minlength=len(groups))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return order, offsets
@@ -0,0 +1,61 @@
+"""
+Runs the email analysis pipeline headlessly, from the PST files to the exported tables.
+
+The stages form a DAG: once spam is filtered out, the categories, products, entities,
+summaries and derived tables run concurrently, within the limits of the gpu and llm
+resources. The wall-clock time of each stage and of the run is reported at the end.
+
+Usage:
+    python -m src.pipeline --config config.json --data-dir data
+    python -m src.pipeline --messages data/interim/preprocessed_messages.csv --stages categories products
+"""
+
+import argparse
+import logging
+
+from src.config.config import Config
+from src.pipeline.dag import DAGScheduler
+from src.pipeline.stages import RESOURCE_LIMITS, build_stages
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--config", default="config.json", help="path to the config file")
+    arg_parser.add_argument("--data-dir", default="data", help="directory of the checkpoints and stage cache")
+    arg_parser.add_argument("--pst-directory", help="directory of the PST files, overriding the config")
+    arg_parser.add_argument("--output-directory", help="directory of the exported tables, overriding the config")
+    arg_parser.add_argument("--messages", help="CSV or Parquet file of messages to start from instead of the PST files")
+    arg_parser.add_argument("--stages", nargs="+", help="stages to run along with their dependencies, defaults to all")
+    arg_parser.add_argument("--llm-entities", action="store_true", help="extract entities with the LLM, not regexes")
+    arg_parser.add_argument("--load", action="store_true", help="load the tables into the database")
+    arg_parser.add_argument("--max-workers", type=int, default=4, help="maximum number of stages running at once")
+    arg_parser.add_argument("--gpu-slots", type=int, default=RESOURCE_LIMITS["gpu"], help="zero-shot stages at once")
+    arg_parser.add_argument("--llm-slots", type=int, default=RESOURCE_LIMITS["llm"], help="LLM stages at once")
+    arg_parser.add_argument("--num-processes", type=int, help="worker processes per stage, defaults to the CPU count")
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(levelname)s %(message)s")
+
+    config = Config.from_json(args.config)
+    if args.pst_directory:
+        config.pst_directory = args.pst_directory
+    if args.output_directory:
+        config.output_directory = args.output_directory
+
+    stages = build_stages(
+        config,
+        args.data_dir,
+        messages_path=args.messages,
+        use_regex_entities=not args.llm_entities,
+        load=args.load,
+        num_processes=args.num_processes,
+    )
+    resource_limits = {**RESOURCE_LIMITS, "gpu": args.gpu_slots, "llm": args.llm_slots}
+    scheduler = DAGScheduler(stages, resource_limits=resource_limits, max_workers=args.max_workers)
+    try:
+        scheduler.run(args.stages)
+    finally:
+        print(scheduler.format_timings())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+class Stage(NamedTuple):
+    """
+    A stage of the pipeline.
+
+    Attributes:
+        name (str): The name of the stage, which its dependents refer to.
+        function (Callable[[Dict[str, Any]], Any]): Computes the output of the stage from the
+            outputs of its dependencies, keyed by stage name.
+        dependencies (Tuple[str, ...]): The stages whose outputs this stage reads.
+        resources (Tuple[Tuple[str, int], ...]): The units of each limited resource the stage
+            holds while running, e.g. (("gpu", 1),).
+    """
+
+    name: str
+    function: Callable[[Dict[str, Any]], Any]
+    dependencies: Tuple[str, ...] = ()
+    resources: Tuple[Tuple[str, int], ...] = ()
+
+
+class StageTiming(NamedTuple):
+    """
+    The wall-clock time of a stage run.
+
+    Attributes:
+        name (str): The name of the stage.
+        start (float): The seconds from the start of the run to the start of the stage.
+        seconds (float): The seconds the stage ran for.
+    """
+
+    name: str
+    start: float
+    seconds: float
+
+
+class DAGScheduler:
+    """
+    Runs the stages of a pipeline as soon as their dependencies are done, concurrently on a
+    thread pool, within the limits of the resources they hold.
+
+    Stages run in threads so that they share the loaded models and dataframes. Model inference
+    and database calls release the GIL, while stages that parse in Python start their own
+    process pools. These pools spawn their workers rather than fork them, since a child forked
+    while other stages hold locks, e.g. of logging or a model, would inherit them locked.
+
+    Attributes:
+        stages (Dict[str, Stage]): The stages, by name.
+        resource_limits (Dict[str, int]): The units of each resource, e.g. {"gpu": 1, "llm": 1}.
+            Resources without a limit are unlimited.
+        max_workers (int): The maximum number of stages running at once.
+        outputs (Dict[str, Any]): The output of each stage run.
+        timings (List[StageTiming]): The timing of each stage run, in the order they finished.
+        seconds (float): The wall-clock time of the last run.
+    """
+
+    def __init__(
+        self, stages: Iterable[Stage], resource_limits: Optional[Dict[str, int]] = None, max_workers: int = 4
+    ) -> None:
+        """
+        Initializes the DAGScheduler, checking that the stages form a DAG.
+
+        Args:
+            stages (Iterable[Stage]): The stages of the pipeline.
+            resource_limits (Optional[Dict[str, int]]): The units of each resource. Defaults to no limits.
+            max_workers (int): The maximum number of stages running at once.
+
+        Raises:
+            ValueError: If a stage is declared twice, depends on an unknown stage, holds more of a
+                resource than its limit, or the dependencies form a cycle.
+        """
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Stage {stage.name} is declared twice")
+            self.stages[stage.name] = stage
+        self.resource_limits = resource_limits or {}
+        self.max_workers = max_workers
+        self.outputs: Dict[str, Any] = {}
+        self.timings: List[StageTiming] = []
+        self.seconds = 0.0
+
+        for stage in self.stages.values():
+            unknown = [dependency for dependency in stage.dependencies if dependency not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {unknown}")
+            for resource, units in stage.resources:
+                if units > self.resource_limits.get(resource, units):
+                    limit = self.resource_limits[resource]
+                    raise ValueError(f"Stage {stage.name} holds {units} {resource}, above the limit of {limit}")
+        self.topological_order()
+
+    def topological_order(self) -> List[str]:
+        """
+        Orders the stages so that each comes after its dependencies.
+
+        Returns:
+            List[str]: The names of the stages.
+
+        Raises:
+            ValueError: If the dependencies form a cycle.
+        """
+        order: List[str] = []
+        visiting: Set[str] = set()
+        visited: Set[str] = set()
+
+        def _visit(name: str, path: Tuple[str, ...]) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Stages form a cycle: {' -> '.join((*path, name))}")
+            visiting.add(name)
+            for dependency in self.stages[name].dependencies:
+                _visit(dependency, (*path, name))
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            _visit(name, ())
+        return order
+
+    def required_stages(self, targets: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Lists the stages to run to compute targets, with all of their dependencies.
+
+        Args:
+            targets (Optional[Iterable[str]]): The stages to compute. Defaults to every stage.
+
+        Returns:
+            List[str]: The names of the stages, in topological order.
+
+        Raises:
+            ValueError: If a target is an unknown stage.
+        """
+        if targets is None:
+            return self.topological_order()
+        required: Set[str] = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}, the stages are {list(self.stages)}")
+            if name not in required:
+                required.add(name)
+                pending.extend(self.stages[name].dependencies)
+        return [name for name in self.topological_order() if name in required]
+
+    def run(self, targets: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Runs the stages needed for targets, each as soon as its dependencies are done and the
+        resources it holds are available. If a stage fails, the running stages are finished,
+        no other stage is started, and the error is raised.
+
+        Args:
+            targets (Optional[Iterable[str]]): The stages to compute. Defaults to every stage.
+
+        Returns:
+            Dict[str, Any]: The output of each stage run, by name.
+        """
+        pending = self.required_stages(targets)
+        self.outputs = {}
+        self.timings = []
+        in_use: Dict[str, int] = {}
+        running: Dict[Future, Tuple[str, float]] = {}
+        error: Optional[BaseException] = None
+        run_start = time.perf_counter()
+
+        def _fits(stage: Stage) -> bool:
+            return all(
+                in_use.get(resource, 0) + units <= self.resource_limits[resource]
+                for resource, units in stage.resources
+                if resource in self.resource_limits
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as executor:
+            while running or (pending and error is None):
+                if error is None:
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if len(running) >= self.max_workers:
+                            break
+                        if all(dependency in self.outputs for dependency in stage.dependencies) and _fits(stage):
+                            for resource, units in stage.resources:
+                                in_use[resource] = in_use.get(resource, 0) + units
+                            inputs = {dependency: self.outputs[dependency] for dependency in stage.dependencies}
+                            logging.info(f"Starting stage {name}")
+                            running[executor.submit(stage.function, inputs)] = (name, time.perf_counter())
+                            pending.remove(name)
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, stage_start = running.pop(future)
+                    for resource, units in self.stages[name].resources:
+                        in_use[resource] -= units
+                    timing = StageTiming(name, stage_start - run_start, time.perf_counter() - stage_start)
+                    self.timings.append(timing)
+                    try:
+                        self.outputs[name] = future.result()
+                        logging.info(f"Finished stage {name} in {timing.seconds:.1f}s")
+                    except Exception as e:
+                        logging.error(f"Stage {name} failed after {timing.seconds:.1f}s: {e}")
+                        error = error or e
+
+        self.seconds = time.perf_counter() - run_start
+        if error is not None:
+            raise error
+        return self.outputs
+
+    def format_timings(self) -> str:
+        """
+        Formats the wall-clock time of each stage of the last run and of the whole run.
+
+        Returns:
+            str: One line per stage with its start and duration, then the totals.
+        """
+        width = max([len("stage"), *(len(timing.name) for timing in self.timings)])
+        lines = [f"{'stage':<{width}}  {'start':>8}  {'seconds':>8}"]
+        for timing in sorted(self.timings, key=lambda timing: timing.start):
+            lines.append(f"{timing.name:<{width}}  {timing.start:>7.1f}s  {timing.seconds:>7.1f}s")
+        stage_seconds = sum(timing.seconds for timing in self.timings)
+        lines.append(f"Total: {self.seconds:.1f}s wall-clock for {stage_seconds:.1f}s of stage time")
+        return "\n".join(lines)
@@ -0,0 +1,231 @@
+import datetime
+import glob
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.config.config import Config
+from src.pipeline.dag import Stage
+from src.transform.message_transformer import clean_texts, get_languages, get_response_time
+from src.utils.checkpoint import DataFrameCheckpointer
+from src.utils.stage_cache import StageCache
+
+# The classifiers, LLMs and database are imported by the stages using them, since the
+# classification modules load their models on import
+
+ZERO_SHOT_MODEL_NAME = "facebook/bart-large-mnli"
+
+# The default units of each resource: the zero-shot classifiers hold the gpu, the LLM stages the llm
+RESOURCE_LIMITS = {"gpu": 1, "llm": 1, "database": 1}
+
+# The stages computing the tables exported and loaded along with the messages
+TABLE_STAGES = ("tables", "categories", "products", "entities", "summaries")
+
+
+def create_address_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lists the addresses of each message, one row per message and address type.
+
+    As in the transform notebook, the from, to, cc and bcc fields are kept whole, so a row
+    holds every comma-separated recipient of its type, and missing fields give empty rows.
+
+    Args:
+        df (pd.DataFrame): The messages, with the from, to, cc and bcc addresses.
+
+    Returns:
+        pd.DataFrame: The message_id, address_type and address columns.
+    """
+    return pd.concat(
+        [
+            pd.DataFrame(
+                {"message_id": df["message_id"], "address_type": address_type, "address": df[f"{address_type}_address"]}
+            )
+            for address_type in ["from", "to", "cc", "bcc"]
+        ],
+        ignore_index=True,
+    )
+
+
+def create_reference_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Lists the messages each message references, one row per reference."""
+    return df[["message_id", "references"]].explode("references").rename(columns={"references": "reference_message_id"})
+
+
+def create_domain_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Lists the sender domains of each message, one row per domain."""
+    return df[["message_id", "sender_domain"]].explode("sender_domain")
+
+
+def build_stages(
+    config: Config,
+    data_dir: str,
+    messages_path: Optional[str] = None,
+    use_regex_entities: bool = True,
+    load: bool = False,
+    num_processes: Optional[int] = None,
+) -> List[Stage]:
+    """
+    Declares the stages of the pipeline, from the PST files to the exported and loaded tables.
+
+    Extraction and preprocessing run in sequence. Once spam is filtered out, the categories,
+    products, entities, summaries and derived tables only depend on the remaining messages,
+    so they run concurrently, within the gpu and llm resource limits.
+
+    Args:
+        config (Config): The pipeline configuration.
+        data_dir (str): The data directory, holding the checkpoints and stage cache.
+        messages_path (Optional[str]): A CSV or Parquet file of messages to start from instead of
+            extracting the PST files of config.pst_directory.
+        use_regex_entities (bool): Whether to extract entities with regexes rather than the LLM.
+        load (bool): Whether to load the tables into the database.
+        num_processes (Optional[int]): The number of worker processes of the extraction, cleaning
+            and language stages, defaults to the CPU count.
+
+    Returns:
+        List[Stage]: The stages.
+    """
+    for directory in ["checkpoints", "interim"]:
+        os.makedirs(f"{data_dir}/{directory}", exist_ok=True)
+    checkpointer = DataFrameCheckpointer(f"{data_dir}/checkpoints")
+    stage_cache = StageCache(f"{data_dir}/stage_cache")
+    date = datetime.datetime.now().strftime("%Y-%m-%d")
+
+    def extract(inputs: Dict[str, Any]) -> pd.DataFrame:
+        if messages_path:
+            logging.info(f"Reading messages from {messages_path}")
+            if messages_path.endswith(".parquet"):
+                return pd.read_parquet(messages_path)
+            return pd.read_csv(messages_path)
+
+        from src.extract.pst_extractor import PSTExtractor
+
+        pst_file_paths = glob.glob(os.path.join(config.pst_directory, "**", "*.pst"), recursive=True)
+        logging.info(f"Extracting {len(pst_file_paths)} PST files from {config.pst_directory}")
+        pst_extractor = PSTExtractor(
+            pst_file_paths,
+            num_processes=num_processes,
+            fill_missing_data=True,
+            internal_domains=config.internal_domains,
+            html_cache_path=f"{data_dir}/interim/html_text_cache.json",
+        )
+        checkpointer.save("ingested_messages", pst_extractor.message_df)
+        return pst_extractor.message_df
+
+    def clean_text(inputs: Dict[str, Any]) -> pd.DataFrame:
+        message_df = inputs["extract"].copy()
+        message_df["clean_text"] = stage_cache.run_series(
+            "clean_text", clean_texts, message_df["plain_text_body"], num_processes=num_processes
+        )
+        return message_df
+
+    def language(inputs: Dict[str, Any]) -> pd.DataFrame:
+        message_df = inputs["clean_text"].copy()
+        message_df["language"] = stage_cache.run_series(
+            "language", get_languages, message_df["clean_text"], model_name="langid", num_processes=num_processes
+        )
+        return message_df
+
+    def response_time(inputs: Dict[str, Any]) -> pd.DataFrame:
+        message_df = get_response_time(inputs["language"])
+        checkpointer.save("preprocessed_messages", message_df)
+        return message_df
+
+    def llm(inputs: Dict[str, Any]) -> Any:
+        from src.transform.llm_invoker import LLMInvoker
+
+        return LLMInvoker(model_name=config.llm_model_name, use_ollama=config.use_ollama)
+
+    def spam(inputs: Dict[str, Any]) -> pd.DataFrame:
+        from src.transform.spam_classification import zero_shot_classify_spam_messages
+
+        message_df = inputs["response_time"].drop_duplicates(subset=["message_id"])
+        spam_df = stage_cache.run(
+            "spam", zero_shot_classify_spam_messages, message_df, model_name=ZERO_SHOT_MODEL_NAME
+        )
+        message_df = message_df.drop(columns="is_spam", errors="ignore").merge(spam_df, on="message_id")
+        message_df = message_df.loc[~message_df["is_spam"].astype(bool)].reset_index(drop=True)
+        message_df["topic_id"] = -1
+        checkpointer.save("spam_classified_messages", message_df)
+        return message_df
+
+    def categories(inputs: Dict[str, Any]) -> pd.DataFrame:
+        from src.transform.message_classification import classify_categories
+
+        return stage_cache.run("categories", classify_categories, inputs["spam"], model_name=ZERO_SHOT_MODEL_NAME)
+
+    def products(inputs: Dict[str, Any]) -> pd.DataFrame:
+        from src.transform.product_classification import classify_products
+
+        return stage_cache.run("products", classify_products, inputs["spam"], model_name=ZERO_SHOT_MODEL_NAME)
+
+    def entities(inputs: Dict[str, Any]) -> pd.DataFrame:
+        from src.transform.ner import extract_entities_from_messages
+
+        return stage_cache.run(
+            "entities",
+            extract_entities_from_messages,
+            inputs["spam"],
+            inputs.get("llm"),
+            params={"use_regex": use_regex_entities},
+        )
+
+    def summaries(inputs: Dict[str, Any]) -> pd.DataFrame:
+        from src.transform.email_summary import summarize_messages
+
+        return stage_cache.run("summaries", summarize_messages, inputs["spam"], inputs["llm"])
+
+    def tables(inputs: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
+        message_df = inputs["spam"]
+        return {
+            "addresses": create_address_df(message_df),
+            "references": create_reference_df(message_df),
+            "domains": create_domain_df(message_df),
+        }
+
+    def export(inputs: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
+        table_dfs = {
+            "messages": inputs["spam"],
+            **inputs["tables"],
+            "classifications": inputs["categories"],
+            "products": inputs["products"],
+            "entities": inputs["entities"],
+            "summaries": inputs["summaries"],
+        }
+        os.makedirs(config.output_directory, exist_ok=True)
+        for table_name, table_df in table_dfs.items():
+            table_df.to_csv(os.path.join(config.output_directory, f"{table_name}_{date}.csv"), index=False)
+        logging.info(f"Exported {len(table_dfs)} tables to {config.output_directory}")
+        return table_dfs
+
+    def load_tables(inputs: Dict[str, Any]) -> None:
+        from src.database.database import Database
+        from src.load.data_loader import DataLoader
+
+        database = Database.from_credentials(
+            username=config.db_user, password=config.db_password, host=config.db_host, database=config.db_name
+        )
+        loader = DataLoader(database)
+        for table_name, table_df in inputs["export"].items():
+            loader.load_dataframe(table_df.replace({np.nan: None}), table_name)
+
+    llm_dependencies = () if use_regex_entities else ("llm",)
+    stages = [
+        Stage("extract", extract),
+        Stage("clean_text", clean_text, ("extract",)),
+        Stage("language", language, ("clean_text",)),
+        Stage("response_time", response_time, ("language",)),
+        Stage("llm", llm),
+        Stage("spam", spam, ("response_time",), resources=(("gpu", 1),)),
+        Stage("categories", categories, ("spam",), resources=(("gpu", 1),)),
+        Stage("products", products, ("spam",), resources=(("gpu", 1),)),
+        Stage("entities", entities, ("spam", *llm_dependencies), resources=(("llm", 1),) if llm_dependencies else ()),
+        Stage("summaries", summaries, ("spam", "llm"), resources=(("llm", 1),)),
+        Stage("tables", tables, ("spam",)),
+        Stage("export", export, ("spam", *TABLE_STAGES)),
+    ]
+    if load:
+        stages.append(Stage("load", load_tables, ("export",), resources=(("database", 1),)))
+    return stages
@@ -0,0 +1,127 @@
+import logging
+import multiprocessing as mp
+import re
+from typing import Dict, List, Optional
+
+import pandas as pd
+from langid.langid import LanguageIdentifier, model
+from tqdm import tqdm
+
+# Characters classified from the start of each text; the language rarely changes further in
+LANGUAGE_PREFIX_LENGTH = 1000
+
+# Share of the letters of a text in Arabic script above which it is Arabic without running langid
+ARABIC_SCRIPT_THRESHOLD = 0.9
+
+# Languages langid mistakes short English texts for
+LANGUAGE_CORRECTIONS = {"la": "en", "qu": "en"}
+
+# Texts per task when identifying languages across processes
+LANGUAGE_CHUNK_SIZE = 1000
+
+# Below this many new texts, classifying them in this process costs less than starting the
+# pool, whose workers each load the langid model
+MIN_POOL_TEXTS = 10_000
+
+ARABIC_LETTERS = re.compile(r"[\u0621-\u064A\u0671-\u06D3\u0750-\u077F\uFB50-\uFDFF\uFE70-\uFEFC]")
+LATIN_LETTERS = re.compile(r"[A-Za-z\u00C0-\u024F]")
+# Letters of Persian and Urdu, which share the Arabic script but not the language
+NON_ARABIC_LETTERS = re.compile(r"[\u0679\u067E\u0686\u0688\u0691\u0698\u06A9\u06AF\u06BA\u06BE\u06CC\u06D2]")
+
+_identifier: Optional[LanguageIdentifier] = None
+
+
+def _get_identifier() -> LanguageIdentifier:
+    """Loads the langid model once per process, on first use."""
+    global _identifier
+    if _identifier is None:
+        _identifier = LanguageIdentifier.from_modelstring(model, norm_probs=False)
+    return _identifier
+
+
+def identify_language(text: str) -> str:
+    """
+    Identifies the language of a text from its first LANGUAGE_PREFIX_LENGTH characters.
+
+    Texts written almost entirely in Arabic script are Arabic without running langid, and
+    the others are classified once.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The ISO 639-1 code of the language.
+    """
+    prefix = text[:LANGUAGE_PREFIX_LENGTH]
+    arabic_letters = len(ARABIC_LETTERS.findall(prefix))
+    if arabic_letters:
+        latin_letters = len(LATIN_LETTERS.findall(prefix))
+        is_arabic_script = arabic_letters >= ARABIC_SCRIPT_THRESHOLD * (arabic_letters + latin_letters)
+        if is_arabic_script and not NON_ARABIC_LETTERS.search(prefix):
+            return "ar"
+    language = _get_identifier().classify(prefix)[0]
+    return LANGUAGE_CORRECTIONS.get(language, language)
+
+
+def _identify_languages(texts: List[str]) -> List[str]:
+    """Identifies the language of a list of texts, the unit of work of the process pool."""
+    return [identify_language(text) for text in texts]
+
+
+class LanguageCache:
+    """
+    The language identified for each text prefix, keyed by a 64-bit hash of the prefix.
+
+    Attributes:
+        languages (Dict[int, str]): The language of each prefix hash.
+        hits (int): The number of texts whose language was already known.
+        misses (int): The number of texts classified.
+    """
+
+    def __init__(self):
+        """Initializes an empty cache."""
+        self.languages: Dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def identify(
+        self, texts: pd.Series, num_processes: Optional[int] = None, chunk_size: int = LANGUAGE_CHUNK_SIZE
+    ) -> pd.Series:
+        """
+        Identifies the language of a Series of texts, classifying each distinct prefix once,
+        and the new ones in chunks across a process pool when there are at least
+        MIN_POOL_TEXTS of them.
+
+        Args:
+            texts (pd.Series): The texts, nulls being treated as empty texts.
+            num_processes (Optional[int]): The number of worker processes, defaults to and is
+                capped at the CPU count, since extra workers only add overhead.
+            chunk_size (int): The number of texts per task.
+
+        Returns:
+            pd.Series: The language of each text, with the index of texts.
+        """
+        prefixes = texts.fillna("").astype(str).str.slice(0, LANGUAGE_PREFIX_LENGTH)
+        hashes = pd.util.hash_pandas_object(prefixes, index=False).tolist()
+        is_first = ~pd.Series(hashes).duplicated().to_numpy()
+        missing = [i for i in is_first.nonzero()[0] if hashes[i] not in self.languages]
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        logging.info(f"Identifying the language of {len(missing)} texts, {len(texts) - len(missing)} were known")
+
+        missing_prefixes = prefixes.to_numpy()[missing].tolist()
+        chunks = [missing_prefixes[start : start + chunk_size] for start in range(0, len(missing), chunk_size)]
+        num_processes = min(num_processes or mp.cpu_count(), mp.cpu_count())
+        if num_processes > 1 and len(chunks) > 1 and len(missing) >= MIN_POOL_TEXTS:
+            # Each spawned worker loads the model once, on its first chunk
+            with mp.get_context("spawn").Pool(processes=min(num_processes, len(chunks))) as pool:
+                languages = list(tqdm(pool.imap(_identify_languages, chunks), total=len(chunks)))
+        else:
+            languages = [_identify_languages(chunk) for chunk in tqdm(chunks, disable=len(chunks) <= 1)]
+        missing_languages = (language for chunk in languages for language in chunk)
+        self.languages.update(zip((hashes[i] for i in missing), missing_languages))
+
+        return pd.Series([self.languages[text_hash] for text_hash in hashes], index=texts.index, dtype=object)
+
+
+default_language_cache = LanguageCache()
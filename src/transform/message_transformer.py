@@ -1,17 +1,16 @@
-import re
-from datetime import datetime
 from typing import Dict, List, Optional, Union
 
 # import nltk
+import numpy as np
 import pandas as pd
-from langid.langid import LanguageIdentifier, model
 from tqdm import tqdm
 
+from src.transform.language_id import default_language_cache, identify_language
+from src.transform.text_cleaning import default_cleaner
+
 # from nltk.corpus import stopwords
 # from nltk.stem import PorterStemmer, WordNetLemmatizer
 
-identifier = LanguageIdentifier.from_modelstring(model, norm_probs=False)
-
 # nltk.download("punkt")
 # nltk.download("punkt_tab")
 # nltk.download("wordnet")
@@ -24,16 +23,32 @@ def get_language(message: str) -> Optional[str]:
     """
     Identify the language of the given message.
 
+    The message is classified once, from its first characters, and messages written almost entirely in Arabic script
+    skip the classifier. Use get_languages to identify the language of a whole Series.
+
     Args:
     message (str): The string message to identify the language from.
 
     Returns:
     Optional[str]: The identified language code or None if the language could not be identified.
     """
-    language = identifier.classify(message)[0]
-    if language in ["la", "qu"]:
-        return "en"
-    return identifier.classify(message)[0]
+    return identify_language(message)
+
+
+def get_languages(messages: pd.Series, num_processes: Optional[int] = None) -> pd.Series:
+    """
+    Identify the language of a Series of messages like get_language, classifying each distinct message once and the
+    new ones in chunks across a process pool when there are enough of them. Languages are cached by text hash for the
+    rest of the session.
+
+    Args:
+    messages (pd.Series): The string messages to identify the language from.
+    num_processes (Optional[int]): The number of worker processes, defaults to the CPU count.
+
+    Returns:
+    pd.Series: The identified language codes, with the index of messages.
+    """
+    return default_language_cache.identify(messages, num_processes)
 
 
 def get_response_time(df: pd.DataFrame) -> pd.DataFrame:
@@ -42,32 +57,97 @@ def get_response_time(df: pd.DataFrame) -> pd.DataFrame:
 
     This function takes a dataframe and adds a new column "response_time" which contains the time difference in seconds
     between the submit time of the current message and the submit time of the previous message of the same thread.
+    The previous messages are looked up with a single indexed join: both identifier columns are coded together so that
+    each message_id maps to the row of its first message, and the submit times are converted to UTC once.
 
     Args:
     df (pd.DataFrame): Dataframe containing the messages.
 
     Returns:
-    pd.DataFrame: Dataframe with the added "response_time" column.
+    pd.DataFrame: Dataframe with the added "response_time" column, None where the previous message is unknown.
     """
-    df["response_time"] = None
-    for index, row in tqdm(df.iterrows(), total=len(df)):
-        previous_message_id = row["previous_message_id"]
-        if previous_message_id:
-            previous_row = df.loc[df["message_id"] == previous_message_id]
-            if len(previous_row) > 0:
-                previous_submit_time = datetime.fromisoformat(str(previous_row["submit_time"].iloc[0]))
-                current_submit_time = datetime.fromisoformat(str(row["submit_time"]))
-                response_time = (current_submit_time - previous_submit_time).total_seconds()
-                df.at[index, "response_time"] = response_time
+    row_count = len(df)
+    codes, uniques = pd.factorize(np.concatenate([df["message_id"].to_numpy(), df["previous_message_id"].to_numpy()]))
+    own_codes, previous_codes = codes[:row_count], codes[row_count:]
+
+    # Rows are assigned in reverse so the first row of a duplicated message_id wins
+    row_of_code = np.full(len(uniques) + 1, -1, dtype=np.int64)
+    rows = np.arange(row_count)[own_codes >= 0][::-1]
+    row_of_code[own_codes[rows]] = rows
+    previous_rows = row_of_code[previous_codes]
+
+    submit_times = pd.to_datetime(df["submit_time"], utc=True, errors="coerce").dt.tz_localize(None).to_numpy()
+    previous_submit_times = np.where(previous_rows >= 0, submit_times[previous_rows], np.datetime64("NaT"))
+    response_times = pd.Series((submit_times - previous_submit_times) / np.timedelta64(1, "s"), index=df.index)
+    df["response_time"] = response_times.astype(object).where(response_times.notna(), None)
     return df
 
 
+def get_thread_response_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate the response times of each thread.
+
+    Args:
+    df (pd.DataFrame): Dataframe containing the messages, with the "thread_id" column of parse_email_threading and the
+        "response_time" column of get_response_time.
+
+    Returns:
+    pd.DataFrame: Dataframe indexed by thread_id with "num_messages", "num_exchanges" (replies with a known response
+        time), "first_response_time" (seconds from the first message of the thread to the first reply) and
+        "median_response_time".
+    """
+    # Group on integer codes rather than the Message-ID strings of the thread roots
+    thread_codes, thread_ids = pd.factorize(df["thread_id"])
+    threads = pd.DataFrame(
+        {
+            "thread": thread_codes,
+            "submit_time": pd.to_datetime(df["submit_time"], utc=True, errors="coerce").dt.tz_localize(None).to_numpy(),
+            "response_time": pd.to_numeric(df["response_time"], errors="coerce").to_numpy(),
+        }
+    )
+    threads = threads[threads["thread"] >= 0].sort_values(["thread", "submit_time"], kind="stable")
+
+    # The first two messages of each thread by submit time give its first response time
+    position = threads.groupby("thread", sort=False).cumcount().to_numpy()
+    first_times = threads.loc[position == 0].set_index("thread")["submit_time"]
+    second_times = threads.loc[position == 1].set_index("thread")["submit_time"]
+
+    grouped = threads.groupby("thread")["response_time"]
+    stats = pd.DataFrame({"num_messages": grouped.size(), "num_exchanges": grouped.count()})
+    stats["first_response_time"] = (second_times - first_times.reindex(second_times.index)).dt.total_seconds()
+    stats["median_response_time"] = grouped.median()
+    stats.index = pd.Index(thread_ids[stats.index], name="thread_id")
+    return stats
+
+
+def get_response_time_percentiles(df: pd.DataFrame, by: str = "day") -> pd.DataFrame:
+    """
+    Calculate the p50, p90 and p99 response times per day or per value of a column, e.g. "topic_id".
+
+    Args:
+    df (pd.DataFrame): Dataframe containing the messages, with the "response_time" column of get_response_time.
+    by (str): "day" to group the replies by the UTC day of their submit time, or the name of a column to group by.
+
+    Returns:
+    pd.DataFrame: Dataframe indexed by day or column value with the "count", "p50", "p90" and "p99" response times in
+        seconds.
+    """
+    response_times = pd.to_numeric(df["response_time"], errors="coerce")
+    keys = pd.to_datetime(df["submit_time"], utc=True, errors="coerce").dt.floor("D") if by == "day" else df[by]
+    grouped = response_times.groupby(keys.rename(by))
+
+    percentiles = grouped.quantile([0.5, 0.9, 0.99]).unstack().reindex(columns=[0.5, 0.9, 0.99])
+    percentiles.columns = ["p50", "p90", "p99"]
+    percentiles.insert(0, "count", grouped.count())
+    return percentiles[percentiles["count"] > 0]
+
+
 def clean_text(text: Optional[str]) -> str:
     """
     Clean the given text by removing any signature blocks and unnecessary whitespace.
 
     This function takes a string and removes any signature blocks, unnecessary whitespace, and caution notes
-    that are commonly added to emails.
+    that are commonly added to emails. Use clean_texts to clean a whole Series.
 
     Args:
     text (str): The string to clean.
@@ -75,23 +155,18 @@ def clean_text(text: Optional[str]) -> str:
     Returns:
     str: The cleaned string.
     """
-    if not text or not isinstance(text, str):
-        return ""
-    parts = re.split(
-        r"^-- \n.*|^--\n.*|^-----Original Message-----.*$|^________________________________.*$|^On .* wrote:.*|^From: .*|^Sent from my iPhone.*$",
-        text,
-        flags=re.MULTILINE | re.DOTALL,
-        maxsplit=1,
-    )
+    return default_cleaner.clean(text)
 
-    text = parts[0].strip() if len(parts) > 1 else text
-    text = re.sub(r"[\n\r\t| -]+", " ", text, flags=re.MULTILINE)
-    caution_notes=[r"CAUTION: This email originated from outside QIB. Do not click any links or open attachments unless you are sure of the safety of the contents.",
-                 r"""CAUTION: This email originated from outside of the organization. Do not click links or open attachments unless you recognize the sender and know the content is safe"""]
-    for caution_note in caution_notes:
-        text = re.sub(caution_note, "", text)
 
-    # Remove any lines that are just whitespace
-    text = "\n".join([line for line in text.split("\n") if line.strip()])
+def clean_texts(texts: pd.Series, num_processes: Optional[int] = None) -> pd.Series:
+    """
+    Clean a Series of texts like clean_text, in chunks across a process pool.
 
-    return text
\ No newline at end of file
+    Args:
+    texts (pd.Series): The strings to clean.
+    num_processes (Optional[int]): The number of worker processes, defaults to the CPU count.
+
+    Returns:
+    pd.Series: The cleaned strings, with the index of texts.
+    """
+    return default_cleaner.clean_series(texts, num_processes)
@@ -0,0 +1,113 @@
+import multiprocessing as mp
+import re
+from typing import List, Optional, Sequence
+
+import pandas as pd
+from tqdm import tqdm
+
+# Regexes matching the start of a line that begins a signature; the text from there on is dropped
+SIGNATURE_MARKERS = [r"-- \n", r"--\n", r"Sent from my iPhone"]
+
+# Regexes matching the start of a line that begins a quoted reply or forward; the text from there on is dropped
+QUOTE_MARKERS = [r"-----Original Message-----", r"________________________________", r"On .* wrote:", r"From: "]
+
+# Disclaimers removed wherever they appear, after whitespace is collapsed
+DISCLAIMERS = [
+    "CAUTION: This email originated from outside QIB. Do not click any links or open attachments unless you are sure "
+    "of the safety of the contents.",
+    "CAUTION: This email originated from outside of the organization. Do not click links or open attachments unless "
+    "you recognize the sender and know the content is safe",
+]
+
+# Texts per task when cleaning across processes
+CLEAN_CHUNK_SIZE = 2000
+
+
+class TextCleaner:
+    """
+    Cleans email bodies by cutting them at the first signature or quote marker, collapsing
+    whitespace, pipes and dashes, and removing disclaimers.
+
+    The markers are combined into a single pattern compiled once, the disclaimers into
+    another that only runs when the text contains the first word of one of them.
+
+    Attributes:
+        cut_pattern (re.Pattern): The combined signature and quote markers, anchored at line starts.
+        whitespace_pattern (re.Pattern): The runs of whitespace, pipes and dashes collapsed to a space.
+        disclaimer_pattern (Optional[re.Pattern]): The combined disclaimers, or None if there are none.
+        disclaimer_prefixes (List[str]): The first word of each disclaimer, checked before searching for them.
+    """
+
+    def __init__(
+        self,
+        signature_markers: Sequence[str] = SIGNATURE_MARKERS,
+        quote_markers: Sequence[str] = QUOTE_MARKERS,
+        disclaimers: Sequence[str] = DISCLAIMERS,
+    ):
+        """
+        Initializes the TextCleaner, compiling its patterns.
+
+        Args:
+            signature_markers (Sequence[str]): Regexes matching the start of a line that begins a signature.
+            quote_markers (Sequence[str]): Regexes matching the start of a line that begins a quoted message.
+            disclaimers (Sequence[str]): Disclaimers to remove, as plain text with single spaces.
+        """
+        markers = [*signature_markers, *quote_markers]
+        self.cut_pattern = re.compile("^(?:" + "|".join(markers) + ")", flags=re.MULTILINE | re.DOTALL)
+        # Single spaces, most of any text, are left alone rather than replaced by themselves
+        self.whitespace_pattern = re.compile(r"[\n\r\t| -]{2,}|[\n\r\t|-]")
+        self.disclaimer_pattern = (
+            re.compile("|".join(re.escape(disclaimer) for disclaimer in disclaimers)) if disclaimers else None
+        )
+        self.disclaimer_prefixes: List[str] = sorted({disclaimer.split(" ")[0] for disclaimer in disclaimers})
+
+    def clean(self, text: Optional[str]) -> str:
+        """
+        Cleans a text.
+
+        Args:
+            text (Optional[str]): The text to clean.
+
+        Returns:
+            str: The cleaned text, empty for missing or blank texts.
+        """
+        if not text or not isinstance(text, str):
+            return ""
+        cut = self.cut_pattern.search(text)
+        if cut:
+            text = text[: cut.start()].strip()
+        text = self.whitespace_pattern.sub(" ", text)
+        if self.disclaimer_pattern and any(prefix in text for prefix in self.disclaimer_prefixes):
+            text = self.disclaimer_pattern.sub("", text)
+        return text if text.strip() else ""
+
+    def clean_list(self, texts: List[Optional[str]]) -> List[str]:
+        """Cleans a list of texts, the unit of work of the process pool."""
+        return [self.clean(text) for text in texts]
+
+    def clean_series(
+        self, texts: pd.Series, num_processes: Optional[int] = None, chunk_size: int = CLEAN_CHUNK_SIZE
+    ) -> pd.Series:
+        """
+        Cleans a Series of texts in chunks across a process pool.
+
+        Args:
+            texts (pd.Series): The texts to clean.
+            num_processes (Optional[int]): The number of worker processes, defaults to the CPU count.
+            chunk_size (int): The number of texts per task.
+
+        Returns:
+            pd.Series: The cleaned texts, with the index of texts.
+        """
+        values = texts.tolist()
+        chunks = [values[start : start + chunk_size] for start in range(0, len(values), chunk_size)]
+        num_processes = num_processes or mp.cpu_count()
+        if num_processes > 1 and len(chunks) > 1:
+            with mp.get_context("spawn").Pool(processes=min(num_processes, len(chunks))) as pool:
+                cleaned = list(tqdm(pool.imap(self.clean_list, chunks), total=len(chunks)))
+        else:
+            cleaned = [self.clean_list(chunk) for chunk in tqdm(chunks, disable=len(chunks) <= 1)]
+        return pd.Series([text for chunk in cleaned for text in chunk], index=texts.index, dtype=object)
+
+
+default_cleaner = TextCleaner()
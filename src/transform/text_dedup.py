@@ -0,0 +1,111 @@
+import logging
+import time
+from typing import Any, Callable, Dict
+
+import pandas as pd
+
+
+def normalize_texts(texts: pd.Series) -> pd.Series:
+    """
+    Normalizes texts for deduplication, casefolding them and collapsing their whitespace.
+
+    Args:
+        texts (pd.Series): The texts, nulls being treated as empty texts.
+
+    Returns:
+        pd.Series: The normalized texts.
+    """
+    return texts.fillna("").astype(str).str.replace(r"\s+", " ", regex=True).str.strip().str.casefold()
+
+
+def text_hashes(texts: pd.Series) -> pd.Series:
+    """
+    Hashes the normalized form of texts, so that texts differing only by case or whitespace
+    share a hash. The hashes are stable across runs.
+
+    Args:
+        texts (pd.Series): The texts.
+
+    Returns:
+        pd.Series: The 64-bit hash of each text, with the index of texts.
+    """
+    return pd.util.hash_pandas_object(normalize_texts(texts), index=False)
+
+
+class TextDeduplicator:
+    """
+    Runs expensive transform stages once per distinct normalized text.
+
+    Auto-replies, campaign spam and customers resending the same complaint share their
+    clean_text, so a stage only has to see the first message of each distinct text. Its
+    results are then fanned back out to every message_id with the same text.
+
+    Attributes:
+        column (str): The text column the stages read.
+        stats (Dict[str, Dict[str, float]]): The number of rows, distinct texts, dedup ratio and
+            seconds of each stage run.
+    """
+
+    def __init__(self, column: str = "clean_text"):
+        """
+        Initializes the TextDeduplicator.
+
+        Args:
+            column (str): The text column the stages read. Defaults to "clean_text".
+        """
+        self.column = column
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def run(
+        self, stage_name: str, stage: Callable[..., pd.DataFrame], df: pd.DataFrame, *args: Any, **kwargs: Any
+    ) -> pd.DataFrame:
+        """
+        Runs a stage on the first message of each distinct text and fans its results out.
+
+        Args:
+            stage_name (str): The name of the stage in the stats.
+            stage (Callable[..., pd.DataFrame]): The stage, taking a dataframe of messages and
+                returning a dataframe with a message_id column, with any number of rows per message.
+            df (pd.DataFrame): The dataframe of messages, with the message_id and text columns.
+            *args: The other positional arguments of the stage.
+            **kwargs: The keyword arguments of the stage.
+
+        Returns:
+            pd.DataFrame: The results of the stage for every message of df.
+        """
+        start_time = time.time()
+        hashes = text_hashes(df[self.column]).to_numpy()
+        is_first = ~pd.Series(hashes).duplicated().to_numpy()
+        unique_df = df.loc[is_first].copy()
+
+        result = stage(unique_df, *args, **kwargs)
+
+        # Each message takes the results of the first message with the same text
+        first_message_ids = pd.Series(unique_df["message_id"].to_numpy(), index=hashes[is_first])
+        members = pd.DataFrame(
+            {"message_id": df["message_id"].to_numpy(), "_first_message_id": first_message_ids[hashes].to_numpy()}
+        )
+        result = members.merge(
+            result.rename(columns={"message_id": "_first_message_id"}), on="_first_message_id", how="inner"
+        ).drop(columns="_first_message_id")
+
+        self.stats[stage_name] = {
+            "rows": len(df),
+            "unique_texts": int(is_first.sum()),
+            "dedup_ratio": 1 - is_first.sum() / len(df) if len(df) else 0.0,
+            "seconds": time.time() - start_time,
+        }
+        logging.info(f"{stage_name}: {self.format_stage_stats(stage_name)}")
+        return result
+
+    def format_stage_stats(self, stage_name: str) -> str:
+        """Formats the stats of a stage run, e.g. "1200 distinct texts of 5000 rows (76% deduplicated) in 3.2s"."""
+        stats = self.stats[stage_name]
+        return (
+            f"{stats['unique_texts']} distinct texts of {stats['rows']} rows "
+            f"({stats['dedup_ratio']:.0%} deduplicated) in {stats['seconds']:.1f}s"
+        )
+
+    def format_stats(self) -> str:
+        """Formats the stats of every stage run, one line per stage."""
+        return "\n".join(f"{stage_name}: {self.format_stage_stats(stage_name)}" for stage_name in self.stats)
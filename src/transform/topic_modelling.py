@@ -1,7 +1,7 @@
 import logging
 import re
 from collections import Counter
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -12,6 +12,7 @@ from sklearn.preprocessing import normalize
 from tqdm import tqdm
 from wordcloud import WordCloud
 
+from src.database.embedding_store import EmbeddingStore
 from src.transform.llm_invoker import LLMInvoker
 
 tqdm.pandas()
@@ -25,6 +26,7 @@ class TopicModellor:
         n_components_svd (int): Number of components for SVD.
         min_cluster_size (int): Minimum size for clusters.
         min_samples (int): Minimum number of samples per cluster.
+        embedding_store (Optional[EmbeddingStore]): The store the embeddings are read from, if any.
         topic_df (pd.DataFrame): The dataframe containing messages and their assigned topics.
     """
     def __init__(
@@ -34,6 +36,7 @@ class TopicModellor:
         n_components_svd: int = 50,
         min_cluster_size: int = 10,
         min_samples: int = 5,
+        embedding_store: Optional[EmbeddingStore] = None,
     ):
         """
         Initializes the TopicModellor with the provided dataframe and parameters.
@@ -44,10 +47,13 @@ class TopicModellor:
             n_components_svd (int): Number of components to use for dimensionality reduction.
             min_cluster_size (int): Minimum size for clusters.
             min_samples (int): Minimum number of samples per cluster.
+            embedding_store (Optional[EmbeddingStore]): The store to read the embeddings from.
+                Defaults to the "embeddings" column of message_df.
         """
         self.n_components_svd = n_components_svd
         self.min_cluster_size = min_cluster_size
         self.min_samples = min_samples
+        self.embedding_store = embedding_store
 
         logging.info("Clustering messages using HDBSCAN")
         self.topic_df = self.cluster_topics(message_df)[["message_id", "topic_id", "clean_text"]]
@@ -57,13 +63,17 @@ class TopicModellor:
         Clusters messages into topics using HDBSCAN and embeddings.
 
         Args:
-            message_df (pd.DataFrame): Dataframe containing messages and their embeddings.
+            message_df (pd.DataFrame): Dataframe containing messages, and their embeddings unless
+                they are read from the embedding store.
 
         Returns:
             pd.DataFrame: Dataframe with the topic ID assigned to each message.
         """
-        # Retrieve embeddings from embedding column in df
-        embeddings = message_df["embeddings"].tolist()
+        # Retrieve embeddings from the embedding store, or the embedding column in df
+        if self.embedding_store is not None:
+            embeddings = self.embedding_store.get(message_df["message_id"].tolist())
+        else:
+            embeddings = np.asarray(message_df["embeddings"].tolist(), dtype=np.float32)
 
         # Dimensionality reduction
         svd = TruncatedSVD(n_components=self.n_components_svd, random_state=42)
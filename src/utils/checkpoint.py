@@ -1,13 +1,26 @@
 import datetime
 import logging
 import os
+from typing import Any, List, Optional, Union
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows per Parquet row group; smaller groups let time filters skip more of a file
+ROW_GROUP_SIZE = 50_000
+
+CHECKPOINT_EXTENSIONS = (".parquet", ".csv")
 
 
 class DataFrameCheckpointer:
     """
     A utility class for saving and pulling dataframes to/from a checkpoint path.
+
+    Dataframes are saved as zstd-compressed Parquet files, which keep their dtypes (datetimes,
+    booleans, lists such as embeddings) and let pull read a subset of columns and skip the row
+    groups outside a submit_time range. CSV checkpoints written by earlier versions can still
+    be pulled, and save can also export a CSV copy.
     """
 
     def __init__(self, checkpoint_path: str) -> None:
@@ -20,32 +33,71 @@ class DataFrameCheckpointer:
         """
         self.checkpoint_path = checkpoint_path
 
-    def save(self, name: str, df: pd.DataFrame) -> None:
+    def save(self, name: str, df: pd.DataFrame, export_csv: bool = False) -> None:
         """
         Saves a dataframe to the checkpoint path with a given name.
 
         Args:
         name (str): The name of the dataframe to save.
         df (pd.DataFrame): The dataframe to save.
+        export_csv (bool): Whether to also write a CSV copy, e.g. for spreadsheets.
         """
-        df.to_csv(f"{self.checkpoint_path}/{name}.csv", index=False)
+        path = f"{self.checkpoint_path}/{name}.parquet"
+        temp_path = f"{path}.tmp"
+        pq.write_table(to_arrow_table(df), temp_path, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+        os.replace(temp_path, path)
+        if export_csv:
+            df.to_csv(f"{self.checkpoint_path}/{name}.csv", index=False)
         logging.info(f"Saved {name} to checkpoint")
 
-    def pull(self, name: str) -> pd.DataFrame:
+    def pull(
+        self,
+        name: str,
+        columns: Optional[List[str]] = None,
+        since: Optional[Union[datetime.datetime, str]] = None,
+        until: Optional[Union[datetime.datetime, str]] = None,
+        time_column: str = "submit_time",
+    ) -> pd.DataFrame:
         """
         Pulls a dataframe from the checkpoint path with a given name.
 
         Args:
         name (str): The name of the dataframe to pull.
+        columns (Optional[List[str]]): The columns to read, defaults to every column.
+        since (Optional[Union[datetime.datetime, str]]): The earliest time_column value to read, inclusive.
+        until (Optional[Union[datetime.datetime, str]]): The latest time_column value to read, exclusive.
+        time_column (str): The column since and until apply to.
 
         Returns:
         pd.DataFrame: The pulled dataframe, or None if no such dataframe exists.
         """
         logging.info(f"Pulling {name} from checkpoint")
-        if os.path.exists(f"{self.checkpoint_path}/{name}.csv"):
-            return pd.read_csv(f"{self.checkpoint_path}/{name}.csv")
-        else:
+        path = f"{self.checkpoint_path}/{name}.parquet"
+        if os.path.exists(path):
+            filters = self.time_filters(path, time_column, since, until)
+            return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+        csv_path = f"{self.checkpoint_path}/{name}.csv"
+        if not os.path.exists(csv_path):
             return None
+        is_time_filtered = since is not None or until is not None
+        # The time column is read for filtering even when columns leaves it out, as in Parquet
+        read_columns = columns
+        if is_time_filtered and columns is not None and time_column not in columns:
+            read_columns = [*columns, time_column]
+        df = pd.read_csv(csv_path, usecols=read_columns)
+        if is_time_filtered:
+            times = pd.to_datetime(df[time_column])
+            time_zone = times.dt.tz
+            in_range = pd.Series(True, index=df.index)
+            if since is not None:
+                in_range &= times >= match_time_zone(since, time_zone)
+            if until is not None:
+                in_range &= times < match_time_zone(until, time_zone)
+            df = df.loc[in_range]
+        if read_columns is not columns:
+            df = df.drop(columns=time_column)
+        return df
 
     def pull_latest(self) -> pd.DataFrame:
         """
@@ -55,13 +107,85 @@ class DataFrameCheckpointer:
         pd.DataFrame: The pulled dataframe, or None if no such dataframe exists.
         """
         logging.info("Pulling latest from checkpoint")
-        files = os.listdir(self.checkpoint_path)
-        files = [self.checkpoint_path + "/" + f for f in files if f.endswith(".csv")]
+        files = [f for f in os.listdir(self.checkpoint_path) if f.endswith(CHECKPOINT_EXTENSIONS)]
 
         if len(files) == 0:
             return None
         else:
-            latest_file = max(files, key=os.path.getctime)
+            latest_file = max(files, key=lambda f: os.path.getctime(f"{self.checkpoint_path}/{f}"))
             logging.info(f"Found latest file: {latest_file}")
-            return pd.read_csv(f"{self.checkpoint_path}/{latest_file}")
+            return self.pull(os.path.splitext(latest_file)[0])
+
+    @staticmethod
+    def time_filters(
+        path: str,
+        time_column: str,
+        since: Optional[Union[datetime.datetime, str]],
+        until: Optional[Union[datetime.datetime, str]],
+    ) -> List[tuple]:
+        """
+        Builds the Parquet filters selecting a time range, matching the time zone of the column.
+
+        Args:
+        path (str): The path to the Parquet file.
+        time_column (str): The column the range applies to.
+        since (Optional[Union[datetime.datetime, str]]): The earliest value, inclusive.
+        until (Optional[Union[datetime.datetime, str]]): The latest value, exclusive.
+
+        Returns:
+        List[tuple]: The filters, empty if neither bound is given.
+        """
+        if since is None and until is None:
+            return []
+        column_type = pq.read_schema(path).field(time_column).type
+        time_zone = getattr(column_type, "tz", None)
 
+        filters = []
+        if since is not None:
+            filters.append((time_column, ">=", match_time_zone(since, time_zone)))
+        if until is not None:
+            filters.append((time_column, "<", match_time_zone(until, time_zone)))
+        return filters
+
+
+def match_time_zone(value: Union[datetime.datetime, str], time_zone: Optional[Any]) -> pd.Timestamp:
+    """
+    Converts a time bound to a timestamp comparable with a column in the given time zone.
+
+    Args:
+    value (Union[datetime.datetime, str]): The time bound, naive bounds being in the time zone of the column.
+    time_zone (Optional[Any]): The time zone of the column, None for naive timestamps.
+
+    Returns:
+    pd.Timestamp: The timestamp, localized to time_zone, or made naive if it is None.
+    """
+    timestamp = pd.Timestamp(value)
+    if time_zone and timestamp.tzinfo is None:
+        return timestamp.tz_localize(time_zone)
+    if not time_zone and timestamp.tzinfo is not None:
+        return timestamp.tz_convert(None)
+    return timestamp
+
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Converts a dataframe to an Arrow table, storing object columns of mixed types as strings.
+
+    Args:
+    df (pd.DataFrame): The dataframe to convert.
+
+    Returns:
+    pa.Table: The Arrow table, without the index.
+    """
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            try:
+                pa.array(df[column], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                logging.warning(f"Storing the mixed types of column {column} as strings")
+                is_null = df[column].isna()
+                df[column] = df[column].astype(str).where(~is_null, None)
+        return pa.Table.from_pandas(df, preserve_index=False)
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.transform.text_dedup import text_hashes
+from src.utils.checkpoint import DataFrameCheckpointer
+
+ROW_KEY_COLUMN = "_row_key"
+
+
+def stage_fingerprint(
+    stage_name: str,
+    stage: Callable[..., Any],
+    input_columns: Sequence[str],
+    params: Optional[Dict[str, Any]] = None,
+    model_name: Optional[str] = None,
+    normalize: bool = False,
+) -> str:
+    """
+    Fingerprints what a stage computes, apart from its input rows.
+
+    Args:
+        stage_name (str): The name of the stage.
+        stage (Callable[..., Any]): The stage function.
+        input_columns (Sequence[str]): The columns the stage reads.
+        params (Optional[Dict[str, Any]]): The parameters changing the output of the stage.
+        model_name (Optional[str]): The model the stage runs, if any.
+        normalize (bool): Whether the rows are keyed by their normalized input texts.
+
+    Returns:
+        str: The first 16 hex digits of the SHA-1 of the fingerprinted values.
+    """
+    description = {
+        "stage_name": stage_name,
+        "stage": f"{stage.__module__}.{stage.__qualname__}",
+        "input_columns": list(input_columns),
+        "params": params or {},
+        "model_name": model_name,
+        "normalize": normalize,
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def row_keys(df: pd.DataFrame, input_columns: Sequence[str], normalize: bool = False) -> np.ndarray:
+    """
+    Hashes the input values of each row, so that rows with the same inputs share a key. The
+    keys are stable across runs.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        input_columns (Sequence[str]): The columns to hash.
+        normalize (bool): Whether to key the rows by the text hashes of TextDeduplicator, see
+            text_hashes, so that texts differing only by case or whitespace share a key.
+
+    Returns:
+        np.ndarray: The 64-bit key of each row.
+    """
+    if normalize:
+        hashes = pd.DataFrame({column: text_hashes(df[column]).to_numpy() for column in input_columns})
+        if len(hashes.columns) == 1:  # The same keys as TextDeduplicator
+            return hashes.iloc[:, 0].to_numpy()
+        return pd.util.hash_pandas_object(hashes, index=False).to_numpy()
+    inputs = df[list(input_columns)]
+    try:
+        return pd.util.hash_pandas_object(inputs, index=False).to_numpy()
+    except TypeError:  # Lists and arrays are not hashable, their text is
+        return pd.util.hash_pandas_object(inputs.astype(str), index=False).to_numpy()
+
+
+def _model_name_of(values: Sequence[Any]) -> Optional[str]:
+    """The model_name attribute of the first value having one, e.g. an LLMInvoker."""
+    for value in values:
+        model_name = getattr(value, "model_name", None)
+        if isinstance(model_name, str):
+            return model_name
+    return None
+
+
+class StageCache:
+    """
+    Stores the output of pipeline stages by content, so that a stage only computes the rows
+    whose input values it has not seen with the same parameters and model.
+
+    Each stage run is fingerprinted by its name, function, input columns, parameters and model
+    name, and its output rows are stored in a Parquet checkpoint named after the fingerprint,
+    keyed by a hash of the input values of the row they were computed from. A run then looks
+    the rows of the dataframe up by key, runs the stage once per distinct unknown key, and
+    adds the new outputs to the checkpoint. Changing a parameter or the model starts a new
+    checkpoint, while new or edited rows are the only ones computed otherwise.
+
+    By default the rows are keyed by the text hashes of TextDeduplicator, so that, as with
+    TextDeduplicator.run, auto-replies, campaign spam and resent complaints that only differ by
+    case or whitespace are computed once, and their outputs fanned out to every message_id
+    sharing the text.
+
+    Attributes:
+        checkpointer (DataFrameCheckpointer): The checkpointer of the stored outputs.
+        stats (Dict[str, Dict[str, float]]): The number of rows, distinct inputs, dedup ratio,
+            cached and computed inputs, and seconds of each stage run.
+    """
+
+    def __init__(self, cache_path: str) -> None:
+        """
+        Initializes the StageCache, creating its directory if needed.
+
+        Args:
+            cache_path (str): The path to the directory of the stored outputs.
+        """
+        os.makedirs(cache_path, exist_ok=True)
+        self.checkpointer = DataFrameCheckpointer(cache_path)
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def run(
+        self,
+        stage_name: str,
+        stage: Callable[..., pd.DataFrame],
+        df: pd.DataFrame,
+        *args: Any,
+        input_columns: Sequence[str] = ("clean_text",),
+        params: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None,
+        normalize: bool = True,
+        **kwargs: Any,
+    ) -> pd.DataFrame:
+        """
+        Runs a stage on the rows of df whose inputs have no stored output, and returns the
+        stored and new outputs of every row.
+
+        Args:
+            stage_name (str): The name of the stage, in the checkpoint names and the stats.
+            stage (Callable[..., pd.DataFrame]): The stage, taking a dataframe of messages and
+                returning a dataframe with a message_id column, with any number of rows per message.
+            df (pd.DataFrame): The dataframe of messages, with the message_id and input columns.
+            *args: The other positional arguments of the stage, not fingerprinted.
+            input_columns (Sequence[str]): The columns the output of the stage depends on.
+            params (Optional[Dict[str, Any]]): The keyword arguments of the stage changing its
+                output, which are fingerprinted and passed to the stage.
+            model_name (Optional[str]): The model the stage runs. Defaults to the model_name of
+                the first argument having one, e.g. an LLMInvoker.
+            normalize (bool): Whether rows whose input texts only differ by case or whitespace
+                share their output.
+            **kwargs: The other keyword arguments of the stage, not fingerprinted.
+
+        Returns:
+            pd.DataFrame: The outputs of the stage for every message of df, in the order of df.
+        """
+        start_time = time.time()
+        params = params or {}
+        if model_name is None:
+            model_name = _model_name_of([*args, *kwargs.values()])
+        fingerprint = stage_fingerprint(stage_name, stage, input_columns, params, model_name, normalize)
+        name = f"{stage_name}-{fingerprint}"
+
+        keys = row_keys(df, input_columns, normalize)
+        is_first = ~pd.Series(keys).duplicated().to_numpy()
+        stored_keys = self.checkpointer.pull(f"{name}-keys")
+        known_keys = np.empty(0, dtype=np.uint64) if stored_keys is None else stored_keys[ROW_KEY_COLUMN].to_numpy()
+        is_missing = is_first & ~np.isin(keys, known_keys)
+        outputs = self.checkpointer.pull(name)
+        if outputs is None:
+            outputs = pd.DataFrame({ROW_KEY_COLUMN: np.empty(0, dtype=np.uint64)})
+
+        if is_missing.any():
+            missing_df = df.loc[is_missing].copy()
+            logging.info(f"{stage_name}: computing {len(missing_df)} new inputs, {len(known_keys)} are stored")
+            result = stage(missing_df, *args, **params, **kwargs)
+            missing_keys = pd.DataFrame(
+                {"message_id": missing_df["message_id"].to_numpy(), ROW_KEY_COLUMN: keys[is_missing]}
+            )
+            new_outputs = missing_keys.merge(result, on="message_id", how="inner").drop(columns="message_id")
+            outputs = pd.concat([outputs, new_outputs], ignore_index=True) if len(outputs) else new_outputs
+            known_keys = np.concatenate([known_keys, keys[is_missing]])
+            self.checkpointer.save(name, outputs)
+            self.checkpointer.save(f"{name}-keys", pd.DataFrame({ROW_KEY_COLUMN: known_keys}))
+
+        members = pd.DataFrame({"message_id": df["message_id"].to_numpy(), ROW_KEY_COLUMN: keys})
+        result = members.merge(outputs, on=ROW_KEY_COLUMN, how="inner").drop(columns=ROW_KEY_COLUMN)
+
+        self.stats[stage_name] = {
+            "rows": len(df),
+            "unique_inputs": int(is_first.sum()),
+            "dedup_ratio": 1 - is_first.sum() / len(df) if len(df) else 0.0,
+            "computed": int(is_missing.sum()),
+            "cached": int(is_first.sum() - is_missing.sum()),
+            "seconds": time.time() - start_time,
+        }
+        logging.info(f"{stage_name}: {self.format_stage_stats(stage_name)}")
+        return result
+
+    def run_series(
+        self,
+        stage_name: str,
+        stage: Callable[..., pd.Series],
+        values: pd.Series,
+        *args: Any,
+        params: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None,
+        **kwargs: Any,
+    ) -> pd.Series:
+        """
+        Runs a stage mapping a Series to a Series of the same length, e.g. clean_texts or
+        get_languages, on the values without a stored output. The values are keyed exactly,
+        since the output of such stages depends on their case and whitespace.
+
+        Args:
+            stage_name (str): The name of the stage, in the checkpoint names and the stats.
+            stage (Callable[..., pd.Series]): The stage, returning one output per value.
+            values (pd.Series): The values, e.g. the clean_text column.
+            *args: The other positional arguments of the stage, not fingerprinted.
+            params (Optional[Dict[str, Any]]): The keyword arguments of the stage changing its
+                output, which are fingerprinted and passed to the stage.
+            model_name (Optional[str]): The model the stage runs, if any.
+            **kwargs: The other keyword arguments of the stage, not fingerprinted.
+
+        Returns:
+            pd.Series: The output for each value, with the index and name of values.
+        """
+        column = values.name if values.name is not None else "value"
+
+        def _frame_stage(frame: pd.DataFrame, *stage_args: Any, **stage_kwargs: Any) -> pd.DataFrame:
+            output = stage(frame[column], *stage_args, **stage_kwargs)
+            return pd.DataFrame({"message_id": frame["message_id"].to_numpy(), "output": list(output)})
+
+        _frame_stage.__module__ = stage.__module__
+        _frame_stage.__qualname__ = stage.__qualname__
+        frame = pd.DataFrame({"message_id": np.arange(len(values)), column: values.to_numpy()})
+        result = self.run(
+            stage_name,
+            _frame_stage,
+            frame,
+            *args,
+            input_columns=[column],
+            params=params,
+            model_name=model_name,
+            normalize=False,
+            **kwargs,
+        )
+        output = result.set_index("message_id")["output"].reindex(frame["message_id"])
+        return pd.Series(output.to_numpy(), index=values.index, name=values.name, dtype=object)
+
+    def format_stage_stats(self, stage_name: str) -> str:
+        """
+        Formats the stats of a stage run, e.g.
+        "5000 rows, 1200 distinct inputs (76% deduplicated), 24 computed in 3.2s".
+        """
+        stats = self.stats[stage_name]
+        return (
+            f"{stats['rows']} rows, {stats['unique_inputs']} distinct inputs "
+            f"({stats['dedup_ratio']:.0%} deduplicated), {stats['computed']} computed in {stats['seconds']:.1f}s"
+        )
+
+    def format_stats(self) -> str:
+        """Formats the stats of every stage run, one line per stage."""
+        return "\n".join(f"{stage_name}: {self.format_stage_stats(stage_name)}" for stage_name in self.stats)